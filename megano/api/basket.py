@@ -0,0 +1,85 @@
+from django.db import transaction
+
+from shopapp.models import Basket, Item, Order
+
+
+class SessionBasket:
+    """
+    Basket of an anonymous visitor, kept in the session as ``{item id: quantity}``.
+    Nothing is written to the shop tables until the visitor logs in and
+    ``merge_into()`` moves the lines into their active order.
+    """
+    session_key = 'basket'
+
+    def __init__(self, session):
+        self.session = session
+
+    @property
+    def lines(self) -> dict:
+        return self.session.get(self.session_key, {})
+
+    def save(self, lines):
+        if lines:
+            self.session[self.session_key] = lines
+        else:
+            self.session.pop(self.session_key, None)
+
+    def add(self, item_id, count) -> bool:
+        """Add ``count`` pieces; returns whether the item was not in the basket yet."""
+        lines = dict(self.lines)
+        key = str(item_id)
+        created = key not in lines
+        lines[key] = lines.get(key, 0) + count
+        self.save(lines)
+        return created
+
+    def remove(self, item_id, count):
+        """Same contract as ``Basket.objects.remove_item``: returns 'update', 'remove' or None."""
+        lines = dict(self.lines)
+        key = str(item_id)
+        if key not in lines:
+            return None
+        if lines[key] > count:
+            lines[key] -= count
+            action = 'update'
+        else:
+            del lines[key]
+            action = 'remove'
+        self.save(lines)
+        return action
+
+    def apply_changes(self, changes):
+        """Same contract as ``Basket.objects.apply_changes``."""
+        lines = dict(self.lines)
+        actions = {}
+        for item_id, change in changes.items():
+            key = str(item_id)
+            quantity = lines.get(key, 0) + change
+            if quantity > 0:
+                actions[item_id] = 'update' if key in lines else 'add'
+                lines[key] = quantity
+            elif key in lines:
+                actions[item_id] = 'remove'
+                del lines[key]
+        self.save(lines)
+        return actions
+
+    def get_lines(self, queryset=None):
+        """Unsaved Basket rows for BasketItemSerializer, their items loaded in one go."""
+        lines = self.lines
+        if not lines:
+            return []
+        queryset = Item.objects.for_listing() if queryset is None else queryset
+        items = queryset.in_bulk([int(pk) for pk in lines])
+        return [Basket(item=items[int(pk)], quantity=quantity) for pk, quantity in lines.items() if int(pk) in items]
+
+    def merge_into(self, customer):
+        """Add the session lines to the customer's active order and empty the session basket."""
+        lines = self.get_lines(Item.objects.all())
+        if lines:
+            with transaction.atomic():
+                order = Order.objects.get_active(customer, create=True)
+                for line in lines:
+                    Basket.objects.add_item(order, line.item, line.quantity)
+        self.save({})
+        return len(lines)
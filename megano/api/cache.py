@@ -0,0 +1,77 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from shopapp.cache import get_timeout, get_version
+
+from .metrics import cache_requests
+
+LOCK_TIMEOUT = 10
+LOCK_POLL_INTERVAL = 0.05
+
+missing = object()
+
+
+def record(name: str, event: str) -> None:
+    cache_requests.inc(name=name, result=event)
+
+
+def cache_stats() -> dict:
+    """Per-name hit/miss counters of this process: ``{name: {'hit': n, 'miss': n}}``."""
+    result = {}
+    for labels, count in cache_requests.items():
+        result.setdefault(labels['name'], {'hit': 0, 'miss': 0})[labels['result']] = count
+    return result
+
+
+def get_or_build(namespace: str, name: str, key: str, build, timeout=missing):
+    """
+    Return the cached value of ``build()``, computing it at most once per
+    version under concurrent misses: the first caller takes a lock in the
+    cache and builds, the others poll until the value appears. A caller that
+    waits longer than LOCK_TIMEOUT builds the value itself.
+    """
+    if timeout is missing:
+        timeout = get_timeout(name)
+    digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+    cache_key = f'api:{namespace}:{get_version(namespace)}:{name}:{digest}'
+    value = cache.get(cache_key, missing)
+    if value is not missing:
+        record(name, 'hit')
+        return value
+
+    lock_key = f'{cache_key}:lock'
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+    while not locked and time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        value = cache.get(cache_key, missing)
+        if value is not missing:
+            record(name, 'hit')
+            return value
+        locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+
+    record(name, 'miss')
+    try:
+        value = build()
+        cache.set(cache_key, value, timeout)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return value
+
+
+class CachedResponseMixin:
+    """
+    Caches the response data of a view that does not depend on the user.
+    ``cache_name`` selects the timeout in ``settings.API_CACHE_TIMEOUTS``;
+    everything cached under ``cache_namespace`` is dropped when it is bumped.
+    Entries are keyed on the path only, so query parameters (paging, cache-busting
+    ``?_=<timestamp>``) never add entries: a view that reads one applies it to the
+    cached data.
+    """
+    cache_namespace = 'feeds'
+    cache_name = None
+
+    def get_cached_data(self, request, build):
+        return get_or_build(self.cache_namespace, self.cache_name, request.path, build)
@@ -0,0 +1,253 @@
+"""
+A small Prometheus-compatible metrics registry.
+
+Metrics are kept in memory per process. When ``settings.METRICS_DIR`` is set,
+every process also dumps its values to ``<METRICS_DIR>/<pid>.json`` (at most
+once per FLUSH_INTERVAL and at exit), and ``/metrics`` sums the files of all
+processes, so the numbers are right under a pre-forking server such as
+gunicorn. Counters are cumulative: clear the directory when the server is
+restarted, not when a worker is recycled.
+
+``/metrics`` answers staff users, and scrapers that send
+``Authorization: Bearer <settings.METRICS_TOKEN>``; everyone else gets a 403.
+"""
+import atexit
+import hmac
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+FLUSH_INTERVAL = 1.0
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_value(value) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def format_labels(labels) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def label_key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.label_key(labels)
+        with self.registry.lock:
+            values = self.registry.values_of(self)
+            values[key] = values.get(key, 0) + amount
+        self.registry.changed()
+
+    def get(self, **labels):
+        """This process' value."""
+        with self.registry.lock:
+            return self.registry.values_of(self).get(self.label_key(labels), 0)
+
+    def items(self):
+        """This process' values as ``(labels, value)`` pairs."""
+        with self.registry.lock:
+            return [(dict(key), value) for key, value in self.registry.values_of(self).items()]
+
+    @staticmethod
+    def merge(value, other):
+        return value + other
+
+    def samples(self, key, value):
+        yield self.name, key, value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(registry, name, documentation, labelnames)
+
+    def observe(self, amount, **labels):
+        key = self.label_key(labels)
+        with self.registry.lock:
+            values = self.registry.values_of(self)
+            # [count per bucket..., count above the last bucket, sum]
+            value = values.setdefault(key, [0] * (len(self.buckets) + 1) + [0])
+            for index, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    value[index] += 1
+                    break
+            else:
+                value[len(self.buckets)] += 1
+            value[-1] += amount
+        self.registry.changed()
+
+    @staticmethod
+    def merge(value, other):
+        return [a + b for a, b in zip(value, other)]
+
+    def samples(self, key, value):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), value):
+            cumulative += count
+            yield f'{self.name}_bucket', key + (('le', format_value(bound)),), cumulative
+        yield f'{self.name}_sum', key, value[-1]
+        yield f'{self.name}_count', key, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.values = {}
+        self.lock = threading.RLock()
+        self.pid = os.getpid()
+        self.flushed_at = 0.0
+        atexit.register(self.flush)
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return Counter(self, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return Histogram(self, name, documentation, labelnames, buckets)
+
+    def values_of(self, metric):
+        if os.getpid() != self.pid:
+            # Forked after values were recorded: they belong to the parent's file.
+            self.pid = os.getpid()
+            self.values = {}
+        return self.values.setdefault(metric.name, {})
+
+    def changed(self):
+        if time.monotonic() - self.flushed_at >= FLUSH_INTERVAL:
+            self.flush()
+
+    def directory(self):
+        return getattr(settings, 'METRICS_DIR', None)
+
+    def dump(self):
+        with self.lock:
+            return {
+                name: [[list(map(list, key)), value] for key, value in values.items()]
+                for name, values in self.values.items()
+            }
+
+    def flush(self):
+        directory = self.directory()
+        self.flushed_at = time.monotonic()
+        if not directory:
+            return
+        data = self.dump()
+        os.makedirs(directory, exist_ok=True)
+        # Write and rename, so readers never see a half written file.
+        fd, path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as file:
+            json.dump(data, file)
+        os.replace(path, os.path.join(directory, f'{os.getpid()}.json'))
+
+    def collect(self):
+        """Values of all processes sharing METRICS_DIR, or of this process alone."""
+        directory = self.directory()
+        if not directory:
+            with self.lock:
+                return {name: dict(values) for name, values in self.values.items()}
+
+        self.flush()
+        merged = {}
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for name, samples in data.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                values = merged.setdefault(name, {})
+                for key, value in samples:
+                    key = tuple(map(tuple, key))
+                    values[key] = metric.merge(values[key], value) if key in values else value
+        return merged
+
+    def render(self) -> str:
+        collected = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for key, value in sorted(collected.get(name, {}).items()):
+                for sample_name, labels, sample_value in metric.samples(key, value):
+                    lines.append(f'{sample_name}{format_labels(labels)} {format_value(sample_value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+requests_total = registry.counter(
+    'api_requests_total', 'Requests served, by route name, method and status code.',
+    ['route', 'method', 'status'],
+)
+request_duration = registry.histogram(
+    'api_request_duration_seconds', 'Time spent serving a request, by route name.', ['route', 'method'],
+)
+request_queries = registry.histogram(
+    'api_request_db_queries', 'Database queries run per request, by route name.', ['route', 'method'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100),
+)
+cache_requests = registry.counter(
+    'api_cache_requests_total', 'Lookups of cached API data, by cache name and result (hit or miss).',
+    ['name', 'result'],
+)
+basket_changes = registry.counter(
+    'shop_basket_changes_total', 'Basket lines added, updated or removed.', ['action'],
+)
+order_transitions = registry.counter(
+    'shop_order_transitions_total', 'Orders created (from "") or moved between statuses.', ['from_status', 'to_status'],
+)
+
+
+def is_authorized(request) -> bool:
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    header = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode())
+
+
+def metrics_view(request):
+    if not is_authorized(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
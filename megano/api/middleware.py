@@ -0,0 +1,149 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+in_list_re = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+class QueryRecorder:
+    """``connection.execute_wrapper`` that counts and times every query of one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            # Parameters are passed separately, so the SQL is already a template; only
+            # IN lists of different lengths have to be folded together.
+            self.statements[in_list_re.sub('IN (...)', sql)] += 1
+
+    def repeated(self, threshold):
+        """Statements run at least ``threshold`` times, most repeated first - usually an N+1."""
+        return [(sql, count) for sql, count in self.statements.most_common() if count >= threshold]
+
+
+class SerializeTimer:
+    """
+    Time spent in serializers during one request. Only the outermost measured ``.data`` is
+    timed, so serializers called from another one are not counted twice, and the SQL it
+    triggers is left out: that is already counted under ``db``.
+    """
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.duration = 0.0
+        self.depth = 0
+
+
+serialize_timer = ContextVar('serialize_timer', default=None)
+
+
+@contextmanager
+def measure_serialization():
+    """Add the enclosed time to the current request's ``serialize`` timing, if it is measured."""
+    timer = serialize_timer.get()
+    if timer is None:
+        yield
+        return
+    timer.depth += 1
+    started, db_started = time.perf_counter(), timer.recorder.duration
+    try:
+        yield
+    finally:
+        timer.depth -= 1
+        if not timer.depth:
+            timer.duration += time.perf_counter() - started - (timer.recorder.duration - db_started)
+
+
+class InstrumentationMiddleware:
+    """
+    Measures every request: number and total time of SQL queries, time spent in
+    serializers (see ``measure_serialization``), time spent rendering the response
+    and total time. The numbers are sent back in a ``Server-Timing`` header, so
+    they show up in the browser's devtools.
+
+    Requests slower than ``SLOW_REQUEST_THRESHOLD`` seconds, or running one
+    statement ``REPEATED_QUERY_THRESHOLD`` times or more, are logged as warnings
+    with their most repeated SQL. Request counts, latencies and query counts
+    per route also feed ``/metrics`` (see api.metrics).
+    ``REQUEST_INSTRUMENTATION = False`` turns all of it off.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'REQUEST_INSTRUMENTATION', False):
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        timer = SerializeTimer(recorder)
+        request.render_duration = 0.0
+        started = time.perf_counter()
+        token = serialize_timer.set(timer)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                response = self.get_response(request)
+        finally:
+            serialize_timer.reset(token)
+        total = time.perf_counter() - started
+
+        render, serialize = request.render_duration, timer.duration
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={recorder.duration * 1000:.2f};desc="{recorder.count} queries"',
+            f'serialize;dur={serialize * 1000:.2f}',
+            f'render;dur={render * 1000:.2f}',
+            f'app;dur={max(total - recorder.duration - serialize - render, 0) * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ])
+        self.log(request, response, recorder, total)
+        self.observe(request, response, recorder, total)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after the last process_template_response() hook.
+        if hasattr(request, 'render_duration'):
+            started = time.perf_counter()
+
+            def rendered(response):
+                request.render_duration = time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def observe(self, request, response, recorder, total):
+        match = request.resolver_match
+        route, method = match.view_name if match else '', request.method
+        metrics.requests_total.inc(route=route, method=method, status=response.status_code)
+        metrics.request_duration.observe(total, route=route, method=method)
+        metrics.request_queries.observe(recorder.count, route=route, method=method)
+
+    def log(self, request, response, recorder, total):
+        slow = total >= getattr(settings, 'SLOW_REQUEST_THRESHOLD', 0.5)
+        repeated = recorder.repeated(getattr(settings, 'REPEATED_QUERY_THRESHOLD', 5))
+        if not slow and not repeated:
+            return
+        lines = [f'{"Slow request" if slow else "Repeated queries in"} {request.method} {request.get_full_path()} '
+                 f'{response.status_code}: {total * 1000:.0f} ms, {recorder.count} queries '
+                 f'in {recorder.duration * 1000:.0f} ms']
+        lines.extend(f'  {count}x {sql}' for sql, count in repeated[:5])
+        logger.warning('\n'.join(lines))
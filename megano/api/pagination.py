@@ -0,0 +1,125 @@
+import base64
+import binascii
+import json
+import math
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+class CatalogPagination(BasePagination):
+    """
+    Paginates the catalog in the shape the frontend expects
+    (``items``/``currentPage``/``lastPage``).
+
+    Shallow pages are fetched with LIMIT/OFFSET via ``currentPage``. Passing
+    ``cursor`` switches to keyset mode: the opaque token carries the sort value
+    and pk of the last row already shown, so the next page is a plain range
+    scan and its cost does not grow with the page number.
+
+    The view describes its ordering with ``keyset_ordering = (field, descending)``
+    and must order the queryset by that field and then by pk in the same direction.
+    A view that has already counted the queryset can pass it as ``result_count``.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_query_param = 'currentPage'
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.field, self.descending = getattr(view, 'keyset_ordering', ('pk', False))
+        self.count = getattr(view, 'result_count', None)
+        if self.count is None:
+            self.count = queryset.count()
+        self.last_page = max(1, math.ceil(self.count / self.page_size))
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, pk, self.current_page = self.decode_cursor(cursor, self.get_sort_field(queryset))
+            queryset = queryset.filter(self.get_keyset_filter(value, pk))
+            page = list(queryset[:self.page_size])
+        else:
+            self.current_page = self.get_page_number(request)
+            offset = (self.current_page - 1) * self.page_size
+            page = list(queryset[offset:offset + self.page_size])
+
+        self.next_cursor = None
+        if page and self.current_page < self.last_page:
+            self.next_cursor = self.encode_cursor(page[-1], self.current_page + 1)
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'items': data,
+            'currentPage': self.current_page,
+            'lastPage': self.last_page,
+            'nextCursor': self.next_cursor,
+        }, status=status.HTTP_200_OK)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_page_number(self, request):
+        try:
+            page_number = int(request.query_params.get(self.page_query_param, 1))
+        except (TypeError, ValueError):
+            return 1
+        return max(page_number, 1)
+
+    def get_keyset_filter(self, value, pk):
+        lookup = 'lt' if self.descending else 'gt'
+        return Q(**{f'{self.field}__{lookup}': value}) | Q(**{self.field: value, f'pk__{lookup}': pk})
+
+    def get_sort_field(self, queryset):
+        """The model field or annotation output field the keyset is ordered by."""
+        annotation = queryset.query.annotations.get(self.field)
+        if annotation is not None:
+            return annotation.output_field
+        if self.field == 'pk':
+            return queryset.model._meta.pk
+        return queryset.model._meta.get_field(self.field)
+
+    def encode_cursor(self, instance, page_number):
+        value = getattr(instance, self.field)
+        if isinstance(value, (datetime, date)):
+            value = value.isoformat()
+        elif value is not None:
+            value = str(value)
+        payload = {'f': self.field, 'd': self.descending, 'v': value, 'pk': instance.pk, 'p': page_number}
+        raw = json.dumps(payload, separators=(',', ':')).encode('ascii')
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+
+    def decode_cursor(self, cursor, field):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            value = field.to_python(payload['v'])
+            if value is None:
+                raise ValueError('The cursor has no sort value')
+            position = value, int(payload['pk']), max(int(payload['p']), 1)
+        except (binascii.Error, ValueError, TypeError, KeyError, UnicodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        # A cursor only makes sense for the ordering it was issued for.
+        if payload.get('f') != self.field or payload.get('d') != self.descending:
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+
+class ReviewPagination(CatalogPagination):
+    page_size = 10
+
+
+class OrderHistoryPagination(CatalogPagination):
+    page_size = 10
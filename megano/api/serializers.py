@@ -2,13 +2,41 @@ import django_filters
 import logging
 from rest_framework import serializers
 from shopapp.models import Item, ItemImage, Category, FeedBack, Tag, Specification, Basket, Order, Sale, SaleItem
+from shopapp.search import search_items
 from myauth.models import CustomUser
-from decimal import Decimal
+from django.core.files.storage import default_storage
+from .middleware import measure_serialization
 
 logger = logging.getLogger(__name__)
 
 
-class UserSerializer(serializers.ModelSerializer):
+class TimedListSerializer(serializers.ListSerializer):
+    @property
+    def data(self):
+        with measure_serialization():
+            return super().data
+
+
+class TimedSerializerMixin:
+    """
+    For serializers whose output is the response: counts the time ``.data`` takes, with
+    ``many=True`` as well, in the request's ``serialize`` Server-Timing entry. Serializers
+    only used nested are timed as part of their parent and do not take it.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        meta = getattr(cls, 'Meta', None)
+        if meta is not None and not hasattr(meta, 'list_serializer_class'):
+            meta.list_serializer_class = TimedListSerializer
+
+    @property
+    def data(self):
+        with measure_serialization():
+            return super().data
+
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     fullName = serializers.SerializerMethodField()
     avatar = serializers.SerializerMethodField()
 
@@ -29,7 +57,7 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class ItemFilter(django_filters.FilterSet):
-    title = django_filters.CharFilter(field_name='name', lookup_expr='icontains')
+    title = django_filters.CharFilter(method='filter_title')
     minPrice = django_filters.NumberFilter(field_name='price', lookup_expr='gte')
     maxPrice = django_filters.NumberFilter(field_name='price', lookup_expr='lte')
     freeDelivery = django_filters.BooleanFilter(field_name='free_delivery')
@@ -40,6 +68,9 @@ class ItemFilter(django_filters.FilterSet):
         model = Item
         fields = ['name', 'price', 'freeDelivery', 'available', 'category']
 
+    def filter_title(self, queryset, name, value):
+        return search_items(queryset, value).order_by('-search_rank')
+
 
 class ItemImageSerializer(serializers.ModelSerializer):
     src = serializers.ImageField()
@@ -49,13 +80,13 @@ class ItemImageSerializer(serializers.ModelSerializer):
         fields = ('src', 'description')
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = ['id', 'name']
 
 
-class FeedBackSerializer(serializers.ModelSerializer):
+class FeedBackSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     date = serializers.DateTimeField(format='%d-%m-%Y')
 
     class Meta:
@@ -69,13 +100,14 @@ class SpecificationSerializer(serializers.ModelSerializer):
         fields = ['name', 'value']
 
 
-class ItemSerializer(serializers.ModelSerializer):
+class ItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     images = ItemImageSerializer(many=True)
     reviews = FeedBackSerializer(many=True, read_only=True, source='feedbacks')
     rating = serializers.SerializerMethodField()
     title = serializers.CharField(source='name')
     tags = TagSerializer(many=True, read_only=True)
     specifications = SpecificationSerializer(many=True, read_only=True)
+    reviewsCount = serializers.IntegerField(source='review_count', read_only=True)
 
     class Meta:
         model = Item
@@ -90,6 +122,7 @@ class ItemSerializer(serializers.ModelSerializer):
                   'images',
                   'tags',
                   'reviews',
+                  'reviewsCount',
                   'specifications',
                   'rating']
 
@@ -100,7 +133,51 @@ class ItemSerializer(serializers.ModelSerializer):
         return obj.get_feedbacks_count()
 
 
-class BasketItemSerializer(serializers.ModelSerializer):
+def get_preview_images(obj):
+    """First image of an item annotated by ``ItemQuerySet.with_preview()``, in the frontend image format."""
+    src = obj.preview_src or obj.preview.name
+    return [{'src': default_storage.url(src), 'alt': obj.name}] if src else []
+
+
+class ItemCardSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Compact product card for list endpoints; expects an Item queryset built with
+    ``for_cards()``. ItemSerializer stays the full representation for the detail page.
+    """
+    title = serializers.CharField(source='name')
+    salePrice = serializers.DecimalField(max_digits=10, decimal_places=2, source='sale_price', read_only=True)
+    freeDelivery = serializers.BooleanField(source='free_delivery')
+    images = serializers.SerializerMethodField()
+    tags = TagSerializer(many=True, read_only=True)
+    rating = serializers.SerializerMethodField()
+    reviews = serializers.IntegerField(source='review_count')
+
+    class Meta:
+        model = Item
+        fields = ['id', 'category', 'title', 'price', 'salePrice', 'count', 'date', 'freeDelivery',
+                  'images', 'tags', 'rating', 'reviews']
+
+    def get_images(self, obj):
+        return get_preview_images(obj)
+
+    def get_rating(self, obj):
+        return round(obj.rating_avg, 1)
+
+
+class BannerSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Lightweight banner projection; expects an Item queryset built with ``with_preview()``."""
+    title = serializers.CharField(source='name')
+    images = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Item
+        fields = ['id', 'category', 'title', 'price', 'images']
+
+    def get_images(self, obj):
+        return get_preview_images(obj)
+
+
+class BasketItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     item = ItemSerializer()
     quantity = serializers.IntegerField(source='quantity')
 
@@ -110,11 +187,10 @@ class BasketItemSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         item_representation = ItemSerializer(instance.item).data
-        sale_price = instance.item.price * (1 - Decimal(instance.item.discount) / 100)
         return {
             'id': item_representation['id'],
             'category': item_representation['category'],
-            'price': sale_price,
+            'price': instance.item.sale_price,
             'count': instance.quantity,
             'date': item_representation['date'],
             'title': item_representation['title'],
@@ -127,6 +203,16 @@ class BasketItemSerializer(serializers.ModelSerializer):
         }
 
 
+class BasketChangeSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    count = serializers.IntegerField()
+
+
+class BasketLineSerializer(BasketChangeSerializer):
+    """A single add or remove request: the count is a positive number of pieces."""
+    count = serializers.IntegerField(min_value=1)
+
+
 class CustomProductSerializer(serializers.Serializer):
 
     class Meta:
@@ -135,9 +221,33 @@ class CustomProductSerializer(serializers.Serializer):
                   'freeDelivery', 'images', 'tags', 'reviews', 'rating']
 
 
-class OrderDetailSerializer(serializers.ModelSerializer):
+class OrderLineSerializer(serializers.ModelSerializer):
+    """An order line as the order pages show it, read from the line's own copy of the item."""
+    id = serializers.IntegerField(source='item_id')
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, source='sale_price')
+    unitPrice = serializers.DecimalField(max_digits=10, decimal_places=2, source='unit_price')
+    count = serializers.IntegerField(source='quantity')
+    total = serializers.DecimalField(max_digits=10, decimal_places=2, source='line_total')
+    freeDelivery = serializers.BooleanField(source='free_delivery')
+    images = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Basket
+        fields = ['id', 'title', 'description', 'price', 'unitPrice', 'discount', 'count', 'total', 'freeDelivery',
+                  'images']
+
+    def get_images(self, obj):
+        return [{'src': default_storage.url(obj.image), 'alt': obj.title}] if obj.image else []
+
+
+def get_delivery_type(order):
+    has_paid_delivery = any(line.free_delivery is False for line in order.basket_set.all())
+    return 'free' if not has_paid_delivery else 'paid'
+
+
+class OrderDetailSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     customer = UserSerializer()
-    products = BasketItemSerializer(many=True, read_only=True, source='basket_set')
+    products = OrderLineSerializer(many=True, read_only=True, source='basket_set')
     deliveryType = serializers.SerializerMethodField()
     paymentType = serializers.CharField(source='payment_type')
     totalCost = serializers.DecimalField(max_digits=10, decimal_places=2, source='total_amount')
@@ -148,8 +258,7 @@ class OrderDetailSerializer(serializers.ModelSerializer):
                   'status', 'city', 'address', 'products', 'totalCost']
 
     def get_deliveryType(self, obj):
-        has_paid_delivery = any(item.free_delivery is False for item in obj.items.all())
-        return 'free' if not has_paid_delivery else 'paid'
+        return get_delivery_type(obj)
 
     def to_representation(self, instance):
         formatted_data = {
@@ -164,27 +273,55 @@ class OrderDetailSerializer(serializers.ModelSerializer):
             'status': instance.status,
             'city': instance.city,
             'address': instance.address,
-            'products': BasketItemSerializer(instance.basket_set.all(), many=True).data,
+            'products': OrderLineSerializer(instance.basket_set.all(), many=True).data,
         }
 
         return formatted_data
 
 
-class SalesItemSerializer(serializers.ModelSerializer):
-    items = ItemSerializer()
+class OrderLineSummarySerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='item_id')
+    count = serializers.IntegerField(source='quantity')
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, source='sale_price')
+
+    class Meta:
+        model = Basket
+        fields = ['id', 'title', 'count', 'price']
+
+
+class OrderHistorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Compact order for the history page: the lines are summaries, not full products."""
+    createdAt = serializers.DateTimeField(source='created_at', format='%Y-%m-%d %H:%M')
+    fullName = serializers.CharField(source='customer.get_fullName')
+    deliveryType = serializers.SerializerMethodField()
+    paymentType = serializers.CharField(source='payment_type')
+    totalCost = serializers.DecimalField(max_digits=10, decimal_places=2, source='total_amount')
+    products = OrderLineSummarySerializer(many=True, source='basket_set')
+
+    class Meta:
+        model = Order
+        fields = ['id', 'createdAt', 'fullName', 'deliveryType', 'paymentType', 'totalCost', 'status', 'city',
+                  'address', 'products']
+
+    def get_deliveryType(self, obj):
+        return get_delivery_type(obj)
+
+
+class SalesItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    items = ItemCardSerializer()
+    salePrice = serializers.DecimalField(max_digits=10, decimal_places=2, source='sale_price', read_only=True)
 
     class Meta:
         model = SaleItem
-        fields = ['items']
+        fields = ['items', 'salePrice']
 
     def to_representation(self, instance):
         item_representation = self.fields['items'].to_representation(instance.item)
-        sale_price = instance.item.price * (1 - Decimal(instance.sale.discount) / 100)
         sale_representation = {
             'id': item_representation['id'],
             'dateFrom': instance.sale.date_from.strftime('%d-%m'),
             'dateTo': instance.sale.date_to.strftime('%d-%m'),
-            'salePrice': sale_price,
+            'salePrice': self.fields['salePrice'].to_representation(instance.sale_price),
         }
 
         return {**item_representation, **sale_representation}
@@ -224,6 +361,26 @@ class CategorySerializer(serializers.ModelSerializer):
         return SubcategorySerializer(subcategories, many=True).data
 
 
+class CategoryTreeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Same shape as CategorySerializer, but children are looked up in the
+    ``children`` context map (parent pk -> categories) built from one query.
+    """
+    image = serializers.SerializerMethodField()
+    subcategories = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Category
+        fields = ['id', 'title', 'image', 'subcategories']
+
+    def get_image(self, obj):
+        return {'src': obj.image.url, 'alt': 'Image alt string'} if obj.image else None
+
+    def get_subcategories(self, obj):
+        children = self.context['children'].get(obj.pk, [])
+        return CategoryTreeSerializer(children, many=True, context=self.context).data
+
+
 class ChangePasswordSerializer(serializers.Serializer):
     currentPassword = serializers.CharField(required=True)
     newPassword = serializers.CharField(required=True)
@@ -0,0 +1,37 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from shopapp.cache import bump_version
+from shopapp.models import Banner, Category, Item, ItemImage, Order, Specification, FeedBack, Sale, SaleItem
+from shopapp.order_states import status_changed
+from .metrics import order_transitions
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_categories(sender, **kwargs):
+    bump_version('categories')
+
+
+@receiver([post_save, post_delete], sender=Banner)
+@receiver([post_save, post_delete], sender=Item)
+@receiver([post_save, post_delete], sender=ItemImage)
+@receiver([post_save, post_delete], sender=Specification)
+@receiver([post_save, post_delete], sender=FeedBack)
+@receiver([post_save, post_delete], sender=Sale)
+@receiver([post_save, post_delete], sender=SaleItem)
+@receiver(m2m_changed, sender=Item.tags.through)
+def invalidate_feeds(sender, **kwargs):
+    bump_version('feeds')
+
+
+@receiver(post_save, sender=Order)
+def count_order_creation(sender, instance, created, **kwargs):
+    if created:
+        order_transitions.inc(from_status='', to_status=instance.status)
+
+
+@receiver(status_changed)
+def count_order_transitions(sender, transitions, **kwargs):
+    for (from_status, to_status), count in transitions.items():
+        order_transitions.inc(count, from_status=from_status, to_status=to_status)
+
@@ -1,3 +1,1488 @@
-from django.test import TestCase
+import base64
+import json
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature, tag
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework.utils.encoders import JSONEncoder
+
+from api import metrics
+from api.basket import SessionBasket
+from api.cache import cache_stats, get_or_build
+from api.middleware import (InstrumentationMiddleware, QueryRecorder, SerializeTimer, measure_serialization,
+                            serialize_timer)
+from api.serializers import (BasketChangeSerializer, ItemCardSerializer, ItemImageSerializer, ItemSerializer,
+                             TimedListSerializer)
+from api.views import CatalogListView
+from myauth.models import CustomUser
+from shopapp.models import (Banner, Item, FeedBack, Category, Tag, Specification, ItemImage, Order, Basket, Sale, SaleItem,
+                            DeliverySettings, StockReservation)
+from shopapp.pricing import pricing
+from shopapp.search import get_backend
+
+
+class CatalogPaginationTestCase(TestCase):
+    items_count = 95
+
+    @classmethod
+    def setUpTestData(cls):
+        Item.objects.bulk_create(
+            Item(name=f'Item {i}', description='Description', price=Decimal(i % 17) + Decimal('0.50'))
+            for i in range(cls.items_count)
+        )
+        items = list(Item.objects.order_by('pk'))
+        FeedBack.objects.bulk_create(
+            FeedBack(item=item, author='Author', email='author@example.com', text='Text', rate=i % 6)
+            for i, item in enumerate(items) if i % 3
+        )
+        Item.objects.rebuild_ratings()
+
+    def walk_with_cursor(self, params):
+        response = self.client.get(reverse('api:catalog_api'), params)
+        pages = [response.json()]
+        while pages[-1]['nextCursor']:
+            response = self.client.get(reverse('api:catalog_api'), {**params, 'cursor': pages[-1]['nextCursor']})
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.json())
+        return pages
+
+    def test_page_number_returns_requested_slice(self):
+        response = self.client.get(reverse('api:catalog_api'), {'currentPage': 2, 'limit': 20})
+        data = response.json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['items']), 20)
+        self.assertEqual(data['currentPage'], 2)
+        self.assertEqual(data['lastPage'], 5)
+
+    def test_page_size_is_capped(self):
+        response = self.client.get(reverse('api:catalog_api'), {'limit': 10000})
+
+        self.assertEqual(len(response.json()['items']), 95)
+
+    def test_cursor_walk_matches_offset_pages_for_every_sort(self):
+        for sort in ['date', 'price', 'rating', 'reviews']:
+            for sort_type in ['dec', 'inc']:
+                params = {'sort': sort, 'sortType': sort_type, 'limit': 20}
+                offset_ids = []
+                for page in range(1, 6):
+                    response = self.client.get(reverse('api:catalog_api'), {**params, 'currentPage': page})
+                    offset_ids += [item['id'] for item in response.json()['items']]
+
+                pages = self.walk_with_cursor(params)
+                cursor_ids = [item['id'] for page in pages for item in page['items']]
+
+                self.assertEqual(cursor_ids, offset_ids, (sort, sort_type))
+                self.assertEqual(len(set(cursor_ids)), self.items_count)
+                self.assertEqual([page['currentPage'] for page in pages], [1, 2, 3, 4, 5])
+
+    def test_cursor_query_has_no_offset(self):
+        first = self.client.get(reverse('api:catalog_api'), {'sort': 'price'}).json()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('api:catalog_api'), {'sort': 'price', 'cursor': first['nextCursor']})
+
+        self.assertFalse(any('OFFSET' in query['sql'] for query in queries.captured_queries))
+
+    def test_cursor_for_another_sort_is_rejected(self):
+        first = self.client.get(reverse('api:catalog_api'), {'sort': 'price'}).json()
+        response = self.client.get(reverse('api:catalog_api'), {'sort': 'date', 'cursor': first['nextCursor']})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_garbage_cursor_is_rejected(self):
+        response = self.client.get(reverse('api:catalog_api'), {'cursor': 'not-a-cursor'})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_with_a_bad_sort_value_is_rejected(self):
+        for sort, value in [('price', 'abc'), ('date', 'yesterday'), ('rating', [1]), ('price', None)]:
+            with self.subTest(sort=sort, value=value):
+                field = CatalogListView.sort_fields[sort]
+                payload = {'f': field, 'd': True, 'v': value, 'pk': 1, 'p': 2}
+                cursor = base64.urlsafe_b64encode(json.dumps(payload).encode('ascii')).decode('ascii')
+                response = self.client.get(reverse('api:catalog_api'), {'sort': sort, 'cursor': cursor})
+
+                self.assertEqual(response.status_code, 404)
+
+
+class CatalogCategoryFilterTestCase(TestCase):
+    def test_category_filter_covers_whole_subtree(self):
+        parent = None
+        expected_ids = []
+        for level in range(5):
+            parent = Category.objects.create(title=f'Level {level}', parent_category=parent, image='category/image.jpg')
+            expected_ids.append(Item.objects.create(name=f'Item {level}', description='Description', price=1,
+                                                    category=parent).pk)
+        root_id = Category.objects.get(title='Level 0').pk
+        Item.objects.create(name='Uncategorized', description='Description', price=1)
+
+        response = self.client.get(reverse('api:catalog_api'), {'category': root_id})
+
+        self.assertEqual(sorted(item['id'] for item in response.json()['items']), expected_ids)
+
+    def test_unknown_category_is_not_found(self):
+        response = self.client.get(reverse('api:catalog_api'), {'category': 999})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_non_numeric_category_is_not_found(self):
+        for category in ['abc', '-1', '1.5', '²']:
+            with self.subTest(category=category):
+                response = self.client.get(reverse('api:catalog_api'), {'category': category})
+
+                self.assertEqual(response.status_code, 404)
+
+
+class CategoriesTreeTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.root = Category.objects.create(title='Root', image='category/root.jpg')
+        cls.child = Category.objects.create(title='Child', parent_category=cls.root, image='category/child.jpg')
+        Category.objects.create(title='Grandchild', parent_category=cls.child, image='category/grandchild.jpg')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_tree_is_built_in_one_query_and_then_cached(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(reverse('api:categories_api')).json()
+        self.assertEqual(len(queries.captured_queries), 1)
+        self.assertEqual(data[0]['title'], 'Root')
+        self.assertEqual(data[0]['subcategories'][0]['subcategories'][0]['title'], 'Grandchild')
+        self.assertEqual(data[0]['image'], {'src': '/media/category/root.jpg', 'alt': 'Image alt string'})
+
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get(reverse('api:categories_api')).json()
+        self.assertEqual(len(queries.captured_queries), 0)
+        self.assertEqual(cached, data)
+
+    def test_unchanged_tree_is_not_modified(self):
+        etag = self.client.get(reverse('api:categories_api'))['ETag']
+
+        response = self.client.get(reverse('api:categories_api'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_category_change_invalidates_tree(self):
+        etag = self.client.get(reverse('api:categories_api'))['ETag']
+        self.child.title = 'Renamed'
+        self.child.save()
+
+        response = self.client.get(reverse('api:categories_api'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()[0]['subcategories'][0]['title'], 'Renamed')
+
+    def test_tree_expires_without_a_version_bump(self):
+        # A rename made by a worker whose bump this process's cache never sees.
+        etag = self.client.get(reverse('api:categories_api'))['ETag']
+        Category.objects.filter(pk=self.child.pk).update(title='Renamed')
+
+        with mock.patch('time.time', return_value=time.time() + 301):
+            response = self.client.get(reverse('api:categories_api'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['subcategories'][0]['title'], 'Renamed')
+
+
+class CatalogSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(30):
+            Item.objects.create(name=f'Phone {i}', description='Phone ' * (i % 5), price=i)
+        Item.objects.create(name='Lamp', description='Desk lamp', price=1)
+
+    def test_name_filter_uses_search_index(self):
+        response = self.client.get(reverse('api:catalog_api'), {'filter[name]': 'pho', 'limit': 100})
+
+        self.assertEqual(len(response.json()['items']), 30)
+
+    def test_relevance_sort_walks_with_cursor(self):
+        params = {'filter[name]': 'phone', 'sort': 'relevance', 'limit': 7}
+        offset_ids = []
+        for page in range(1, 6):
+            response = self.client.get(reverse('api:catalog_api'), {**params, 'currentPage': page})
+            offset_ids += [item['id'] for item in response.json()['items']]
+
+        ids = []
+        data = self.client.get(reverse('api:catalog_api'), params).json()
+        ids += [item['id'] for item in data['items']]
+        while data['nextCursor']:
+            data = self.client.get(reverse('api:catalog_api'), {**params, 'cursor': data['nextCursor']}).json()
+            ids += [item['id'] for item in data['items']]
+
+        self.assertEqual(ids, offset_ids)
+        self.assertEqual(len(set(ids)), 30)
+
+
+class FeedCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = Item.objects.create(name='Item', description='Description', price=10, count=1)
+
+    def setUp(self):
+        cache.clear()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries.captured_queries), response.json()
+
+    def test_feeds_are_served_from_cache(self):
+        for name in ['api-banners', 'api-products-popular', 'api-products-limited', 'api-sale']:
+            self.assertGreater(self.count_queries(reverse(f'api:{name}'))[0], 0, name)
+            self.assertEqual(self.count_queries(reverse(f'api:{name}'))[0], 0, name)
+
+    def test_ignored_query_params_share_the_cached_feed(self):
+        for name in ['api-banners', 'api-products-popular', 'api-products-limited', 'api-sale']:
+            self.count_queries(reverse(f'api:{name}'))
+            self.assertEqual(self.count_queries(f"{reverse(f'api:{name}')}?_=1700000000000")[0], 0, name)
+
+    def test_sales_pages_share_one_cached_feed(self):
+        sale = Sale.objects.create(title='Sale', discount=10, date_from='2024-01-01', date_to='2024-12-31')
+        items = Item.objects.bulk_create(Item(name=f'Item {i}', description='Description', price=10, count=1)
+                                         for i in range(7))
+        SaleItem.objects.bulk_create(SaleItem(sale=sale, item=item) for item in [self.item, *items])
+        url = reverse('api:api-sale')
+
+        first = self.count_queries(url)[1]
+        queries, second = self.count_queries(f'{url}?currentPage=2&_=1700000000000')
+
+        self.assertEqual(queries, 0)
+        self.assertEqual((first['currentPage'], first['lastPage'], len(first['items'])), (1, 2, 6))
+        self.assertEqual((second['currentPage'], second['lastPage'], len(second['items'])), (2, 2, 2))
+        self.assertEqual(self.count_queries(f'{url}?currentPage=abc')[1]['currentPage'], 1)
+        self.assertEqual(self.count_queries(f'{url}?currentPage=99')[1]['currentPage'], 2)
+
+    def test_feedback_invalidates_feeds(self):
+        self.assertEqual(self.count_queries(reverse('api:api-products-popular'))[1], [])
+
+        FeedBack.objects.create(item=self.item, author='Author', email='author@example.com', text='Text', rate=5)
+
+        self.assertEqual(len(self.count_queries(reverse('api:api-products-popular'))[1]), 1)
+
+    def test_sale_invalidates_sales_feed(self):
+        self.assertEqual(self.count_queries(reverse('api:api-sale'))[1]['items'], [])
+
+        sale = Sale.objects.create(title='Sale', discount=10, date_from='2024-01-01', date_to='2024-12-31')
+        SaleItem.objects.create(sale=sale, item=self.item)
+
+        sale_item, = self.count_queries(reverse('api:api-sale'))[1]['items']
+        self.assertEqual((sale_item['price'], sale_item['salePrice']), ('10.00', '9.00'))
+
+    def test_counters_track_hits_and_misses(self):
+        before = cache_stats().get('banners', {'hit': 0, 'miss': 0})
+        self.client.get(reverse('api:api-banners'))
+        self.client.get(reverse('api:api-banners'))
+        after = cache_stats()['banners']
+
+        self.assertEqual(after['miss'] - before['miss'], 1)
+        self.assertEqual(after['hit'] - before['hit'], 1)
+
+    @override_settings(API_CACHE_TIMEOUTS={'limited': 0})
+    def test_timeout_is_configurable_per_feed(self):
+        self.count_queries(reverse('api:api-products-limited'))
+
+        self.assertGreater(self.count_queries(reverse('api:api-products-limited'))[0], 0)
+
+    def test_concurrent_misses_build_once(self):
+        calls = []
+
+        def build():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(get_or_build('feeds', 'test', 'key', build)))
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 10)
+
+
+class BannerTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(title='Phones', image='category/phones.jpg')
+        cls.smartphones = Category.objects.create(title='Smartphones', parent_category=cls.phones,
+                                                  image='category/smartphones.jpg')
+        cls.lamps = Category.objects.create(title='Lamps', image='category/lamps.jpg')
+        cls.tvs = Category.objects.create(title='TV', image='category/tv.jpg')
+        cls.best_phone = cls.create_item('Best phone', cls.smartphones, [5, 5])
+        cls.create_item('Good phone', cls.phones, [4])
+        cls.best_lamp = cls.create_item('Best lamp', cls.lamps, [4, 3])
+        cls.create_item('Bad lamp', cls.lamps, [1])
+        cls.best_tv = cls.create_item('Best TV', cls.tvs, [2])
+        ItemImage.objects.create(item=cls.best_phone, src='products/first.jpg')
+        ItemImage.objects.create(item=cls.best_phone, src='products/second.jpg')
+
+    @classmethod
+    def create_item(cls, name, category, rates):
+        item = Item.objects.create(name=name, description='Description', price=10, category=category)
+        for rate in rates:
+            FeedBack.objects.create(item=item, author='Author', email='author@example.com', text='Text', rate=rate)
+        return item
+
+    def setUp(self):
+        cache.clear()
+
+    def get_banners(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(reverse('api:api-banners')).json()
+        return data, len(queries.captured_queries)
+
+    def test_fallback_takes_top_rated_item_per_root_category(self):
+        data, queries = self.get_banners()
+
+        self.assertEqual([banner['id'] for banner in data], [self.best_phone.pk, self.best_lamp.pk, self.best_tv.pk])
+        self.assertEqual(data[0], {
+            'id': self.best_phone.pk,
+            'category': self.smartphones.pk,
+            'title': 'Best phone',
+            'price': '10.00',
+            'images': [{'src': '/media/products/first.jpg', 'alt': 'Best phone'}],
+        })
+        self.assertEqual(data[1]['images'], [])
+        self.assertLessEqual(queries, 3)
+
+    def test_curated_banners_come_first_and_are_bounded(self):
+        cheap = Item.objects.create(name='Curated', description='Description', price=1)
+        Banner.objects.create(item=cheap, position=1)
+        Banner.objects.create(item=self.best_tv, position=0)
+        Banner.objects.create(item=self.best_lamp, position=2, active=False)
+
+        data, _ = self.get_banners()
+
+        self.assertEqual([banner['id'] for banner in data], [self.best_tv.pk, cheap.pk, self.best_phone.pk])
+
+
+class ItemCardTestCase(TestCase):
+    def test_card_is_compact_and_detail_stays_full(self):
+        item = Item.objects.create(name='Phone', description='Description', price=Decimal('200.00'), discount=15,
+                                   count=3, free_delivery=True)
+        item.tags.add(Tag.objects.create(name='new'))
+        ItemImage.objects.create(item=item, src='products/phone.jpg')
+        Specification.objects.create(item=item, name='Weight', value='1 kg')
+        FeedBack.objects.create(item=item, author='Author', email='author@example.com', text='Text', rate=4)
+
+        card = self.client.get(reverse('api:catalog_api')).json()['items'][0]
+        detail = self.client.get(reverse('api:api-product-detail', kwargs={'id': item.pk})).json()
+
+        self.assertEqual(card, {
+            'id': item.pk,
+            'category': None,
+            'title': 'Phone',
+            'price': '200.00',
+            'salePrice': '170.00',
+            'count': 3,
+            'date': card['date'],
+            'freeDelivery': True,
+            'images': [{'src': '/media/products/phone.jpg', 'alt': 'Phone'}],
+            'tags': [{'id': item.tags.get().pk, 'name': 'new'}],
+            'rating': 4.0,
+            'reviews': 1,
+        })
+        self.assertEqual(len(detail['reviews']), 1)
+        self.assertEqual(detail['specifications'], [{'name': 'Weight', 'value': '1 kg'}])
+
+
+@tag('benchmark')
+class ItemCardBenchmark(TestCase):
+    """Compares payload size and serialization throughput of the card and full item serializers."""
+    items_count = 200
+    reviews_per_item = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        Item.objects.bulk_create(
+            Item(name=f'Item {i}', description='Description ' * 40, price=100) for i in range(cls.items_count)
+        )
+        items = list(Item.objects.all())
+        FeedBack.objects.bulk_create(
+            FeedBack(item=item, author='Author', email='author@example.com', text='Review text ' * 20, rate=4)
+            for item in items for _ in range(cls.reviews_per_item)
+        )
+        Specification.objects.bulk_create(
+            Specification(item=item, name=f'Spec {i}', value='Value') for item in items for i in range(5)
+        )
+        Item.objects.rebuild_ratings()
+
+    def measure(self, serializer_class, queryset):
+        started = time.perf_counter()
+        payload = json.dumps(serializer_class(queryset, many=True).data, cls=JSONEncoder)
+        return len(payload), time.perf_counter() - started
+
+    def test_card_payload_and_time(self):
+        full_size, full_time = self.measure(ItemSerializer, Item.objects.for_listing())
+        card_size, card_time = self.measure(ItemCardSerializer, Item.objects.for_cards())
+
+        self.assertLess(card_size * 10, full_size)
+        self.assertLess(card_time, full_time)
+
+
+@override_settings(PRODUCT_DETAIL_REVIEWS=3)
+class ReviewsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = Item.objects.create(name='Item', description='Description', price=10)
+        cls.reviews = [
+            FeedBack.objects.create(item=cls.item, author=f'Author {i}', email='author@example.com',
+                                    text='Text', rate=i % 5 + 1)
+            for i in range(23)
+        ]
+
+    def test_detail_embeds_latest_reviews_and_totals(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(reverse('api:api-product-detail', kwargs={'id': self.item.pk})).json()
+
+        self.assertEqual([review['author'] for review in data['reviews']], ['Author 22', 'Author 21', 'Author 20'])
+        self.assertEqual(data['reviewsCount'], 23)
+        self.assertLessEqual(len(queries.captured_queries), 5)
+
+    def test_reviews_are_paged_newest_first_with_cursor(self):
+        url = reverse('api:api-products-reviews', kwargs={'pk': self.item.pk})
+        data = self.client.get(url).json()
+        authors = [review['author'] for review in data['items']]
+        while data['nextCursor']:
+            with CaptureQueriesContext(connection) as queries:
+                data = self.client.get(url, {'cursor': data['nextCursor']}).json()
+            authors += [review['author'] for review in data['items']]
+            self.assertFalse(any('OFFSET' in query['sql'] for query in queries.captured_queries))
+
+        self.assertEqual(authors, [f'Author {i}' for i in reversed(range(23))])
+        self.assertEqual(data['lastPage'], 3)
+
+    def test_reviews_histogram(self):
+        url = reverse('api:api-products-reviews', kwargs={'pk': self.item.pk})
+
+        histogram = self.client.get(url).json()['histogram']
+
+        self.assertEqual(histogram, {'1': 5, '2': 5, '3': 5, '4': 4, '5': 4})
+
+    def test_reviews_of_unknown_item_are_not_found(self):
+        response = self.client.get(reverse('api:api-products-reviews', kwargs={'pk': 999}))
+
+        self.assertEqual(response.status_code, 404)
+
+
+class QueryPlanTestCase(TestCase):
+    """
+    Runs EXPLAIN QUERY PLAN on every query of the main endpoints and fails when
+    one of them scans a whole table instead of using an index.
+    """
+    full_scan_re = re.compile(r'^SCAN (?P<table>(shopapp|myauth)_\w+)$')
+    # Endpoints that list a whole (small) table by design.
+    allowed_full_scans = {'shopapp_category', 'shopapp_tag', 'shopapp_saleitem'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='buyer', password='secret')
+        cls.category = Category.objects.create(title='Category', image='category/image.jpg')
+        cls.items = [Item.objects.create(name=f'Item {i}', description='Description', price=i, count=i,
+                                         category=cls.category) for i in range(30)]
+        cls.order = Order.objects.create(customer=cls.user, total_amount=0)
+        for item in cls.items[:3]:
+            Basket.objects.create(order=cls.order, item=item, quantity=1)
+            FeedBack.objects.create(item=item, author='Author', email='author@example.com', text='Text', rate=4)
+        sale = Sale.objects.create(title='Sale', discount=10, date_from='2024-01-01', date_to='2024-12-31')
+        SaleItem.objects.create(sale=sale, item=cls.items[0])
+        Banner.objects.create(item=cls.items[1])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def get_requests(self):
+        catalog = reverse('api:catalog_api')
+        requests = [(catalog, {'sort': sort, 'sortType': sort_type, 'filter[available]': 'true'})
+                    for sort in ['date', 'price', 'rating', 'reviews'] for sort_type in ['dec', 'inc']]
+        requests += [
+            (catalog, {}),
+            (catalog, {'category': self.category.pk}),
+            (reverse('api:api-products-limited'), {}),
+            (reverse('api:api-products-popular'), {}),
+            (reverse('api:api-banners'), {}),
+            (reverse('api:api-sale'), {}),
+            (reverse('api:categories_api'), {}),
+            (reverse('api:api-product-detail', kwargs={'id': self.items[0].pk}), {}),
+            (reverse('api:api-products-reviews', kwargs={'pk': self.items[0].pk}), {}),
+            (reverse('api:basket_api'), {}),
+            (reverse('api:orders_api'), {}),
+            (reverse('api:orders_id_api', kwargs={'id': self.order.pk}), {}),
+        ]
+        return requests
+
+    @skipUnlessDBFeature('supports_explaining_query_execution')
+    def test_endpoint_queries_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plans are checked on SQLite')
+        for url, params in self.get_requests():
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url, params)
+            for query in queries.captured_queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                with connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN QUERY PLAN {query["sql"]}')
+                    plan = [row[-1] for row in cursor.fetchall()]
+                for step in plan:
+                    match = self.full_scan_re.match(step)
+                    if match and match['table'] not in self.allowed_full_scans:
+                        self.fail(f'Full scan of {match["table"]} for {url} {params}:\n{query["sql"]}\n{plan}')
+
+
+class CatalogFacetsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(title='Phones', image='category/phones.jpg')
+        cls.lamps = Category.objects.create(title='Lamps', image='category/lamps.jpg')
+        cls.red = Tag.objects.create(name='red')
+        cls.blue = Tag.objects.create(name='blue')
+        for i in range(10):
+            item = Item.objects.create(name=f'Phone {i}', description='Phone', price=100 + i, category=cls.phones,
+                                       free_delivery=i < 3, available=i % 2 == 0)
+            item.tags.add(cls.red if i < 4 else cls.blue)
+        Item.objects.create(name='Lamp', description='Lamp', price=5, category=cls.lamps)
+
+    def get_facets(self, params):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(reverse('api:catalog_api'), {**params, 'facets': 'true'}).json()
+        return data['facets'], len(queries.captured_queries)
+
+    def test_facets_follow_current_filter(self):
+        facets, _ = self.get_facets({'filter[minPrice]': 50})
+
+        self.assertEqual(facets['total'], 10)
+        self.assertEqual(facets['price'], {'min': 100, 'max': 109})
+        self.assertEqual(facets['freeDelivery'], 3)
+        self.assertEqual(facets['available'], 5)
+        self.assertEqual(facets['categories'], [{'id': self.phones.pk, 'count': 10}])
+        self.assertEqual(facets['tags'], [{'id': self.red.pk, 'name': 'red', 'count': 4},
+                                          {'id': self.blue.pk, 'name': 'blue', 'count': 6}])
+
+    def test_facets_cost_one_extra_query(self):
+        with CaptureQueriesContext(connection) as plain:
+            self.client.get(reverse('api:catalog_api'), {'tags[]': [self.red.pk]})
+        facets, facet_queries = self.get_facets({'tags[]': [self.red.pk]})
+
+        # Two facet queries, and the paginator reuses their total instead of counting.
+        self.assertEqual(facet_queries, len(plain.captured_queries) + 1)
+        self.assertEqual(facets['total'], 4)
+
+    def test_facets_of_a_search(self):
+        facets, _ = self.get_facets({'filter[name]': 'phone'})
+
+        self.assertEqual(facets['total'], 10)
+        self.assertEqual(facets['tags'], [{'id': self.red.pk, 'name': 'red', 'count': 4},
+                                          {'id': self.blue.pk, 'name': 'blue', 'count': 6}])
+
+    def test_bad_tag_ids_are_a_bad_request(self):
+        response = self.client.get(reverse('api:catalog_api'), {'tags': ['x'], 'facets': 'true'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('tags', response.json())
+
+    def test_facets_are_optional(self):
+        data = self.client.get(reverse('api:catalog_api')).json()
+
+        self.assertNotIn('facets', data)
+
+
+@tag('benchmark')
+class CatalogFacetsBenchmark(TestCase):
+    """On a 100k item catalog the facet response stays within a fixed multiple of the plain list."""
+    items_count = 100000
+    repeats = 3
+    max_ratio = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = Category.objects.bulk_create(
+            Category(title=f'Category {i}', image='category/image.jpg') for i in range(20)
+        )
+        tags = Tag.objects.bulk_create(Tag(name=f'tag {i}') for i in range(30))
+        Item.objects.bulk_create(
+            (Item(name=f'Item {i}', description='Description', price=Decimal(i % 5000),
+                  category=categories[i % len(categories)], free_delivery=i % 4 == 0)
+             for i in range(cls.items_count)),
+            batch_size=5000,
+        )
+        Item.tags.through.objects.bulk_create(
+            (Item.tags.through(item_id=item_id, tag=tags[item_id % len(tags)])
+             for item_id in Item.objects.values_list('pk', flat=True).iterator()),
+            batch_size=5000,
+        )
+
+    def best_time(self, params):
+        timings = []
+        for _ in range(self.repeats):
+            started = time.perf_counter()
+            self.client.get(reverse('api:catalog_api'), params)
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    def test_facet_overhead_is_bounded(self):
+        params = {'filter[minPrice]': 100, 'filter[freeDelivery]': 'true'}
+        plain_time = self.best_time(params)
+        facet_time = self.best_time({**params, 'facets': 'true'})
+
+        self.assertLess(facet_time, plain_time * self.max_ratio)
+
+
+@tag('benchmark')
+class CatalogPaginationBenchmark(TestCase):
+    """Deep keyset pages must cost about the same as the first page."""
+    items_count = 5000
+    page_size = 20
+    repeats = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        Item.objects.bulk_create(
+            (Item(name=f'Item {i}', description='Description', price=Decimal(i % 997))
+             for i in range(cls.items_count)),
+            batch_size=500,
+        )
+
+    def best_time(self, params):
+        timings = []
+        for _ in range(self.repeats):
+            started = time.perf_counter()
+            response = self.client.get(reverse('api:catalog_api'), params)
+            timings.append(time.perf_counter() - started)
+            self.assertEqual(response.status_code, 200)
+        return min(timings)
+
+    def test_deep_page_latency_is_flat(self):
+        params = {'sort': 'price', 'sortType': 'inc', 'limit': self.page_size}
+        deep_page = self.items_count // self.page_size - 1
+        response = self.client.get(reverse('api:catalog_api'), {**params, 'currentPage': deep_page - 1})
+        deep_cursor = response.json()['nextCursor']
+
+        first_page_time = self.best_time(params)
+        deep_page_time = self.best_time({**params, 'cursor': deep_cursor})
+
+        self.assertEqual(self.client.get(reverse('api:catalog_api'), {**params, 'cursor': deep_cursor})
+                         .json()['currentPage'], deep_page)
+        self.assertLess(deep_page_time, first_page_time * 3 + 0.01)
+
+
+class ListingQueryCountTestCase(TestCase):
+    """List endpoints must not issue queries per serialized item."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='buyer', password='secret')
+        tag = Tag.objects.create(name='tag')
+        sale = Sale.objects.create(title='Sale', discount=10, date_from='2024-01-01', date_to='2024-12-31')
+        order = Order.objects.create(customer=cls.user, total_amount=0)
+        for i in range(60):
+            item = Item.objects.create(name=f'Item {i}', description='Description', price=100, count=i % 10)
+            item.tags.add(tag)
+            Specification.objects.create(item=item, name='Weight', value='1 kg')
+            ItemImage.objects.create(item=item, src='products/image.jpg')
+            FeedBack.objects.create(item=item, author='Author', email='author@example.com', text='Text', rate=4)
+            FeedBack.objects.create(item=item, author='Author', email='author@example.com', text='Text', rate=5)
+            Basket.objects.create(order=order, item=item, quantity=1)
+            SaleItem.objects.create(sale=sale, item=item)
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries.captured_queries)
+
+    def test_catalog_query_count_does_not_depend_on_page_size(self):
+        for sort in ['date', 'rating', 'reviews']:
+            small = self.count_queries(reverse('api:catalog_api'), {'sort': sort, 'limit': 5})
+            large = self.count_queries(reverse('api:catalog_api'), {'sort': sort, 'limit': 50})
+            self.assertEqual(small, large, sort)
+
+    def test_catalog_cards_read_stored_rating(self):
+        items = self.client.get(reverse('api:catalog_api'), {'limit': 1}).json()['items']
+
+        self.assertEqual((items[0]['rating'], items[0]['reviews']), (4.5, 2))
+
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class EndpointBudgetTestCase(TestCase):
+    """
+    Hits every route of api/urls.py against a synthetic catalog of 1000 items and
+    checks the query count and payload size of each one against its budget. Wall
+    time depends on the machine, so it is only checked by the benchmark-tagged test.
+    Set API_BUDGET_REPORT=<path> to also export the measurements as JSON.
+    """
+    items_count = 1000
+    categories_count = 40
+    reviews_per_item = 4
+    orders_count = 30
+    # route name -> (max queries, max seconds, max payload bytes) of any request to it
+    budgets = {
+        'basket_api': (16, 0.5, 10000),
+        'basket_batch_api': (16, 0.5, 20000),
+        'catalog_api': (4, 0.5, 20000),
+        'catalogid_api': (3, 0.5, 20000),
+        'categories_api': (1, 0.5, 20000),
+        'tags_api': (1, 0.5, 2000),
+        'orders_api': (15, 1.0, 250000),
+        'orders_history_api': (5, 0.5, 60000),
+        'orders_details_id_api': (10, 0.5, 10000),
+        'orders_id_api': (10, 0.5, 10000),
+        'payment_id_api': (15, 0.5, 1000),
+        'payment_someone_api': (5, 0.5, 1000),
+        'api-product-detail': (5, 0.5, 5000),
+        'api-products-popular': (2, 0.5, 10000),
+        'api-products-limited': (2, 0.5, 60000),
+        'api-products-reviews': (4, 0.5, 5000),
+        'api-banners': (2, 0.5, 2000),
+        'api-profile': (3, 0.5, 1000),
+        'api-password': (3, 0.5, 1000),
+        'api-sale': (3, 0.5, 40000),
+        'api-login': (9, 0.5, 1000),
+        'api-logout': (4, 0.5, 1000),
+        'api-register': (6, 0.5, 1000),
+    }
+    results = []
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='buyer', password='secret', first_name='Buyer')
+        categories = []
+        for i in range(cls.categories_count):
+            parent = categories[i // 4] if i >= 4 else None
+            categories.append(Category.objects.create(title=f'Category {i}', parent_category=parent,
+                                                      image='category/image.jpg'))
+        cls.category = categories[0]
+        tags = Tag.objects.bulk_create(Tag(name=f'tag {i}') for i in range(20))
+        Item.objects.bulk_create(
+            (Item(name=f'Item {i}', description='Description', price=Decimal(i % 500 + 1), count=i % 50 + 1,
+                  category=categories[i % len(categories)], free_delivery=i % 3 == 0)
+             for i in range(cls.items_count)),
+            batch_size=500,
+        )
+        items = list(Item.objects.order_by('pk'))
+        cls.item = items[0]
+        Item.tags.through.objects.bulk_create(
+            Item.tags.through(item=item, tag=tags[i % len(tags)]) for i, item in enumerate(items)
+        )
+        ItemImage.objects.bulk_create(ItemImage(item=item, src='products/image.jpg') for item in items)
+        Specification.objects.bulk_create(Specification(item=item, name='Weight', value='1 kg') for item in items)
+        FeedBack.objects.bulk_create(
+            FeedBack(item=item, author='Author', email='author@example.com', text='Text', rate=(i + j) % 5 + 1)
+            for i, item in enumerate(items) for j in range(cls.reviews_per_item)
+        )
+        Item.objects.rebuild_ratings()
+        get_backend().rebuild()
+        orders = Order.objects.bulk_create(
+            Order(customer=cls.user, total_amount=100, status={0: 'active', 1: 'payment'}.get(i, 'pending'))
+            for i in range(cls.orders_count)
+        )
+        Basket.objects.bulk_create(
+            Basket(order=order, item=items[i * 5 + j], quantity=1) for i, order in enumerate(orders) for j in range(5)
+        )
+        cls.order, cls.confirmed_order, cls.placed_order = orders[:3]
+        sale = Sale.objects.create(title='Sale', discount=10, date_from='2024-01-01', date_to='2024-12-31')
+        SaleItem.objects.bulk_create(SaleItem(sale=sale, item=item) for item in items[:50])
+
+    @classmethod
+    def tearDownClass(cls):
+        report = os.environ.get('API_BUDGET_REPORT')
+        if report:
+            with open(report, 'w') as report_file:
+                json.dump(cls.results, report_file, indent=2)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+
+    def get_requests(self):
+        """(route name, method, url kwargs, query params or body, body content type, log in first)"""
+        credentials = json.dumps({'username': 'buyer', 'password': 'secret'})
+        form = 'application/x-www-form-urlencoded'
+        return [
+            ('basket_api', 'get', {}, {}, None, True),
+            ('basket_api', 'post', {}, {'id': self.item.pk, 'count': 2}, 'application/json', True),
+            ('basket_api', 'delete', {}, {'id': self.order.basket_set.first().item_id, 'count': 1},
+             'application/json', True),
+            ('basket_batch_api', 'post', {},
+             [{'id': self.item.pk, 'count': 2}, {'id': self.order.basket_set.first().item_id, 'count': -1}]
+             + [{'id': item_id, 'count': 1} for item_id in range(self.item.pk + 100, self.item.pk + 110)],
+             'application/json', True),
+            ('catalog_api', 'get', {}, {'sort': 'price', 'sortType': 'inc', 'limit': 20}, None, False),
+            ('catalog_api', 'get', {}, {'filter[name]': 'item', 'category': self.category.pk, 'limit': 20},
+             None, False),
+            ('catalogid_api', 'get', {'id': self.category.pk}, {'limit': 20}, None, False),
+            ('categories_api', 'get', {}, {}, None, False),
+            ('tags_api', 'get', {}, {}, None, False),
+            ('orders_api', 'get', {}, {}, None, True),
+            ('orders_api', 'post', {}, {}, 'application/json', True),
+            ('orders_history_api', 'get', {}, {'limit': 100}, None, True),
+            ('orders_details_id_api', 'get', {'id': self.order.pk}, {}, None, True),
+            ('orders_id_api', 'get', {'id': self.order.pk}, {}, None, True),
+            ('orders_id_api', 'post', {'id': self.placed_order.pk},
+             {'fullName': 'Buyer Name', 'deliveryType': 'ordinary', 'paymentType': 'online', 'city': 'City',
+              'address': 'Address'}, 'application/json', True),
+            ('payment_id_api', 'post', {'id': self.confirmed_order.pk}, {'number': '1234'}, 'application/json', True),
+            ('payment_someone_api', 'post', {}, {'number': '1234'}, 'application/json', True),
+            ('api-product-detail', 'get', {'id': self.item.pk}, {}, None, False),
+            ('api-products-popular', 'get', {}, {}, None, False),
+            ('api-products-limited', 'get', {}, {}, None, False),
+            ('api-products-reviews', 'get', {'pk': self.item.pk}, {}, None, False),
+            ('api-products-reviews', 'post', {'pk': self.item.pk},
+             {'author': 'Author', 'email': 'author@example.com', 'text': 'Text', 'rate': 5}, 'application/json',
+             False),
+            ('api-banners', 'get', {}, {}, None, False),
+            ('api-profile', 'get', {}, {}, None, True),
+            ('api-profile', 'post', {}, {'fullName': 'Buyer Name', 'email': 'buyer@example.com'},
+             'application/json', True),
+            ('api-password', 'post', {}, {'currentPassword': 'secret', 'newPassword': 'secret2'},
+             'application/json', True),
+            ('api-sale', 'get', {}, {}, None, False),
+            ('api-login', 'post', {}, credentials, form, False),
+            ('api-logout', 'post', {}, {}, 'application/json', True),
+            ('api-register', 'post', {}, json.dumps({'name': 'New', 'username': 'new', 'password': 'secret'}),
+             form, False),
+        ]
+
+    def measure(self, name, method, kwargs, data, content_type, login):
+        self.client.logout()
+        if login:
+            self.client.force_login(self.user)
+        url = reverse(f'api:{name}', kwargs=kwargs)
+        if content_type == 'application/json':
+            data = json.dumps(data)
+        request_kwargs = {'content_type': content_type} if content_type else {}
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(self.client, method)(url, data, **request_kwargs)
+            elapsed = time.perf_counter() - started
+        return {
+            'route': name,
+            'method': method.upper(),
+            'status': response.status_code,
+            'queries': len(queries.captured_queries),
+            'time': round(elapsed, 4),
+            'size': len(response.content),
+        }
+
+    def test_every_route_has_a_budget(self):
+        from api.urls import urlpatterns
+
+        routes = {pattern.name for pattern in urlpatterns if pattern.name}
+        measured = {request[0] for request in self.get_requests()}
+
+        self.assertEqual(routes - set(self.budgets), set())
+        self.assertEqual(routes - measured, set())
+
+    def check_all(self, check):
+        """Measure every request and pass the result to ``check`` inside the request's subTest."""
+        for request in self.get_requests():
+            with self.subTest(route=request[0], method=request[1]):
+                with transaction.atomic():
+                    result = self.measure(*request)
+                    transaction.set_rollback(True)
+                check(result)
+
+    def test_endpoints_stay_within_budget(self):
+        def check(result):
+            type(self).results.append(result)
+            max_queries, _, max_size = self.budgets[result['route']]
+            self.assertLess(result['status'], 500, result)
+            self.assertLessEqual(result['queries'], max_queries, result)
+            self.assertLessEqual(result['size'], max_size, result)
+
+        self.check_all(check)
+
+    @tag('benchmark')
+    def test_endpoints_stay_within_time_budget(self):
+        def check(result):
+            self.assertLessEqual(result['time'], self.budgets[result['route']][1], result)
+
+        self.check_all(check)
+
+
+
+class ListingQueryScalingTestCase(TestCase):
+    """The item lists issue as many queries for 30 items as for 3."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='buyer', password='secret')
+        self.tag = Tag.objects.create(name='tag')
+        self.sale = Sale.objects.create(title='Sale', discount=10, date_from='2024-01-01', date_to='2024-12-31')
+        self.order = Order.objects.create(customer=self.user, total_amount=0)
+        self.created = 0
+
+    def add_items(self, count):
+        for i in range(self.created, self.created + count):
+            category = Category.objects.create(title=f'Category {i}', image='category/image.jpg')
+            item = Item.objects.create(name=f'Item {i}', description='Description', price=100, count=1,
+                                       category=category)
+            item.tags.add(self.tag)
+            Specification.objects.create(item=item, name='Weight', value='1 kg')
+            ItemImage.objects.create(item=item, src='products/image.jpg')
+            FeedBack.objects.create(item=item, author='Author', email='author@example.com', text='Text', rate=4)
+            SaleItem.objects.create(sale=self.sale, item=item)
+            Banner.objects.create(item=item, position=i)
+            Basket.objects.create(order=self.order, item=item, quantity=1)
+            archived = Order.objects.create(customer=self.user, total_amount=0, status='archived')
+            Basket.objects.create(order=archived, item=item, quantity=1)
+        self.created += count
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries.captured_queries)
+
+    def test_item_lists_use_fixed_query_count(self):
+        self.client.force_login(self.user)
+        urls = [reverse('api:api-products-popular'),
+                reverse('api:api-products-limited'),
+                reverse('api:api-banners'),
+                reverse('api:api-sale'),
+                reverse('api:basket_api'),
+                reverse('api:orders_api')]
+        self.add_items(3)
+        small = {url: self.count_queries(url) for url in urls}
+        self.add_items(27)
+        large = {url: self.count_queries(url) for url in urls}
+
+        self.assertEqual(small, large)
+
+class InstrumentationMiddlewareTestCase(TestCase):
+    def setUp(self):
+        Item.objects.create(name='Item', description='Description', price=100)
+
+    def server_timing(self, response):
+        return dict(re.findall(r'(\w+);dur=([\d.]+)', response['Server-Timing']))
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api:catalog_api'))
+
+        self.assertIn(f'desc="{len(queries.captured_queries)} queries"', response['Server-Timing'])
+        timings = {name: float(duration) for name, duration in self.server_timing(response).items()}
+        self.assertEqual(set(timings), {'db', 'serialize', 'render', 'app', 'total'})
+        self.assertGreater(timings['serialize'], 0)
+        self.assertGreater(timings['render'], 0)
+        self.assertAlmostEqual(timings['db'] + timings['serialize'] + timings['render'] + timings['app'],
+                               timings['total'], delta=0.2)
+
+    def test_serialize_time_counts_nesting_once_and_leaves_out_queries(self):
+        recorder = QueryRecorder()
+        timer = SerializeTimer(recorder)
+        self.addCleanup(serialize_timer.reset, serialize_timer.set(timer))
+
+        with mock.patch('api.middleware.time.perf_counter', side_effect=[0.0, 1.0, 3.0]):
+            with measure_serialization():
+                with measure_serialization():
+                    recorder.duration += 0.5
+
+        self.assertEqual(timer.duration, 2.5)
+
+    def test_only_response_serializers_are_timed(self):
+        self.assertIsInstance(ItemCardSerializer([], many=True), TimedListSerializer)
+        self.assertNotIsInstance(ItemImageSerializer([], many=True), TimedListSerializer)
+        self.assertNotIsInstance(BasketChangeSerializer(data=[], many=True), TimedListSerializer)
+
+    @override_settings(REQUEST_INSTRUMENTATION=False)
+    def test_can_be_switched_off(self):
+        response = self.client.get(reverse('api:catalog_api'))
+
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(REPEATED_QUERY_THRESHOLD=3)
+    def test_repeated_queries_are_logged(self):
+        request = RequestFactory().get('/api/items')
+
+        def n_plus_one(request):
+            for item in Item.objects.all():
+                for pk in range(4):
+                    list(Item.objects.filter(pk__in=range(pk + 1)))
+            return HttpResponse()
+
+        with self.assertLogs('api.middleware', 'WARNING') as logs:
+            InstrumentationMiddleware(n_plus_one)(request)
+
+        self.assertIn('Repeated queries in GET /api/items 200', logs.output[0])
+        self.assertIn('4x SELECT', logs.output[0])
+        self.assertIn('IN (...)', logs.output[0])
+
+    @override_settings(SLOW_REQUEST_THRESHOLD=0)
+    def test_slow_requests_are_logged(self):
+        with self.assertLogs('api.middleware', 'WARNING') as logs:
+            self.client.get(reverse('api:tags_api'))
+
+        self.assertIn('Slow request GET /api/tags/ 200', logs.output[0])
+
+    def test_fast_requests_are_not_logged(self):
+        with self.assertNoLogs('api.middleware'):
+            self.client.get(reverse('api:tags_api'))
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        Item.objects.create(name='Item', description='Description', price=100, count=10)
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if line and not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_only_staff_and_the_token_can_read_metrics(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(response.status_code, 403)
+        with override_settings(METRICS_TOKEN=None):
+            response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer None'})
+            self.assertEqual(response.status_code, 403)
+
+        user = CustomUser.objects.create_user(username='buyer', password='secret')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        user.is_staff = True
+        user.save(update_fields=['is_staff'])
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    def test_request_metrics(self):
+        requests = 'api_requests_total{route="api:catalog_api",method="GET",status="200"}'
+        duration = 'api_request_duration_seconds_count{route="api:catalog_api",method="GET"}'
+        before = self.scrape()
+        self.client.get(reverse('api:catalog_api'))
+        self.client.get(reverse('api:catalog_api'))
+        after = self.scrape()
+
+        self.assertEqual(after[requests] - before.get(requests, 0), 2)
+        self.assertEqual(after[duration] - before.get(duration, 0), 2)
+        self.assertEqual(after['api_request_db_queries_bucket{route="api:catalog_api",method="GET",le="+Inf"}'],
+                         after['api_request_db_queries_count{route="api:catalog_api",method="GET"}'])
+
+    def test_order_transitions_and_basket_changes(self):
+        created = metrics.order_transitions.get(from_status='', to_status='active')
+        paid = metrics.order_transitions.get(from_status='payment', to_status='delivery')
+        added = metrics.basket_changes.get(action='add')
+        user = CustomUser.objects.create_user(username='buyer', password='secret')
+        self.client.force_login(user)
+
+        self.client.post(reverse('api:basket_api'), json.dumps({'id': Item.objects.get().pk, 'count': 1}),
+                         content_type='application/json')
+        order = Order.objects.get()
+        self.client.post(reverse('api:orders_api'))
+        self.client.post(reverse('api:orders_id_api', kwargs={'id': order.pk}), {})
+        self.client.post(reverse('api:payment_id_api', kwargs={'id': order.pk}), {})
+
+        self.assertEqual(metrics.order_transitions.get(from_status='', to_status='active'), created + 1)
+        self.assertEqual(metrics.order_transitions.get(from_status='payment', to_status='delivery'), paid + 1)
+        self.assertEqual(metrics.basket_changes.get(action='add'), added + 1)
+
+    def test_processes_are_added_up_through_the_shared_directory(self):
+        counter = metrics.registry.counter('test_forked_total', 'Incremented by forked processes.', ['worker'])
+        self.addCleanup(metrics.registry.metrics.pop, counter.name)
+        context = multiprocessing.get_context('fork')
+
+        def work(worker):
+            counter.inc(worker=worker)
+            counter.inc(worker='any')
+            metrics.registry.flush()
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            counter.inc(worker='any')
+            processes = [context.Process(target=work, args=(str(worker),)) for worker in range(3)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            samples = self.scrape()
+
+        self.assertEqual(samples['test_forked_total{worker="any"}'], 4)
+        self.assertEqual(samples['test_forked_total{worker="0"}'], 1)
+        self.assertEqual(samples['test_forked_total{worker="2"}'], 1)
+
+
+class BasketConcurrencyTestCase(TransactionTestCase):
+    threads = 8
+    additions = 10
+
+    def setUp(self):
+        self.item = Item.objects.create(name='Item', description='Description', price=100)
+        self.user = CustomUser.objects.create_user(username='buyer', password='secret')
+
+    def hammer(self, method, data):
+        errors = []
+
+        def work():
+            client = Client()
+            client.force_login(self.user)
+            try:
+                for _ in range(self.additions):
+                    response = getattr(client, method)(reverse('api:basket_api'), json.dumps(data),
+                                                       content_type='application/json')
+                    self.assertLess(response.status_code, 300)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work) for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_concurrent_additions_are_not_lost(self):
+        self.hammer('post', {'id': self.item.pk, 'count': 1})
+
+        order = Order.objects.get(customer=self.user, status='active')
+        self.assertEqual(Basket.objects.get(order=order, item=self.item).quantity, self.threads * self.additions)
+
+    def test_concurrent_removals_empty_the_basket(self):
+        self.hammer('post', {'id': self.item.pk, 'count': 1})
+        self.hammer('delete', {'id': self.item.pk, 'count': 1})
+
+        self.assertFalse(Order.objects.filter(customer=self.user, status='active').exists())
+        self.assertFalse(Basket.objects.exists())
+
+
+class AnonymousBasketTestCase(TestCase):
+    def setUp(self):
+        self.phone = Item.objects.create(name='Phone', description='Description', price=100)
+        self.lamp = Item.objects.create(name='Lamp', description='Description', price=10)
+        self.user = CustomUser.objects.create_user(username='buyer', password='secret')
+
+    def add(self, item, count):
+        return self.client.post(reverse('api:basket_api'), json.dumps({'id': item.pk, 'count': count}),
+                                content_type='application/json')
+
+    def basket(self):
+        return {line['id']: line['count'] for line in self.client.get(reverse('api:basket_api')).json()}
+
+    def test_basket_is_kept_in_the_session(self):
+        self.add(self.phone, 1)
+        self.add(self.phone, 2)
+        self.add(self.lamp, 1)
+        response = self.client.delete(reverse('api:basket_api'), json.dumps({'id': self.lamp.pk, 'count': 1}),
+                                      content_type='application/json')
+
+        self.assertEqual([line['count'] for line in response.json()], [3])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.basket(), {self.phone.pk: 3})
+        self.assertFalse(any('myauth_customuser' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(CustomUser.objects.count(), 1)
+        self.assertFalse(Order.objects.exists())
+
+    def test_login_merges_the_session_basket_into_the_active_order(self):
+        order = Order.objects.create(customer=self.user, total_amount=0)
+        Basket.objects.create(order=order, item=self.phone, quantity=1)
+        self.add(self.phone, 2)
+        self.add(self.lamp, 1)
+
+        response = self.client.post(reverse('api:api-login'), json.dumps({'username': 'buyer', 'password': 'secret'}),
+                                    content_type='application/x-www-form-urlencoded')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.basket(), {self.phone.pk: 3, self.lamp.pk: 1})
+        self.assertEqual(Order.objects.get().pk, order.pk)
+        self.assertNotIn(SessionBasket.session_key, self.client.session)
+
+    def test_count_must_be_a_positive_number(self):
+        for user in [None, self.user]:
+            if user:
+                self.client.force_login(user)
+            for count in [0, -2, 'two']:
+                with self.subTest(user=user, count=count):
+                    self.assertEqual(self.add(self.phone, count).status_code, 400)
+                    response = self.client.delete(reverse('api:basket_api'),
+                                                  json.dumps({'id': self.phone.pk, 'count': count}),
+                                                  content_type='application/json')
+                    self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.basket(), {})
+        self.assertNotIn(SessionBasket.session_key, self.client.session)
+        self.assertFalse(Basket.objects.exists())
+
+
+class BasketBatchTestCase(TestCase):
+    def setUp(self):
+        self.items = [Item.objects.create(name=f'Item {i}', description='Description', price=100 + i) for i in range(30)]
+        self.user = CustomUser.objects.create_user(username='buyer', password='secret')
+
+    def batch(self, changes):
+        return self.client.post(reverse('api:basket_batch_api'), json.dumps(changes), content_type='application/json')
+
+    def test_changes_are_applied_at_once(self):
+        self.client.force_login(self.user)
+        order = Order.objects.create(customer=self.user, total_amount=0)
+        Basket.objects.create(order=order, item=self.items[0], quantity=2)
+        Basket.objects.create(order=order, item=self.items[1], quantity=1)
+
+        response = self.batch([{'id': self.items[0].pk, 'count': 3}, {'id': self.items[1].pk, 'count': -1},
+                               {'id': self.items[2].pk, 'count': 1}, {'id': self.items[2].pk, 'count': 1}])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({line['id']: line['count'] for line in response.json()},
+                         {self.items[0].pk: 5, self.items[2].pk: 2})
+        self.assertEqual(Basket.objects.get(order=order, item=self.items[2]).sale_price, 102)
+
+        self.batch([{'id': self.items[0].pk, 'count': -5}, {'id': self.items[2].pk, 'count': -9}])
+        self.assertFalse(Order.objects.exists())
+
+    def test_query_count_does_not_depend_on_the_number_of_changes(self):
+        self.client.force_login(self.user)
+        self.batch([{'id': self.items[0].pk, 'count': 1}])
+        counts = []
+        for items in [self.items[1:3], self.items[3:]]:
+            with CaptureQueriesContext(connection) as queries:
+                self.batch([{'id': item.pk, 'count': 1} for item in items])
+            counts.append(len(queries.captured_queries))
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(Basket.objects.count(), 30)
+
+    def test_anonymous_basket(self):
+        self.batch([{'id': self.items[0].pk, 'count': 2}, {'id': self.items[1].pk, 'count': 1}])
+        response = self.batch([{'id': self.items[1].pk, 'count': -1}])
+
+        self.assertEqual([(line['id'], line['count']) for line in response.json()], [(self.items[0].pk, 2)])
+        self.assertFalse(Order.objects.exists())
+
+    def test_invalid_changes_are_rejected(self):
+        self.client.force_login(self.user)
+
+        self.assertEqual(self.batch([{'id': 0, 'count': 1}]).status_code, 400)
+        self.assertEqual(self.batch([{'id': self.items[0].pk}]).status_code, 400)
+        self.assertEqual(self.batch({'id': self.items[0].pk, 'count': 1}).status_code, 400)
+        self.assertFalse(Basket.objects.exists())
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class CheckoutContentionTestCase(TransactionTestCase):
+    stock = 10
+    buyers = 24
+
+    def setUp(self):
+        self.item = Item.objects.create(name='Item', description='Description', price=100, count=self.stock)
+        self.users = []
+        for number in range(self.buyers):
+            user = CustomUser.objects.create_user(username=f'buyer{number}', password='secret')
+            order = Order.objects.create(customer=user, total_amount=0)
+            Basket.objects.create(order=order, item=self.item, quantity=1, sale_price=100)
+            self.users.append(user)
+
+    def test_parallel_checkouts_never_oversell(self):
+        statuses = []
+        barrier = threading.Barrier(self.buyers)
+
+        def checkout(user):
+            client = Client()
+            client.force_login(user)
+            barrier.wait()
+            try:
+                statuses.append(client.post(reverse('api:orders_api')).status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(user,)) for user in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [200] * self.stock + [409] * (self.buyers - self.stock))
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.count, 0)
+        self.assertEqual(StockReservation.objects.filter(status=StockReservation.HELD).count(), self.stock)
+        self.assertEqual(Order.objects.filter(status='pending').count(), self.stock)
+
+
+class OrderHistoryTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='buyer', password='secret', first_name='Buyer',
+                                              last_name='Name')
+        cls.other = CustomUser.objects.create_user(username='other', password='secret')
+        cls.items = [Item.objects.create(name=f'Item {i}', description='Description', price=100,
+                                         free_delivery=i % 2 == 0) for i in range(5)]
+
+    def create_orders(self, customer, count):
+        orders = Order.objects.bulk_create(
+            Order(customer=customer, total_amount=300, status='archived', city='City', address='Address')
+            for _ in range(count)
+        )
+        Basket.objects.bulk_create(
+            Basket(order=order, item=item, quantity=index + 1, line_total=100 * (index + 1), **Basket.snapshot_of(item))
+            for order in orders for index, item in enumerate(self.items[:3])
+        )
+        return orders
+
+    def get(self, params=None):
+        response = self.client.get(reverse('api:orders_history_api'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_compact_summary(self):
+        order, = self.create_orders(self.user, 1)
+        self.create_orders(self.other, 2)
+        self.client.force_login(self.user)
+
+        data = self.get()
+
+        self.assertEqual((data['currentPage'], data['lastPage'], data['nextCursor']), (1, 1, None))
+        summary, = data['items']
+        self.assertEqual(summary['id'], order.pk)
+        self.assertEqual((summary['fullName'], summary['totalCost'], summary['status'], summary['deliveryType']),
+                         ('Buyer Name', '300.00', 'archived', 'paid'))
+        self.assertEqual(summary['products'], [
+            {'id': item.pk, 'title': item.name, 'count': index + 1, 'price': '100.00'}
+            for index, item in enumerate(self.items[:3])
+        ])
+
+    def test_anonymous_user_has_no_history(self):
+        self.create_orders(self.user, 1)
+
+        self.assertEqual(self.get()['items'], [])
+
+    def test_cursor_walks_all_orders_newest_first(self):
+        orders = self.create_orders(self.user, 25)
+        self.client.force_login(self.user)
+
+        seen, params = [], {'limit': 10}
+        while True:
+            data = self.get(params)
+            seen.extend(summary['id'] for summary in data['items'])
+            if not data['nextCursor']:
+                break
+            params = {'limit': 10, 'cursor': data['nextCursor']}
+
+        self.assertEqual(seen, sorted((order.pk for order in orders), reverse=True))
+
+    def test_order_list_is_paged_too(self):
+        orders = self.create_orders(self.user, 25)
+        self.client.force_login(self.user)
+
+        data = self.client.get(reverse('api:orders_api')).json()
+        following = self.client.get(reverse('api:orders_api'), {'cursor': data['nextCursor']}).json()
+
+        self.assertEqual((data['currentPage'], data['lastPage']), (1, 3))
+        self.assertEqual([order['id'] for order in data['items'] + following['items']],
+                         sorted((order.pk for order in orders), reverse=True)[:20])
+
+    def test_query_count_does_not_depend_on_the_number_of_orders(self):
+        self.client.force_login(self.user)
+        counts, created = [], 0
+        for size in [1, 100, 1000]:
+            self.create_orders(self.user, size - created)
+            created = size
+            with CaptureQueriesContext(connection) as queries:
+                data = self.get({'limit': 100})
+            self.assertEqual(len(data['items']), min(size, 100))
+            counts.append(len(queries.captured_queries))
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(counts[1], counts[2])
+
+
+class OrderSnapshotTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='buyer', password='secret')
+        self.item = Item.objects.create(name='Kettle', description='Description', price=Decimal('199.99'),
+                                        discount=15, count=10, free_delivery=True)
+        ItemImage.objects.create(item=self.item, src='products/kettle.jpg')
+        self.client.force_login(self.user)
+
+    def checkout(self):
+        self.client.post(reverse('api:basket_api'), {'id': self.item.pk, 'count': 3})
+        order_id = self.client.post(reverse('api:orders_api')).json()['orderId']
+        return Order.objects.get(pk=order_id)
+
+    def test_catalog_card_basket_and_order_use_the_same_price(self):
+        card, = self.client.get(reverse('api:catalog_api')).json()['items']
+        basket_line = self.client.post(reverse('api:basket_api'), {'id': self.item.pk, 'count': 1}).json()
+
+        self.assertEqual(Decimal(str(card['salePrice'])), Decimal('169.99'))
+        self.assertEqual(Decimal(str(basket_line['price'])), Decimal('169.99'))
+        self.assertEqual(Basket.objects.get().line_total, Decimal('169.99'))
+
+    def test_checkout_freezes_the_lines(self):
+        order = self.checkout()
+
+        self.assertEqual(order.total_amount, Decimal('509.97'))
+        Item.objects.filter(pk=self.item.pk).update(name='Renamed', price=1, discount=0, free_delivery=False)
+        ItemImage.objects.all().delete()
+
+        data = self.client.get(reverse('api:orders_id_api', kwargs={'id': order.pk})).json()
+        self.assertEqual((data['totalCost'], data['deliveryType']), (509.97, 'free'))
+        self.assertEqual(data['products'], [{
+            'id': self.item.pk, 'title': 'Kettle', 'description': 'Description', 'price': '169.99',
+            'unitPrice': '199.99', 'discount': 15, 'count': 3, 'total': '509.97', 'freeDelivery': True,
+            'images': [{'src': '/media/products/kettle.jpg', 'alt': 'Kettle'}],
+        }])
+
+    def test_basket_lines_carry_description_and_image_before_checkout(self):
+        self.client.post(reverse('api:basket_api'), {'id': self.item.pk, 'count': 1})
+
+        order, = self.client.get(reverse('api:orders_api')).json()['items']
+        line, = order['products']
+        self.assertEqual(line['description'], 'Description')
+        self.assertEqual(line['images'], [{'src': '/media/products/kettle.jpg', 'alt': 'Kettle'}])
+
+    def test_delivery_is_charged_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            DeliverySettings.objects.create(delivery_type='ordinary', standard_delivery_fee=200,
+                                            free_delivery_threshold=2000)
+        self.addCleanup(pricing.invalidate)
+        order = self.checkout()
+        url = reverse('api:orders_id_api', kwargs={'id': order.pk})
+        for _ in range(2):
+            self.client.post(url, {'deliveryType': 'ordinary', 'paymentType': 'online', 'city': 'City',
+                                   'address': 'Address'}, content_type='application/json')
+
+        order.refresh_from_db()
+        self.assertEqual((order.delivery_fee, order.total_amount), (200, Decimal('709.97')))
+
+    def test_status_follows_the_checkout_steps(self):
+        order = self.checkout()
+        payment_url = reverse('api:payment_id_api', kwargs={'id': order.pk})
+
+        self.assertEqual(self.client.post(payment_url, {}).status_code, 409)
+        self.client.post(reverse('api:orders_id_api', kwargs={'id': order.pk}), {})
+        self.assertEqual(self.client.post(payment_url, {}).status_code, 200)
+        self.assertEqual(self.client.post(payment_url, {}).json()['status'], 'delivery')
+        self.assertEqual(list(order.events.order_by('pk').values_list('from_status', 'to_status')),
+                         [('active', 'pending'), ('pending', 'payment'), ('payment', 'delivery')])
+
+    def test_order_pages_do_not_read_items(self):
+        order = self.checkout()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('api:orders_id_api', kwargs={'id': order.pk}))
+            self.client.get(reverse('api:orders_history_api'))
+
+        self.assertFalse([query for query in queries.captured_queries if 'shopapp_item' in query['sql']])
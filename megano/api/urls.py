@@ -12,8 +12,10 @@ from .views import (CategoriesAPIView,
                     ProfileAPIView,
                     TagView,
                     BasketAPIView,
+                    BasketBatchAPIView,
                     OrderAPIView,
                     OrderDetailAPIView,
+                    OrderHistoryAPIView,
                     PaymentAPIView,
                     LoginApiView, LogoutApiView, RegisterApiView, SalesAPIView,
                     )
@@ -25,11 +27,13 @@ app_name = 'api'
 urlpatterns = [
     # path('about/', TemplateView.as_view(template_name="frontend/about.html")),
     path('basket', BasketAPIView.as_view(), name='basket_api'),
+    path('basket/batch', BasketBatchAPIView.as_view(), name='basket_batch_api'),
     path('catalog/', CatalogListView.as_view(), name='catalog_api'),
     path('catalog/<int:id>/', CatalogListView.as_view(), name='catalogid_api'),
     path('categories/', CategoriesAPIView.as_view(), name='categories_api'),
     path('tags/', TagView.as_view(), name='tags_api'),
     path('orders', OrderAPIView.as_view(), name='orders_api'),
+    path('orders/history', OrderHistoryAPIView.as_view(), name='orders_history_api'),
     # path('history-order/', TemplateView.as_view(template_name="frontend/historyorder.html")),
     path('order/<int:id>', OrderDetailAPIView.as_view(), name='orders_details_id_api'),
     path('orders/<int:id>', OrderDetailAPIView.as_view(), name='orders_id_api'),
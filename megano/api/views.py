@@ -2,20 +2,36 @@ from django.contrib.auth import authenticate, login, logout
 from datetime import datetime
 
 import logging
+import math
 import json
-from django.db.models import Avg, OuterRef, Subquery, Count
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
 from django.shortcuts import get_object_or_404
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.generics import (ListAPIView,
                                      RetrieveAPIView,)
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.request import Request
 from rest_framework.views import APIView
-from shopapp.models import Item, Category, FeedBack, Tag, Basket, Order, DeliverySettings, Sale, SaleItem
+from shopapp.cache import get_version
+from shopapp.models import (Banner, Item, Category, FeedBack, Tag, Basket, Order, OutOfStock, Sale, SaleItem,
+                            StockReservation)
+from shopapp.order_states import can_transition
+from shopapp.pricing import pricing
+from shopapp.search import search_items
 from myauth.models import CustomUser
+from django.conf import settings
 from django.contrib.auth.models import Group
-from .serializers import (CategorySerializer,
+from .basket import SessionBasket
+from .cache import CachedResponseMixin, get_or_build
+from .metrics import basket_changes
+from .pagination import CatalogPagination, OrderHistoryPagination, ReviewPagination
+from .serializers import (BannerSerializer,
+                          BasketChangeSerializer,
+                          BasketLineSerializer,
+                          CategoryTreeSerializer,
                           ItemSerializer,
+                          ItemCardSerializer,
                           ItemFilter,
                           FeedBackSerializer,
                           UserSerializer,
@@ -24,6 +40,7 @@ from .serializers import (CategorySerializer,
                           TagSerializer,
                           BasketItemSerializer,
                           OrderDetailSerializer,
+                          OrderHistorySerializer,
                           SalesItemSerializer)
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
@@ -34,10 +51,23 @@ logger = logging.getLogger(__name__)
 
 
 class CategoriesAPIView(APIView):
+    cache_namespace = 'categories'
+
     def get(self, request: Request, *args, **kwargs) -> Response:
-        categories = Category.objects.filter(parent_category__isnull=True)
-        serializer = CategorySerializer(categories, many=True)
-        return Response(serializer.data)
+        version = get_version(self.cache_namespace)
+        etag = f'"{self.cache_namespace}-{version}"'
+        if request.headers.get('If-None-Match') == etag:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        data = get_or_build(self.cache_namespace, 'categories', 'tree', self.build_tree)
+        return Response(data, headers={'ETag': etag})
+
+    def build_tree(self):
+        children = {}
+        for category in Category.objects.order_by('pk'):
+            children.setdefault(category.parent_category_id, []).append(category)
+        roots = children.get(None, [])
+        return CategoryTreeSerializer(roots, many=True, context={'children': children}).data
 
 
 class TagView(APIView):
@@ -48,13 +78,20 @@ class TagView(APIView):
 
 
 class CatalogListView(ListAPIView):
-    queryset = Item.objects.filter(archived=False)
-    serializer_class = ItemSerializer
+    queryset = Item.objects.filter(archived=False).for_cards()
+    serializer_class = ItemCardSerializer
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_class = ItemFilter
     ordering_fields = ['rating', 'price', 'reviews', 'date']
     ordering = 'date'
-    pagination_class = PageNumberPagination
+    pagination_class = CatalogPagination
+    sort_fields = {
+        'rating': 'rating_avg',
+        'price': 'price',
+        'reviews': 'review_count',
+        'date': 'date',
+        'relevance': 'search_rank',
+    }
 
     def list(self, request, *args, **kwargs):
         name = request.GET.get('filter[name]', '')
@@ -65,12 +102,13 @@ class CatalogListView(ListAPIView):
         category_id = request.GET.get('category', None)
         sort = request.GET.get('sort', 'date')
         sort_type = request.GET.get('sortType', 'dec')
-        tags = request.GET.getlist('tags', [])
+        tags = request.GET.getlist('tags', []) or request.GET.getlist('tags[]', [])
+        with_facets = request.GET.get('facets') == 'true'
 
-        queryset = Item.objects.all()
+        queryset = self.get_queryset()
 
         if name:
-            queryset = queryset.filter(name__icontains=name)
+            queryset = search_items(queryset, name)
         if min_price:
             queryset = queryset.filter(price__gte=min_price)
         if max_price:
@@ -82,36 +120,69 @@ class CatalogListView(ListAPIView):
         if free_delivery == 'true':
             queryset = queryset.filter(free_delivery=True)
         if category_id:
-            category_instance = Category.objects.get(id=category_id)
-            category_serializer = CategorySerializer(instance=category_instance)
-            subcategories = category_serializer.get_subcategories(category_instance)
-            subcategory_ids = [subcategory['id'] for subcategory in subcategories]
-            all_categories = [category_instance.id] + subcategory_ids
-            queryset = queryset.filter(category__in=all_categories)
-        if sort == 'rating':
-            queryset = queryset.annotate(avg_rating=Avg('feedbacks__rate'))
-            queryset = queryset.order_by('-avg_rating' if sort_type == 'dec' else 'avg_rating')
-        elif sort == 'price':
-            queryset = queryset.order_by('-price' if sort_type == 'dec' else 'price')
-        elif sort == 'reviews':
-            queryset = queryset.annotate(feedbacks_count=Count('feedbacks'))
-            queryset = queryset.order_by('-feedbacks_count' if sort_type == 'dec' else 'feedbacks_count')
-        elif sort == 'date':
-            queryset = queryset.order_by('-date' if sort_type == 'dec' else 'date')
-
-        serialized_items = self.get_serializer(queryset, many=True).data
-        data = {
-            'items': serialized_items,
+            if not category_id.isdecimal():
+                raise NotFound('Unknown category')
+            category_instance = get_object_or_404(Category, id=category_id)
+            queryset = queryset.filter(category__in=category_instance.descendant_ids())
+        if tags:
+            try:
+                tags = [int(tag) for tag in tags]
+            except ValueError:
+                raise ValidationError({'tags': ['Tag ids must be integers']})
+            queryset = queryset.filter(pk__in=Item.tags.through.objects.filter(tag__in=tags).values('item'))
+        facets = self.get_facets(queryset) if with_facets else None
+        # The facets already counted the result set; the paginator does not need to again.
+        self.result_count = facets['total'] if facets else None
+
+        if sort not in self.sort_fields or (sort == 'relevance' and not name):
+            sort = 'date'
+        sort_field = self.sort_fields[sort]
+        descending = sort_type == 'dec'
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(f'{prefix}{sort_field}', f'{prefix}pk')
+        self.keyset_ordering = (sort_field, descending)
+
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        response = self.get_paginated_response(serializer.data)
+        if facets is not None:
+            response.data['facets'] = facets
+        return response
+
+    def get_facets(self, queryset):
+        """
+        Filter counts for the current result set, in two grouped queries: the totals are
+        added up from the per-category rows, so the items are scanned once for both.
+        """
+        queryset = queryset.order_by()
+        rows = list(queryset.values('category').annotate(
+            count=Count('pk'),
+            min_price=Min('price'),
+            max_price=Max('price'),
+            free_delivery=Count('pk', filter=Q(free_delivery=True)),
+            available=Count('pk', filter=Q(available=True)),
+        ).order_by('category'))
+        prices = [row['min_price'] for row in rows] + [row['max_price'] for row in rows]
+        tags = (Item.tags.through.objects.filter(item__in=queryset.values('pk'))
+                .values('tag', 'tag__name').annotate(count=Count('item')).order_by('tag'))
+        return {
+            'total': sum(row['count'] for row in rows),
+            'price': {'min': min(prices, default=None), 'max': max(prices, default=None)},
+            'freeDelivery': sum(row['free_delivery'] for row in rows),
+            'available': sum(row['available'] for row in rows),
+            'categories': [{'id': row['category'], 'count': row['count']}
+                           for row in rows if row['category'] is not None],
+            'tags': [{'id': row['tag'], 'name': row['tag__name'], 'count': row['count']} for row in tags],
         }
 
-        return Response(data, status=status.HTTP_200_OK)
-
 
 class ItemDetailView(RetrieveAPIView):
-    queryset = Item.objects.all()
     serializer_class = ItemSerializer
     lookup_field = 'id'
 
+    def get_queryset(self):
+        return Item.objects.for_detail(settings.PRODUCT_DETAIL_REVIEWS)
+
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
         serializer = self.get_serializer(instance)
@@ -119,6 +190,28 @@ class ItemDetailView(RetrieveAPIView):
 
 
 class FeedBackPost(APIView):
+    """
+    GET pages through the reviews of an item, newest first, with keyset
+    cursors and a histogram of rates; POST adds a review.
+    """
+    pagination_class = ReviewPagination
+    keyset_ordering = ('date', True)
+
+    def get(self, request, pk, *args, **kwargs):
+        item = get_object_or_404(Item.objects.only('pk'), pk=pk)
+        reviews = FeedBack.objects.filter(item=item).order_by('-date', '-pk')
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(reviews, request, view=self)
+        response = paginator.get_paginated_response(FeedBackSerializer(page, many=True).data)
+        response.data['histogram'] = self.get_histogram(reviews)
+        return response
+
+    def get_histogram(self, reviews):
+        histogram = {rate: 0 for rate in range(1, 6)}
+        for row in reviews.order_by().values('rate').annotate(count=Count('pk')):
+            histogram[row['rate']] = row['count']
+        return histogram
+
     def post(self, request, pk, *args, **kwargs):
         data = {'item': int(pk), **request.data, 'date': datetime.now()}
 
@@ -133,31 +226,52 @@ class FeedBackPost(APIView):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class PopularItemAPIView(APIView):
+class PopularItemAPIView(CachedResponseMixin, APIView):
+    cache_name = 'popular'
+
     def get(self, request, format=None):
-        avg_reviews = FeedBack.objects.filter(item=OuterRef('pk')).values('item').annotate(avg_reviews=Avg('rate')).values('avg_reviews')[:1]
+        return Response(self.get_cached_data(request, self.build_data), status=status.HTTP_200_OK)
 
-        popular_products = Item.objects.annotate(
-            avg_reviews=Subquery(avg_reviews)
-        ).filter(
-            avg_reviews__gt=5/2,
-        ).order_by('-avg_reviews')[:10]
+    def build_data(self):
+        popular_products = Item.objects.for_cards().filter(
+            rating_avg__gt=5/2,
+        ).order_by('-rating_avg', '-id')[:10]
+
+        return ItemCardSerializer(popular_products, many=True).data
 
-        serializer = ItemSerializer(popular_products, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
 
+class LimitedItemAPIView(CachedResponseMixin, APIView):
+    cache_name = 'limited'
 
-class LimitedItemAPIView(APIView):
     def get(self, request, format=None):
-        limited_products = Item.objects.filter(count__lt=5)
-        serializer = ItemSerializer(limited_products, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(self.get_cached_data(request, self.build_data), status=status.HTTP_200_OK)
 
+    def build_data(self):
+        limited_products = Item.objects.filter(count__lt=5).for_cards()
+        return ItemCardSerializer(limited_products, many=True).data
+
+
+class BannerAPIView(CachedResponseMixin, APIView):
+    """
+    Curated banners (admin-managed, by position) topped up with the best rated
+    item of each root category until ``settings.BANNERS_LIMIT`` slots are filled.
+    """
+    cache_name = 'banners'
 
-class BannerAPIView(APIView):
     def get(self, request, format=None):
-        serializer = ItemSerializer(Item.objects.all(), many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(self.get_cached_data(request, self.build_data), status=status.HTTP_200_OK)
+
+    def build_data(self):
+        limit = settings.BANNERS_LIMIT
+        items = Item.objects.filter(archived=False).with_preview()
+        curated_ids = list(Banner.objects.filter(active=True, item__archived=False)
+                           .values_list('item_id', flat=True)[:limit])
+        curated = {item.pk: item for item in items.filter(pk__in=curated_ids)}
+        banners = [curated[pk] for pk in dict.fromkeys(curated_ids) if pk in curated]
+        if len(banners) < limit:
+            fallback = items.top_rated_per_root_category().exclude(pk__in=curated_ids)
+            banners += list(fallback[:limit - len(banners)])
+        return BannerSerializer(banners, many=True).data
 
 
 class ProfileAPIView(APIView):
@@ -209,142 +323,201 @@ class ProfileAPIView(APIView):
 
 
 class BasketAPIView(APIView):
+    """
+    Basket of the current visitor: the active order of a logged in user, or a
+    SessionBasket for anonymous visitors, merged into their order at login.
+    """
     serializer_class = BasketItemSerializer
 
+    def get_basket(self, order):
+        if order is None:
+            return []
+        basket_items = Basket.objects.filter(order=order).for_listing()
+        return self.serializer_class(basket_items, many=True).data
+
     def get(self, request, *args, **kwargs):
-        if request.user.is_authenticated:
-            customer_identifier = request.user.id
-        else:
-            session_key = request.session.session_key
-            custom_user = CustomUser.objects.filter(session_key=session_key).first()
-            customer_identifier = custom_user.id
-        order = Order.objects.filter(customer=customer_identifier, status='active').first()
-        basket_items = Basket.objects.filter(order=order)
-        serializer = self.serializer_class(basket_items, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        if not request.user.is_authenticated:
+            basket_items = SessionBasket(request.session).get_lines()
+            return Response(self.serializer_class(basket_items, many=True).data, status=status.HTTP_200_OK)
+
+        order = Order.objects.filter(customer=request.user, status='active').first()
+        return Response(self.get_basket(order), status=status.HTTP_200_OK)
 
     def post(self, request, *args, **kwargs):
-        item = Item.objects.get(pk=request.data.get('id', 0))
-        count = int(request.data.get('count', 0))
+        serializer = BasketLineSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        item = get_object_or_404(Item.objects.with_preview(), pk=serializer.validated_data['id'])
+        count = serializer.validated_data['count']
+
         if request.user.is_authenticated:
-            customer_identifier = request.user
+            with transaction.atomic():
+                order = Order.objects.get_active(request.user, create=True)
+                basket_item, created = Basket.objects.add_item(order, item, count)
         else:
-            session_key = request.session.session_key
-            if not session_key:
-                request.session.save()
-                session_key = request.session.session_key
-            customer_identifier, created = CustomUser.objects.get_or_create(session_key=session_key)
-
-        order, created = Order.objects.get_or_create(customer=customer_identifier, status='active', total_amount=0)
-        basket_item, created = Basket.objects.get_or_create(order=order, item=item)
-        sale_price = item.price - item.discount
-        basket_item.sale_price = sale_price
-        basket_item.quantity += count
-        basket_item.save()
+            basket = SessionBasket(request.session)
+            created = basket.add(item.pk, count)
+            basket_item = Basket(item=item, quantity=basket.lines[str(item.pk)])
+        basket_changes.inc(action='add' if created else 'update')
 
         serializer = self.serializer_class(basket_item, many=False)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete(self, request, *args, **kwargs):
-        data = request.data
-        item_id = data['id']
-        count = data['count']
-        if request.user.is_authenticated:
-            customer_identifier = request.user
-        else:
-            session_key = request.session.session_key
-            if not session_key:
-                request.session.save()
-                session_key = request.session.session_key
-            customer_identifier, created = CustomUser.objects.get_or_create(session_key=session_key)
-
-        order = Order.objects.filter(customer=customer_identifier, status='active').first()
-        basket_item = Basket.objects.filter(order=order, item_id=item_id).first()
-        if count < basket_item.quantity:
-            basket_item.quantity -= count
-            basket_item.save()
-        else:
-            basket_item.delete()
-            remaining_items = Basket.objects.filter(order=order).exists()
-            if not remaining_items:
+        serializer = BasketLineSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        item_id = serializer.validated_data['id']
+        count = serializer.validated_data['count']
+
+        if not request.user.is_authenticated:
+            basket = SessionBasket(request.session)
+            action = basket.remove(item_id, count)
+            if action:
+                basket_changes.inc(action=action)
+            return Response(self.serializer_class(basket.get_lines(), many=True).data, status=status.HTTP_200_OK)
+
+        with transaction.atomic():
+            order = Order.objects.get_active(request.user)
+            if order is None:
+                return Response([], status=status.HTTP_200_OK)
+            action = Basket.objects.remove_item(order, item_id, count)
+            if action == 'remove' and not Basket.objects.filter(order=order).exists():
                 order.delete()
-                serializer = BasketItemSerializer([], many=True)
-                return Response(serializer.data, status=status.HTTP_200_OK)
+                order = None
+        if action:
+            basket_changes.inc(action=action)
 
-        updated_basket_items = Basket.objects.filter(order=order)
+        return Response(self.get_basket(order), status=status.HTTP_200_OK)
+
+
+class BasketBatchAPIView(BasketAPIView):
+    """
+    Applies a list of ``{id, count}`` quantity changes (negative counts remove) in one
+    transaction and returns the whole basket once.
+    """
+    http_method_names = ['post', 'options']
+
+    def post(self, request, *args, **kwargs):
+        serializer = BasketChangeSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        changes = {}
+        for change in serializer.validated_data:
+            changes[change['id']] = changes.get(change['id'], 0) + change['count']
+        items = Item.objects.with_preview().in_bulk(changes)
+        unknown = sorted(set(changes) - set(items))
+        if unknown:
+            raise ValidationError({'id': [f'Unknown items: {unknown}']})
+
+        if not request.user.is_authenticated:
+            basket = SessionBasket(request.session)
+            actions = basket.apply_changes(changes)
+            basket_items = self.serializer_class(basket.get_lines(), many=True).data
+        else:
+            with transaction.atomic():
+                order = Order.objects.get_active(request.user, create=True)
+                actions = Basket.objects.apply_changes(order, items, changes)
+                if not Basket.objects.filter(order=order).exists():
+                    order.delete()
+                    order = None
+            basket_items = self.get_basket(order)
+        for action in actions.values():
+            basket_changes.inc(action=action)
+        return Response(basket_items, status=status.HTTP_200_OK)
 
-        serializer = BasketItemSerializer(updated_basket_items, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+
+def invalid_transition_response(order, to_status):
+    return Response({'error': f'Order is {order.status}', 'status': order.status, 'to': to_status},
+                    status=status.HTTP_409_CONFLICT)
 
 
 class OrderAPIView(APIView):
+    """GET pages through the user's orders, newest first, like the order history; POST checks out."""
+    pagination_class = OrderHistoryPagination
+    keyset_ordering = ('created_at', True)
 
     def get(self, request, *args, **kwargs):
         customer_identifier = request.user.id
-        orders = Order.objects.filter(customer=customer_identifier)
-        serializer = OrderDetailSerializer(orders, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        orders = Order.objects.filter(customer=customer_identifier).for_listing().order_by('-created_at', '-pk')
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(orders, request, view=self)
+        return paginator.get_paginated_response(OrderDetailSerializer(page, many=True).data)
 
     def post(self, request, *args, **kwargs):
-        customer_identifier = request.user.id
-        order = Order.objects.filter(customer=customer_identifier, status='active').first()
-        if order:
-            order.total_amount = order.calculate_total_amount()
-            order.status = 'pending'
-            order.save()
-            response_data = {'orderId': order.id}
-            return Response(response_data, status=status.HTTP_200_OK)
+        with transaction.atomic():
+            order = Order.objects.get_active(request.user) if request.user.is_authenticated else None
+            if order:
+                try:
+                    StockReservation.objects.reserve(order, settings.STOCK_RESERVATION_TIMEOUT)
+                except OutOfStock as error:
+                    return Response({'error': 'Not enough stock', 'items': error.item_ids},
+                                    status=status.HTTP_409_CONFLICT)
+                Basket.objects.freeze(order)
+                order.save()
+                order.transition('pending')
+                response_data = {'orderId': order.id}
+                return Response(response_data, status=status.HTTP_200_OK)
         return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class OrderHistoryAPIView(ListAPIView):
+    """The user's orders, newest first, paged with keyset cursors in a constant number of queries."""
+    serializer_class = OrderHistorySerializer
+    pagination_class = OrderHistoryPagination
+    keyset_ordering = ('created_at', True)
+
+    def get_queryset(self):
+        if not self.request.user.is_authenticated:
+            return Order.objects.none()
+        return Order.objects.filter(customer=self.request.user).for_listing().order_by('-created_at', '-pk')
+
+
 class OrderDetailAPIView(RetrieveAPIView):
     queryset = Order.objects.all()
     serializer_class = OrderDetailSerializer
     lookup_field = 'id'
 
     def get(self, request, *args, **kwargs):
-        order = get_object_or_404(self.queryset, id=kwargs[self.lookup_field])
+        order = get_object_or_404(self.queryset.for_listing(), id=kwargs[self.lookup_field])
         serializer = self.serializer_class(order)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def post(self, request, *args, **kwargs):
-        order = get_object_or_404(self.queryset, id=kwargs[self.lookup_field])
         data = request.data
-        order.customer.update_name(data.get('fullName', order.customer.get_fullName()))
-        order.payment_type = data.get('paymentType', order.payment_type)
-        order.city = data.get('city', order.city)
-        order.address = data.get('address', order.address)
-        order.delivery_type = data.get('deliveryType', order.delivery_type)
-        delivery_settings = DeliverySettings.objects.filter(delivery_type=order.delivery_type).first()
-        total_amount = order.total_amount
-        if delivery_settings and total_amount < delivery_settings.free_delivery_threshold:
-            total_amount += delivery_settings.standard_delivery_fee
-        if order.delivery_type == 'express':
-            total_amount += delivery_settings.express_delivery_fee
-        order.total_amount = total_amount
-        order.status = 'payment'
-        order.save()
-        print(order.payment_type)
+        with transaction.atomic():
+            order = get_object_or_404(self.queryset.select_for_update(), id=kwargs[self.lookup_field])
+            # The details can be confirmed again until the order is paid.
+            if order.status != 'payment' and not can_transition(order.status, 'payment'):
+                return invalid_transition_response(order, 'payment')
+            order.customer.update_name(data.get('fullName', order.customer.get_fullName()))
+            order.payment_type = data.get('paymentType', order.payment_type)
+            order.city = data.get('city', order.city)
+            order.address = data.get('address', order.address)
+            order.delivery_type = data.get('deliveryType', order.delivery_type)
+            pricing.update_delivery(order)
+            order.save()
+            if order.status != 'payment':
+                order.transition('payment')
 
         return Response({'orderId': order.id})
 
 
 class PaymentAPIView(APIView):
     def get(self, request, *args, **kwargs):
-        order = Order.objects.get(pk=id)
+        order = get_object_or_404(Order, pk=kwargs.get('id'))
         return Response(status=status.HTTP_200_OK)
         # return JsonResponse({'order_id': order.id})
 
     def post(self, request, *args, **kwargs):
-        order_id = kwargs.get('id')
-        payment_data = request.data
-        order = Order.objects.get(pk=order_id)
-        order.status = 'delivery'
-        order.save()
-        try:
-            return Response(status=status.HTTP_200_OK)
-        except Exception as e:
-            return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        with transaction.atomic():
+            order = get_object_or_404(Order.objects.select_for_update(), pk=kwargs.get('id'))
+            if not can_transition(order.status, 'delivery'):
+                return invalid_transition_response(order, 'delivery')
+            try:
+                StockReservation.objects.commit(order, settings.STOCK_RESERVATION_TIMEOUT)
+            except OutOfStock as error:
+                return Response({'error': 'Not enough stock', 'items': error.item_ids},
+                                status=status.HTTP_409_CONFLICT)
+            order.transition('delivery')
+        return Response(status=status.HTTP_200_OK)
 
 
 class LoginApiView(APIView):
@@ -353,7 +526,12 @@ class LoginApiView(APIView):
         user = authenticate(request, username=data.get('username'), password=data.get('password'))
 
         if user is not None:
+            basket = SessionBasket(request.session)
+            lines = basket.lines
             login(request, user)
+            # login() may flush the session, so the anonymous basket is restored before merging it.
+            basket.save(lines)
+            basket.merge_into(user)
             return Response({'status': 'success'}, status=200)
         else:
             return Response({'status': 'failure'}, status=500)
@@ -387,18 +565,32 @@ class CustomPageNumberPagination(PageNumberPagination):
     page_size = 6
 
 
-class SalesAPIView(ListAPIView):
+class SalesAPIView(CachedResponseMixin, ListAPIView):
+    """
+    Items on sale, six per page. All of them are serialized and cached once; the page
+    asked for is cut out of the cached list, so every page shares the one cache entry.
+    """
     serializer_class = SalesItemSerializer
     pagination_class = CustomPageNumberPagination
+    cache_name = 'sales'
 
     def list(self, request, *args, **kwargs):
-        sales_items = SaleItem.objects.all()
-        serialized_items = self.get_serializer(sales_items, many=True).data
-
-        data = {
-            'items': serialized_items,
-            "currentPage": request.query_params.get('currentPage', 1),
-            "lastPage": len(serialized_items) // 6 + (len(serialized_items) % 6 > 0),
-        }
+        items = self.get_cached_data(request, self.build_data)
+        page_size = self.pagination_class.page_size
+        last_page = max(1, math.ceil(len(items) / page_size))
+        page = min(self.get_page_number(request), last_page)
+        return Response({
+            'items': items[(page - 1) * page_size:page * page_size],
+            'currentPage': page,
+            'lastPage': last_page,
+        }, status=status.HTTP_200_OK)
+
+    def get_page_number(self, request):
+        try:
+            return max(int(request.query_params.get('currentPage', 1)), 1)
+        except (TypeError, ValueError):
+            return 1
 
-        return Response(data, status=status.HTTP_200_OK)
+    def build_data(self):
+        sales_items = SaleItem.objects.for_listing().order_by('pk')
+        return self.get_serializer(sales_items, many=True).data
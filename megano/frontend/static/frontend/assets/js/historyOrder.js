@@ -1,12 +1,13 @@
 var mix = {
 	methods: {
 		getHistoryOrder() {
-			this.getData("/api/orders")
+			// One page at a time: the next one is only asked for when the user wants it.
+			const params = this.nextCursor ? {cursor: this.nextCursor} : {}
+			this.getData("/api/orders/history", params)
 				.then(data => {
-					console.log(data)
-					this.orders = data
+					this.orders = this.orders.concat(data.items)
+					this.nextCursor = data.nextCursor
 				}).catch(() => {
-				this.orders = []
 				console.warn('Ошибка при получении списка заказов')
 			})
 		}
@@ -17,6 +18,7 @@ var mix = {
 	data() {
 		return {
 			orders: [],
+			nextCursor: null,
 		}
 	}
-}
\ No newline at end of file
+}
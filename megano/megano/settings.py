@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,7 +52,6 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    # 'request_logging.middleware.LoggingMiddleware',
 ]
 
 ROOT_URLCONF = 'megano.urls'
@@ -81,9 +81,67 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Take the write lock when a transaction starts and wait for it instead of failing
+        # with "database is locked" when two requests write at the same time.
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file, not the shared in-memory database, so concurrency tests can write from several threads.
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+TEST_RUNNER = 'megano.test_runner.TestRunner'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+# Anonymous baskets live in the session, so reading one is a cache lookup rather than a query.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Seconds the home page feeds and the category tree stay cached; model signals drop them
+# earlier on changes (in the workers that share the cache).
+API_CACHE_TIMEOUT = 300
+API_CACHE_TIMEOUTS = {
+    'categories': 300,
+    'banners': 300,
+    'popular': 300,
+    'limited': 60,
+    'sales': 300,
+}
+
+BANNERS_LIMIT = 3
+
+# Reviews embedded in the product detail response; the rest are paged via product/<id>/reviews.
+PRODUCT_DETAIL_REVIEWS = 5
+
+# Seconds stock stays reserved for a checked out order before release_reservations gives it back.
+STOCK_RESERVATION_TIMEOUT = 15 * 60
+
+# Seconds a worker keeps the delivery pricing rules. Changes bump a version in the cache,
+# which only reaches the other workers when CACHES is shared. With the LocMemCache above
+# an admin change is therefore applied by the other workers up to this many seconds late.
+PRICING_RULES_TTL = 60
+
+# Per-request SQL and timing measurements (Server-Timing header, see api.middleware).
+REQUEST_INSTRUMENTATION = True
+# Requests slower than this many seconds are logged with their most repeated SQL.
+SLOW_REQUEST_THRESHOLD = 0.5
+# A statement run this many times in one request is logged as a likely N+1.
+REPEATED_QUERY_THRESHOLD = 5
+
+# Shared directory that lets /metrics add up the numbers of every worker process
+# (see api.metrics); leave unset when a single process serves requests.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+# Bearer token a scraper sends to read /metrics; without it only staff users can.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -156,5 +214,10 @@ LOGGING = {
             'level': 'DEBUG',  # change debug level as appropiate
             'propagate': False,
         },
+        'api.middleware': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     },
 }
\ No newline at end of file
@@ -0,0 +1,13 @@
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Leaves the tests tagged ``benchmark`` out unless they are asked for: they build
+    catalogs of 100k rows and compare timings, which is too slow and too noisy for
+    every run. Run them with ``python manage.py test --tag=benchmark``.
+    """
+    def __init__(self, *args, tags=None, exclude_tags=None, **kwargs):
+        if not tags or 'benchmark' not in tags:
+            exclude_tags = {*(exclude_tags or ()), 'benchmark'}
+        super().__init__(*args, tags=tags, exclude_tags=exclude_tags, **kwargs)
@@ -17,9 +17,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from api.metrics import metrics_view
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path("api/", include(("api.urls", 'api'), namespace='api')),
     path("", include(("frontend.urls", 'frontend'), namespace='frontend')),
 ]
@@ -1,10 +1,11 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.db.models import QuerySet
 from django.http import HttpRequest
 from django.utils.html import format_html
 from .models import Item, Order, ItemImage, Basket, Category, FeedBack, Tag, Specification, DeliverySettings, Sale, \
-    SaleItem
+    SaleItem, Banner, StockReservation, OrderEvent
 from .admin_mixins import ExportAsCSVMixin
+from .pricing import pricing
 from .forms import ItemForm
 
 
@@ -51,6 +52,8 @@ def set_discount_5(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset:
 class OrderItemInLine(admin.TabularInline):
     model = Basket
     extra = 1
+    fields = ('item', 'quantity', 'title', 'unit_price', 'discount', 'sale_price', 'line_total')
+    readonly_fields = ('title', 'unit_price', 'discount', 'sale_price', 'line_total')
 
 
 @admin.register(Item)
@@ -91,6 +94,26 @@ class ItemAdmin(admin.ModelAdmin, ExportAsCSVMixin):
     ]
 
 
+@admin.register(Banner)
+class BannerAdmin(admin.ModelAdmin):
+    list_display = 'item', 'position', 'active'
+    list_editable = 'position', 'active'
+    autocomplete_fields = 'item',
+
+    def get_queryset(self, request):
+        return Banner.objects.select_related('item')
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = 'order', 'item', 'quantity', 'status', 'expires_at'
+    list_filter = 'status',
+    raw_id_fields = 'order', 'item'
+
+    def get_queryset(self, request):
+        return StockReservation.objects.select_related('order', 'item')
+
+
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     search_fields = ['name']
@@ -103,12 +126,27 @@ class ItemInLine(admin.StackedInline):
 
 @admin.action(description='Archived orders')
 def mark_archived_order(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(status='archived')
+    archived = queryset.transition('archived')
+    modeladmin.message_user(request, f'{archived} orders archived')
 
 
 @admin.action(description='Re-archived orders')
 def remark_archived_order(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(status='archived')
+    archived = queryset.transition('archived')
+    modeladmin.message_user(request, f'{archived} orders archived')
+
+
+@admin.register(OrderEvent)
+class OrderEventAdmin(admin.ModelAdmin):
+    list_display = 'order', 'from_status', 'to_status', 'created_at'
+    list_filter = 'to_status',
+    raw_id_fields = 'order',
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(DeliverySettings)
@@ -152,10 +190,11 @@ class OrderAdmin(admin.ModelAdmin):
         remark_archived_order,
         'export_csv',
     ]
-    readonly_fields = ('created_at', 'customer', 'address', 'city', 'payment_type', 'total_amount')
+    readonly_fields = ('created_at', 'customer', 'address', 'city', 'payment_type', 'subtotal', 'discount',
+                       'delivery_fee', 'total_amount')
     fieldsets = [
         (None, {
-            'fields': ('customer', 'created_at', 'total_amount'),
+            'fields': ('customer', 'created_at', 'subtotal', 'discount', 'delivery_fee', 'total_amount'),
         }),
         ('Description', {
             'fields': ('address', 'city', 'payment_type', 'status'),
@@ -165,6 +204,40 @@ class OrderAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return Order.objects.select_related('customer').prefetch_related('items')
 
+    def save_model(self, request, obj, form, change):
+        to_status = obj.status
+        if change and 'status' in form.changed_data:
+            # The status goes through the state machine, so the change is checked and logged.
+            obj.status = form.initial['status']
+        super().save_model(request, obj, form, change)
+        if obj.status != to_status:
+            if Order.objects.filter(pk=obj.pk).transition(to_status):
+                obj.status = to_status
+            else:
+                self.message_user(request, f'An order cannot go from {obj.status} to {to_status}',
+                                  level=messages.ERROR)
+
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not Basket:
+            return super().save_formset(request, form, formset, change)
+        # Lines added or changed here are priced like basket lines: at the item's current price.
+        lines = formset.save(commit=False)
+        items = Item.objects.with_preview().in_bulk([line.item_id for line in lines])
+        for line in lines:
+            for field, value in Basket.snapshot_of(items[line.item_id]).items():
+                setattr(line, field, value)
+            line.line_total = line.sale_price * line.quantity
+            line.save()
+        for line in formset.deleted_objects:
+            line.delete()
+        formset.save_m2m()
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        order = form.instance
+        pricing.recalculate(order, order.basket_set.all())
+        order.save(update_fields=['subtotal', 'discount', 'delivery_fee', 'total_amount'])
+
     def user_verbose(self, obj: Order) -> str:
         return obj.customer_name.first_name or obj.customer_name.username
 
@@ -182,11 +255,7 @@ class CategoryAdmin(admin.ModelAdmin):
     search_fields = ('title',)
 
     def full_path(self, obj):
-        path = [obj.title]
-        current = obj.parent_category
-        while current:
-            path.insert(0, current.title)
-            current = current.parent_category
+        path = [ancestor.title for ancestor in obj.ancestors()] + [obj.title]
         full_path = '/'.join(path)
         last_item = path[-1]
         full_path = full_path.replace(last_item, f'<strong>{last_item}</strong>', 1)
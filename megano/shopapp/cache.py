@@ -0,0 +1,37 @@
+"""
+Version tokens of cached namespaces, shared by the API's response caches and
+the pricing rules (see api.cache and shopapp.pricing).
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+DEFAULT_TIMEOUT = 300
+
+
+def version_key(namespace: str) -> str:
+    return f'version:{namespace}'
+
+
+def get_timeout(name: str):
+    timeouts = getattr(settings, 'API_CACHE_TIMEOUTS', {})
+    return timeouts.get(name, getattr(settings, 'API_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+
+
+def get_version(namespace: str) -> str:
+    """
+    Current version token of a cached namespace. Entries are stored under keys
+    that embed the token, so bumping it invalidates them in every worker sharing the cache.
+    The token itself expires after the namespace's timeout: a worker with its own cache
+    (LocMemCache) never sees another worker's bump, and this bounds how long it stays behind.
+    """
+    version = cache.get(version_key(namespace))
+    if version is None:
+        cache.add(version_key(namespace), uuid.uuid4().hex, get_timeout(namespace))
+        version = cache.get(version_key(namespace))
+    return version
+
+
+def bump_version(namespace: str) -> None:
+    cache.set(version_key(namespace), uuid.uuid4().hex, get_timeout(namespace))
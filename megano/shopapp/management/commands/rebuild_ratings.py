@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from shopapp.models import Item
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the stored rating_sum/review_count/rating_avg columns of every item'
+
+    def handle(self, *args, **options):
+        updated = Item.objects.rebuild_ratings()
+        self.stdout.write(self.style.SUCCESS(f'Ratings rebuilt for {updated} items'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from shopapp.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Drop and rebuild the full-text search index of items'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        indexed = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'{indexed} items indexed with {type(backend).__name__}'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from shopapp.models import StockReservation
+
+
+class Command(BaseCommand):
+    help = 'Give the stock of expired reservations back to the items; run it periodically, e.g. every minute'
+
+    def handle(self, *args, **options):
+        released = StockReservation.objects.release_expired()
+        self.stdout.write(self.style.SUCCESS(f'{released} expired reservations released'))
@@ -0,0 +1,236 @@
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from myauth.models import CustomUser
+from shopapp.cache import bump_version
+from shopapp.models import (Banner, Basket, Category, FeedBack, Item, ItemImage, Order, Sale, SaleItem,
+                            Specification, Tag, discounted_price)
+from shopapp.search import get_backend
+
+PRESETS = {
+    '1k': {'items': 1_000, 'category_depth': 3, 'users': 100, 'orders': 300, 'sales': 3},
+    '100k': {'items': 100_000, 'category_depth': 4, 'users': 5_000, 'orders': 20_000, 'sales': 10},
+    '1m': {'items': 1_000_000, 'category_depth': 5, 'users': 50_000, 'orders': 200_000, 'sales': 30},
+}
+ROOT_CATEGORIES = 6
+SUBCATEGORIES = 3
+TAGS = 40
+BANNERS = 5
+SEED_PASSWORD = 'seed-password'
+
+ADJECTIVES = ['Compact', 'Smart', 'Wireless', 'Classic', 'Portable', 'Digital', 'Silent', 'Ultra', 'Pro', 'Eco',
+              'Premium', 'Mini', 'Turbo', 'Retro', 'Modern', 'Rugged']
+NOUNS = ['phone', 'laptop', 'kettle', 'speaker', 'camera', 'monitor', 'lamp', 'blender', 'watch', 'router',
+         'keyboard', 'headphones', 'heater', 'vacuum', 'printer', 'tablet', 'drone', 'projector']
+COLORS = ['black', 'white', 'silver', 'red', 'blue', 'green', 'graphite', 'gold']
+SPECIFICATIONS = {
+    'Color': COLORS,
+    'Weight': [f'{weight} g' for weight in range(100, 5000, 150)],
+    'Warranty': ['6 months', '1 year', '2 years', '3 years'],
+    'Country': ['China', 'Germany', 'Japan', 'Korea', 'Russia', 'USA'],
+}
+REVIEW_TEXTS = ['Works as expected.', 'Great value for the money.', 'Broke after a month.',
+                'Fast delivery, good packaging.', 'Not what I expected.', 'Would buy again.']
+STATUSES = ['pending', 'delivery', 'payment', 'archived']
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with a deterministic synthetic shop (category trees, items with tags, '
+            'specifications, images and reviews, users, orders and sales) for load testing')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=PRESETS, default='1k', help='Size preset (default: 1k)')
+        parser.add_argument('--items', type=int, help='Override the number of items of the preset')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed gives the same data')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Items generated per transaction')
+        parser.add_argument('--skip-search-index', action='store_true',
+                            help='Do not rebuild the full-text search index afterwards')
+
+    def handle(self, *args, **options):
+        preset = dict(PRESETS[options['size']])
+        if options['items'] is not None:
+            if options['items'] < 1:
+                raise CommandError('--items must be positive')
+            # Keep the proportions of the preset when only the item count is overridden.
+            ratio = options['items'] / preset['items']
+            preset.update(items=options['items'],
+                          users=max(1, round(preset['users'] * ratio)),
+                          orders=max(1, round(preset['orders'] * ratio)))
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
+        started = time.monotonic()
+
+        with transaction.atomic():
+            categories = self.create_categories(preset['category_depth'])
+            tags = Tag.objects.bulk_create(Tag(name=f'tag-{i}') for i in range(TAGS))
+        self.log(f'{len(categories)} categories, {len(tags)} tags')
+
+        leaves = [category for category in categories if category.depth == preset['category_depth']]
+        item_ids, snapshots = [], []
+        for offset in range(0, preset['items'], self.batch_size):
+            count = min(self.batch_size, preset['items'] - offset)
+            with transaction.atomic():
+                items = self.create_items(offset, count, leaves, tags)
+            item_ids.extend(item.pk for item in items)
+            # Tuples rather than Basket.snapshot_of() dicts keep the 1m preset's memory down.
+            snapshots.extend((item.name, item.description, item.price, item.discount, item.free_delivery)
+                             for item in items)
+            self.log(f'{offset + count} items')
+
+        with transaction.atomic():
+            users = self.create_users(preset['users'])
+        self.log(f'{len(users)} users')
+        for offset in range(0, preset['orders'], self.batch_size):
+            count = min(self.batch_size, preset['orders'] - offset)
+            with transaction.atomic():
+                self.create_orders(offset, count, users, item_ids, snapshots)
+        self.log(f'{preset["orders"]} orders')
+
+        with transaction.atomic():
+            self.create_sales(preset['sales'], item_ids)
+            Banner.objects.bulk_create(
+                Banner(item_id=item_id, position=position)
+                for position, item_id in enumerate(self.random.sample(item_ids, min(BANNERS, len(item_ids))))
+            )
+
+        if not options['skip_search_index']:
+            indexed = get_backend().rebuild()
+            self.log(f'{indexed} items indexed for search')
+        # bulk_create() sends no signals, so drop the cached feeds and category tree by hand.
+        bump_version('feeds')
+        bump_version('categories')
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {preset["items"]} items in {time.monotonic() - started:.1f}s (seed {options["seed"]})'
+        ))
+
+    def log(self, message):
+        if self.verbosity > 1:
+            self.stdout.write(message)
+
+    def create_categories(self, depth):
+        """Full trees level by level; paths are filled in here because bulk_create() skips Category.save()."""
+        categories = []
+        parents = [None]
+        for level in range(1, depth + 1):
+            width = ROOT_CATEGORIES if level == 1 else SUBCATEGORIES
+            level_categories = Category.objects.bulk_create(
+                Category(title=f'{self.random.choice(NOUNS).title()} {level}.{i}', parent_category=parent,
+                         image=f'category/seed/{level}.jpg')
+                for parent in parents for i in range(width)
+            )
+            for category in level_categories:
+                parent_path = category.parent_category.path if category.parent_category else ''
+                category.path = f'{parent_path}{category.pk}/'
+                category.depth = level
+            Category.objects.bulk_update(level_categories, ['path'], batch_size=self.batch_size)
+            categories.extend(level_categories)
+            parents = level_categories
+        return categories
+
+    def create_items(self, offset, count, categories, tags):
+        items = []
+        for number in range(offset, offset + count):
+            price = Decimal(self.random.randrange(100, 200_000)) / 100
+            items.append(Item(
+                name=f'{self.random.choice(ADJECTIVES)} {self.random.choice(NOUNS)} {number}',
+                description=' '.join(self.random.choices(ADJECTIVES + NOUNS + COLORS, k=20)),
+                price=price,
+                discount=self.random.choice([0, 0, 0, 5, 10, 25]),
+                count=self.random.randrange(0, 100),
+                category=self.random.choice(categories),
+                free_delivery=self.random.random() < 0.3,
+                available=self.random.random() < 0.95,
+                archived=self.random.random() < 0.02,
+            ))
+
+        # Reviews are generated up front so the stored rating columns are written with the item.
+        reviews = []
+        for item in items:
+            rates = [self.random.choices([1, 2, 3, 4, 5], weights=[1, 1, 2, 4, 5])[0]
+                     for _ in range(self.random.randrange(0, 7))]
+            item.rating_sum, item.review_count = sum(rates), len(rates)
+            item.rating_avg = item.rating_sum / item.review_count if rates else 0.0
+            reviews.append(rates)
+        items = Item.objects.bulk_create(items, batch_size=self.batch_size)
+
+        item_tags, specifications, images, feedbacks = [], [], [], []
+        for item, rates in zip(items, reviews):
+            item_tags.extend(Item.tags.through(item_id=item.pk, tag_id=tag.pk)
+                             for tag in self.random.sample(tags, self.random.randrange(0, 4)))
+            specifications.extend(Specification(item_id=item.pk, name=name, value=self.random.choice(values))
+                                  for name, values in self.random.sample(list(SPECIFICATIONS.items()), 2))
+            images.extend(ItemImage(item_id=item.pk, src=f'products/seed/{self.random.randrange(50)}.jpg')
+                          for _ in range(self.random.randrange(1, 3)))
+            feedbacks.extend(FeedBack(item_id=item.pk, author=f'user{self.random.randrange(10_000)}',
+                                      email='reviewer@example.com', text=self.random.choice(REVIEW_TEXTS), rate=rate)
+                             for rate in rates)
+        for model, objects in [(Item.tags.through, item_tags), (Specification, specifications),
+                               (ItemImage, images), (FeedBack, feedbacks)]:
+            model.objects.bulk_create(objects, batch_size=self.batch_size)
+        return items
+
+    def create_users(self, count):
+        # Hashing is the slow part of creating users, so every seeded user shares one hash.
+        password = make_password(SEED_PASSWORD)
+        # Numbering continues after the users of earlier runs, so seeding twice adds new users.
+        start = CustomUser.objects.filter(username__startswith='seed-user-').count()
+        return CustomUser.objects.bulk_create(
+            (CustomUser(username=f'seed-user-{i}', password=password, first_name='Seed', last_name=f'User {i}',
+                        email=f'seed-user-{i}@example.com') for i in range(start, start + count)),
+            batch_size=self.batch_size,
+        )
+
+    def create_orders(self, offset, count, users, item_ids, snapshots):
+        orders, baskets = [], []
+        for number in range(offset, offset + count):
+            # Each user gets at most one active (basket) order: the first one created for them.
+            status = 'active' if number < len(users) and self.random.random() < 0.2 else self.random.choice(STATUSES)
+            lines = []
+            for index in self.random.sample(range(len(item_ids)), min(self.random.randrange(1, 6), len(item_ids))):
+                lines.append((item_ids[index], snapshots[index], self.random.randrange(1, 4)))
+            subtotal = sum(price * quantity for _, (_, _, price, _, _), quantity in lines)
+            total = sum(discounted_price(price, discount) * quantity
+                        for _, (_, _, price, discount, _), quantity in lines)
+            # Seeded orders are charged no delivery, which spares a DeliverySettings lookup per order.
+            orders.append(Order(
+                customer=users[number % len(users)],
+                status=status,
+                subtotal=subtotal,
+                discount=subtotal - total,
+                total_amount=total,
+                payment_type=self.random.choice(['online', 'someone']),
+                delivery_type=self.random.choice(['ordinary', 'express']),
+                city='Moscow',
+                address=f'{self.random.randrange(1, 200)} Seed street',
+            ))
+            baskets.append(lines)
+        orders = Order.objects.bulk_create(orders, batch_size=self.batch_size)
+        Basket.objects.bulk_create(
+            (Basket(order_id=order.pk, item_id=item_id, quantity=quantity, title=title, description=description,
+                    unit_price=price, discount=discount, sale_price=discounted_price(price, discount),
+                    free_delivery=free_delivery, line_total=discounted_price(price, discount) * quantity)
+             for order, lines in zip(orders, baskets)
+             for item_id, (title, description, price, discount, free_delivery), quantity in lines),
+            batch_size=self.batch_size,
+        )
+
+    def create_sales(self, count, item_ids):
+        today = date.today()
+        sales = Sale.objects.bulk_create(
+            Sale(title=f'Sale {i}', discount=self.random.choice([5, 10, 15, 20, 30]),
+                 date_from=today - timedelta(days=self.random.randrange(30)),
+                 date_to=today + timedelta(days=self.random.randrange(1, 60)))
+            for i in range(count)
+        )
+        SaleItem.objects.bulk_create(
+            (SaleItem(sale=sale, item_id=item_id)
+             for sale in sales for item_id in self.random.sample(item_ids, min(20, len(item_ids)))),
+            batch_size=self.batch_size,
+        )
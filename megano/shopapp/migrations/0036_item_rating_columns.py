@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:25
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+
+def fill_rating_columns(apps, schema_editor):
+    Item = apps.get_model('shopapp', 'Item')
+    FeedBack = apps.get_model('shopapp', 'FeedBack')
+    feedbacks = FeedBack.objects.filter(item=OuterRef('pk')).order_by().values('item')
+    rating_sum = Coalesce(Subquery(feedbacks.annotate(total=Sum('rate')).values('total')), 0)
+    review_count = Coalesce(Subquery(feedbacks.annotate(total=Count('pk')).values('total')), 0)
+    Item.objects.update(
+        rating_sum=rating_sum,
+        review_count=review_count,
+        rating_avg=Coalesce(Cast(rating_sum, models.FloatField()) / NullIf(review_count, 0), 0.0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0035_sale_archived'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='rating_avg',
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['rating_avg', 'id'], name='item_rating_avg_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['review_count', 'id'], name='item_review_count_idx'),
+        ),
+        migrations.RunPython(fill_rating_columns, migrations.RunPython.noop),
+    ]
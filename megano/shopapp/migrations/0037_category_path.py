@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:26
+
+from django.db import migrations, models
+
+
+def fill_category_paths(apps, schema_editor):
+    Category = apps.get_model('shopapp', 'Category')
+    children = {}
+    for category in Category.objects.all():
+        children.setdefault(category.parent_category_id, []).append(category)
+    stack = [(category, '') for category in children.get(None, [])]
+    while stack:
+        category, parent_path = stack.pop()
+        category.path = f'{parent_path}{category.pk}/'
+        stack.extend((child, category.path) for child in children.get(category.pk, []))
+        category.save(update_fields=['path'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0036_item_rating_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=1000),
+        ),
+        migrations.RunPython(fill_category_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+from django.db import migrations
+
+# The index is created with frozen SQL rather than through shopapp.search, so this
+# migration keeps doing what it did when it was written whatever the search code
+# becomes. The documents match shopapp.search.item_document at the time.
+
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS shopapp_itemsearch USING fts5("
+    "name, description, tags, specifications, tokenize='unicode61 remove_diacritics 2')",
+    """
+    INSERT INTO shopapp_itemsearch (rowid, name, description, tags, specifications)
+    SELECT item.id, item.name, item.description,
+           COALESCE((SELECT group_concat(tag.name, ' ')
+                     FROM shopapp_item_tags item_tag JOIN shopapp_tag tag ON tag.id = item_tag.tag_id
+                     WHERE item_tag.item_id = item.id), ''),
+           COALESCE((SELECT group_concat(spec.name || ' ' || spec.value, ' ')
+                     FROM shopapp_specification spec WHERE spec.item_id = item.id), '')
+    FROM shopapp_item item
+    """,
+]
+
+POSTGRESQL_CREATE = [
+    'CREATE TABLE IF NOT EXISTS shopapp_itemsearch (item_id bigint PRIMARY KEY, document tsvector NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS shopapp_itemsearch_document ON shopapp_itemsearch USING GIN (document)',
+    """
+    INSERT INTO shopapp_itemsearch (item_id, document)
+    SELECT item.id,
+           setweight(to_tsvector('simple', item.name), 'A') ||
+           setweight(to_tsvector('simple', COALESCE((
+               SELECT string_agg(tag.name, ' ')
+               FROM shopapp_item_tags item_tag JOIN shopapp_tag tag ON tag.id = item_tag.tag_id
+               WHERE item_tag.item_id = item.id), '')), 'B') ||
+           setweight(to_tsvector('simple', COALESCE((
+               SELECT string_agg(spec.name || ' ' || spec.value, ' ')
+               FROM shopapp_specification spec WHERE spec.item_id = item.id), '')), 'C') ||
+           setweight(to_tsvector('simple', item.description), 'D')
+    FROM shopapp_item item
+    """,
+]
+
+CREATE = {'sqlite': SQLITE_CREATE, 'postgresql': POSTGRESQL_CREATE}
+DROP = {vendor: ['DROP TABLE IF EXISTS shopapp_itemsearch'] for vendor in CREATE}
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0037_category_path'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE), run(DROP)),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:34
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_basket_rows(apps, schema_editor):
+    Basket = apps.get_model('shopapp', 'Basket')
+    duplicates = (Basket.objects.values('order', 'item').order_by()
+                  .annotate(rows=Count('pk'), keep=Min('pk'), quantity=Sum('quantity')).filter(rows__gt=1))
+    for duplicate in duplicates:
+        rows = Basket.objects.filter(order=duplicate['order'], item=duplicate['item'])
+        rows.exclude(pk=duplicate['keep']).delete()
+        rows.update(quantity=duplicate['quantity'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0040_feedback_item_date_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_basket_rows, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='banner',
+            index=models.Index(condition=models.Q(('active', True)), fields=['position', 'id'], name='banner_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('archived', False), ('available', True)), fields=['date', 'id'], name='item_catalog_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('archived', False), ('available', True)), fields=['price', 'id'], name='item_catalog_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('archived', False)), fields=['date', 'id'], name='item_listed_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['category', 'date', 'id'], name='item_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('count__lt', 5)), fields=['count'], name='item_limited_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'status'], name='order_customer_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='basket',
+            constraint=models.UniqueConstraint(fields=('order', 'item'), name='basket_order_item_unique'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:52
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_active_orders(apps, schema_editor):
+    Order = apps.get_model('shopapp', 'Order')
+    Basket = apps.get_model('shopapp', 'Basket')
+    duplicates = (Order.objects.filter(status='active').values('customer').order_by()
+                  .annotate(orders=Count('pk'), keep=Min('pk')).filter(orders__gt=1))
+    for duplicate in duplicates:
+        extra_orders = Order.objects.filter(customer=duplicate['customer'], status='active').exclude(pk=duplicate['keep'])
+        for line in Basket.objects.filter(order__in=extra_orders):
+            kept, created = Basket.objects.get_or_create(
+                order_id=duplicate['keep'], item_id=line.item_id,
+                defaults={'quantity': line.quantity, 'sale_price': line.sale_price},
+            )
+            if not created:
+                kept.quantity += line.quantity
+                kept.save(update_fields=['quantity'])
+        extra_orders.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0041_catalog_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_active_orders, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'active')), fields=('customer',), name='order_customer_active_unique'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:02
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, NullIf
+
+
+def copy_item_data(apps, schema_editor):
+    """Existing lines keep the sale price they were bought at; the rest is copied from the item as it is now."""
+    Basket = apps.get_model('shopapp', 'Basket')
+    Item = apps.get_model('shopapp', 'Item')
+    ItemImage = apps.get_model('shopapp', 'ItemImage')
+    item = Item.objects.filter(pk=OuterRef('item_id'))
+    first_image = ItemImage.objects.filter(item=OuterRef('item_id')).order_by('pk').values('src')[:1]
+    Basket.objects.update(
+        title=Subquery(item.values('name')),
+        unit_price=Subquery(item.values('price')),
+        discount=Subquery(item.values('discount')),
+        free_delivery=Subquery(item.values('free_delivery')),
+        image=Coalesce(Subquery(first_image), NullIf(Subquery(item.values('preview')), Value('')), Value('')),
+        line_total=F('sale_price') * F('quantity'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0044_order_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basket',
+            name='discount',
+            field=models.SmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='basket',
+            name='free_delivery',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='basket',
+            name='image',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='basket',
+            name='line_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='basket',
+            name='title',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='basket',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, help_text='Item price before discount', max_digits=10),
+        ),
+        migrations.RunPython(copy_item_data, migrations.RunPython.noop),
+    ]
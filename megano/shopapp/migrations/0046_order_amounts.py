@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:05
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_amounts(apps, schema_editor):
+    """
+    Sum the lines into the new columns. Only active orders get their total re-priced:
+    the total of a placed order is what the customer was asked to pay.
+    """
+    Order = apps.get_model('shopapp', 'Order')
+    Basket = apps.get_model('shopapp', 'Basket')
+    lines = Basket.objects.filter(order=OuterRef('pk')).order_by().values('order')
+
+    def line_sum(expression):
+        total = lines.annotate(total=Sum(expression, output_field=DecimalField())).values('total')
+        return Coalesce(Subquery(total), Value(0), output_field=DecimalField())
+
+    Order.objects.update(
+        subtotal=line_sum(F('unit_price') * F('quantity')),
+        discount=line_sum((F('unit_price') - F('sale_price')) * F('quantity')),
+    )
+    Order.objects.filter(status='active').update(total_amount=F('subtotal') - F('discount'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0045_basket_line_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='delivery_fee',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='discount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, help_text='Items at list price', max_digits=10),
+        ),
+        migrations.RunPython(fill_amounts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0047_order_event'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('archived', False)), fields=['category', 'price', 'free_delivery', 'available', 'id'], name='item_facet_idx'),
+        ),
+    ]
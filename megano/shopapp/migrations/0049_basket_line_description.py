@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:37
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, NullIf
+
+
+def copy_item_data(apps, schema_editor):
+    """Lines get their item's description, and lines without an image (not checked out yet) its image."""
+    Basket = apps.get_model('shopapp', 'Basket')
+    Item = apps.get_model('shopapp', 'Item')
+    ItemImage = apps.get_model('shopapp', 'ItemImage')
+    item = Item.objects.filter(pk=OuterRef('item_id'))
+    first_image = ItemImage.objects.filter(item=OuterRef('item_id')).order_by('pk').values('src')[:1]
+    Basket.objects.update(description=Subquery(item.values('description')))
+    Basket.objects.filter(image='').update(
+        image=Coalesce(Subquery(first_image), NullIf(Subquery(item.values('preview')), Value('')), Value('')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0048_item_facet_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basket',
+            name='description',
+            field=models.TextField(blank=True, default='', max_length=1000),
+        ),
+        migrations.RunPython(copy_item_data, migrations.RunPython.noop),
+    ]
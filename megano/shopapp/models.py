@@ -1,8 +1,15 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator
-from django.db import models
-from django.db.models import Avg, Sum, F
+from django.db import models, transaction
+from django.db.models import Sum, F, Count, OuterRef, Q, Subquery, Value, Window
+from django.db.models.functions import Cast, Coalesce, Concat, Length, NullIf, RowNumber, StrIndex, Substr
 from django.utils import timezone
 from myauth.models import CustomUser
+from .order_states import RELEASES_STOCK, TRANSITION_BATCH_SIZE, InvalidTransition, can_transition, sources_of, status_changed
+from .pricing import ZERO, discounted_price, pricing
 
 
 def product_preview_directory_path(instance: "Item", filename: str) -> str:
@@ -34,14 +41,115 @@ class Category(models.Model):
     title = models.CharField(max_length=50)
     parent_category = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='subcategories')
     image = models.ImageField(upload_to=category_preview_directory_path, blank=False)
+    # Materialized ancestor path: pks from the root down to this category, e.g. "1/4/9/".
+    path = models.CharField(max_length=1000, db_index=True, editable=False, default='')
 
     def __str__(self):
         return self.title
 
+    def clean(self):
+        if self.pk and self.parent_category_id:
+            if self.parent_category_id in self.descendant_ids():
+                raise ValidationError({'parent_category': 'A category cannot be nested inside itself.'})
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            categories = Category.objects.all()
+            parent_path = ''
+            if self.parent_category_id:
+                parent_path = categories.filter(pk=self.parent_category_id).values_list('path', flat=True).get()
+            old_path = categories.filter(pk=self.pk).values_list('path', flat=True).get()
+            path = f'{parent_path}{self.pk}/'
+            if path != old_path:
+                categories.filter(pk=self.pk).update(path=path)
+                if old_path:
+                    categories.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                        path=Concat(Value(path), Substr('path', len(old_path) + 1)),
+                    )
+            self.path = path
+
+    def descendant_ids(self, include_self=True):
+        """Pks of the whole subtree, as a lazy single query usable in ``__in`` filters."""
+        descendants = Category.objects.filter(path__startswith=self.path)
+        if not include_self:
+            descendants = descendants.exclude(pk=self.pk)
+        return descendants.values_list('pk', flat=True)
+
+    def ancestors(self):
+        """Ancestors from the root down to the direct parent, fetched in one query."""
+        ancestor_ids = [int(pk) for pk in self.path.split('/') if pk][:-1]
+        return Category.objects.filter(pk__in=ancestor_ids).order_by(Length('path'))
+
+
+class ItemQuerySet(models.QuerySet):
+    def for_listing(self):
+        """
+        Everything ItemSerializer reads, loaded in a fixed number of queries.
+        The rating comes from the stored rating columns, so no aggregation is needed.
+        """
+        return self.prefetch_related('images', 'feedbacks', 'tags', 'specifications')
+
+    def for_detail(self, reviews_limit):
+        """Like for_listing(), but only the ``reviews_limit`` newest reviews are loaded."""
+        latest_reviews = FeedBack.objects.annotate(
+            item_rank=Window(RowNumber(), partition_by=[F('item')], order_by=[F('date').desc(), F('pk').desc()]),
+        ).filter(item_rank__lte=reviews_limit).order_by('-date', '-pk')
+        return self.prefetch_related(
+            'images', 'tags', 'specifications', models.Prefetch('feedbacks', queryset=latest_reviews),
+        )
+
+    def for_cards(self):
+        """What ItemCardSerializer reads: the first image and the tags, no reviews or specifications."""
+        return self.with_preview().prefetch_related('tags')
+
+    def with_preview(self):
+        """Annotate ``preview_src`` with the path of the first gallery image."""
+        first_image = ItemImage.objects.filter(item=OuterRef('pk')).order_by('pk').values('src')[:1]
+        return self.annotate(preview_src=Subquery(first_image))
+
+    def top_rated_per_root_category(self):
+        """The best rated item of every root category tree, found with one windowed query."""
+        root_id = Substr('category__path', 1, StrIndex('category__path', Value('/')) - 1)
+        return self.filter(category__isnull=False).annotate(
+            root_rank=Window(RowNumber(), partition_by=[root_id],
+                             order_by=[F('rating_avg').desc(), F('review_count').desc(), F('pk').desc()]),
+        ).filter(root_rank=1).order_by('-rating_avg', '-review_count', '-pk')
+
+    def rebuild_ratings(self):
+        """Recompute the stored rating columns from FeedBack rows in a single UPDATE."""
+        feedbacks = FeedBack.objects.filter(item=OuterRef('pk')).order_by().values('item')
+        rating_sum = Coalesce(Subquery(feedbacks.annotate(total=Sum('rate')).values('total')), 0)
+        review_count = Coalesce(Subquery(feedbacks.annotate(total=Count('pk')).values('total')), 0)
+        return self.update(
+            rating_sum=rating_sum,
+            review_count=review_count,
+            rating_avg=Coalesce(Cast(rating_sum, models.FloatField()) / NullIf(review_count, 0), 0.0),
+        )
+
 
 class Item(models.Model):
     class Meta:
         ordering = ['name', 'price']
+        indexes = [
+            models.Index(fields=['rating_avg', 'id'], name='item_rating_avg_idx'),
+            models.Index(fields=['review_count', 'id'], name='item_review_count_idx'),
+            # Partial indexes for the catalog's default filter (not archived, available): boolean
+            # filters are rendered as bare predicates, so they can't use a composite index prefix.
+            models.Index(fields=['date', 'id'], condition=Q(archived=False, available=True),
+                         name='item_catalog_date_idx'),
+            models.Index(fields=['price', 'id'], condition=Q(archived=False, available=True),
+                         name='item_catalog_price_idx'),
+            models.Index(fields=['date', 'id'], condition=Q(archived=False), name='item_listed_date_idx'),
+            models.Index(fields=['category', 'date', 'id'], name='item_category_idx'),
+            # Covers the catalog facets: the per-category counts and the tag facet's item list
+            # are read from the index alone, grouped in index order.
+            models.Index(fields=['category', 'price', 'free_delivery', 'available', 'id'],
+                         condition=Q(archived=False), name='item_facet_idx'),
+            models.Index(fields=['count'], condition=Q(count__lt=5), name='item_limited_idx'),
+        ]
+
+    objects = ItemQuerySet.as_manager()
 
     name = models.CharField(max_length=50)
     description = models.TextField(max_length=1000)
@@ -55,7 +163,9 @@ class Item(models.Model):
     free_delivery = models.BooleanField(default=False)
     available = models.BooleanField(default=True)
     tags = models.ManyToManyField(Tag, blank=True)
-
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_avg = models.FloatField(default=0.0, editable=False)
 
     @property
     def description_short(self) -> str:
@@ -67,22 +177,34 @@ class Item(models.Model):
     def __str__(self) -> str:
         return self.name
 
+    @property
+    def sale_price(self) -> Decimal:
+        return discounted_price(self.price, self.discount)
+
     def get_feedbacks_count(self):
-        return self.feedbacks.count()
+        return self.review_count
 
     def get_average_rating(self):
-        return self.feedbacks.aggregate(avg_rating=Avg('rate'))['avg_rating'] or 0.0
+        return self.rating_avg
 
     def calculate_overall_rating(self):
-        total_feedbacks = self.feedbacks.count()
-        total_rating = self.feedbacks.aggregate(sum_rating=Sum('rate'))['sum_rating'] or 0
-
-        if total_feedbacks > 0:
-            average_rating = total_rating / total_feedbacks
+        if self.review_count > 0:
+            average_rating = self.rating_avg
             return f"{average_rating:.1f} / 5" if average_rating % 1 != 0 else f"{int(average_rating)} / 5"
         else:
             return 0.0
 
+    @classmethod
+    def apply_feedback_rate(cls, item_id, rate, sign=1):
+        """Add (``sign=1``) or remove (``sign=-1``) one rate with a single atomic UPDATE."""
+        rating_sum = F('rating_sum') + sign * rate
+        review_count = F('review_count') + sign
+        cls.objects.filter(pk=item_id).update(
+            rating_sum=rating_sum,
+            review_count=review_count,
+            rating_avg=Coalesce(Cast(rating_sum, models.FloatField()) / NullIf(review_count, 0), 0.0),
+        )
+
     def save_related(self, request, form, formsets, change):
         super().save_related(request, form, formsets, change)
         item = form.instance
@@ -93,6 +215,21 @@ class Item(models.Model):
                 item.tags.add(tag)
 
 
+class Banner(models.Model):
+    class Meta:
+        ordering = ['position', 'pk']
+        indexes = [
+            models.Index(fields=['position', 'id'], condition=Q(active=True), name='banner_active_idx'),
+        ]
+
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='banners')
+    position = models.PositiveSmallIntegerField(default=0)
+    active = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"Banner for {self.item.name}"
+
+
 class Specification(models.Model):
     item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='specifications')
     name = models.CharField(max_length=50)
@@ -110,7 +247,63 @@ class ItemImage(models.Model):
         return f"Image for {self.item.name}"
 
 
+class OrderQuerySet(models.QuerySet):
+    def for_listing(self):
+        """
+        What the order serializers read: the customer and the order lines, in two queries.
+        The lines carry their own copy of the item data, so no Item is loaded.
+        """
+        return self.select_related('customer').prefetch_related(
+            models.Prefetch('basket_set', queryset=Basket.objects.order_by('pk')),
+        )
+
+    def get_active(self, customer, create=False):
+        """
+        The customer's basket order, locked until the end of the current transaction so
+        concurrent basket changes are applied one after another. The unique active order
+        constraint makes concurrent creation safe: the loser of the race gets the winner's row.
+        """
+        orders = self.select_for_update()
+        if create:
+            return orders.get_or_create(customer=customer, status='active', defaults={'total_amount': 0})[0]
+        return orders.filter(customer=customer, status='active').first()
+
+    def transition(self, to_status):
+        """
+        Move every order of the queryset that may go to ``to_status`` there (see shopapp.order_states)
+        and log an OrderEvent per moved order. Orders in other statuses are left alone. The orders are
+        locked and moved in batches of TRANSITION_BATCH_SIZE, each with one UPDATE of exactly the
+        locked ids, so the events always match the updated rows. Returns the number of orders moved.
+        """
+        movable = self.filter(status__in=sources_of(to_status)).select_for_update().order_by('pk')
+        total = last_pk = 0
+        with transaction.atomic():
+            while True:
+                moved = list(movable.filter(pk__gt=last_pk).values_list('pk', 'status')[:TRANSITION_BATCH_SIZE])
+                if not moved:
+                    return total
+                ids = [pk for pk, _ in moved]
+                if to_status in RELEASES_STOCK:
+                    StockReservation.objects.filter(order__in=ids).release()
+                self.model.objects.filter(pk__in=ids).update(status=to_status)
+                OrderEvent.objects.record(moved, to_status)
+                total += len(moved)
+                last_pk = ids[-1]
+
+
 class Order(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'status'], name='order_customer_status_idx'),
+            models.Index(fields=['customer', 'created_at', 'id'], name='order_customer_created_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['customer'], condition=Q(status='active'),
+                                    name='order_customer_active_unique'),
+        ]
+
+    objects = OrderQuerySet.as_manager()
+
     status_choice = [
         ('active', 'active'),
         ('pending', 'pending'),
@@ -121,6 +314,9 @@ class Order(models.Model):
     customer = models.ForeignKey(CustomUser, on_delete=models.PROTECT)
     created_at = models.DateTimeField(auto_now_add=True)
     items = models.ManyToManyField(Item, through='Basket')
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0, help_text='Items at list price')
+    discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    delivery_fee = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=10, choices=status_choice, default='active')
     payment_type = models.CharField(max_length=20)
@@ -129,10 +325,57 @@ class Order(models.Model):
     city = models.CharField(max_length=255)
     address = models.TextField()
 
+    def transition(self, to_status):
+        """
+        Move this order to ``to_status``, like OrderQuerySet.transition but without reading the
+        status again. Raises InvalidTransition if the status does not allow it or has changed.
+        """
+        moved = False
+        if can_transition(self.status, to_status):
+            with transaction.atomic(savepoint=False):
+                moved = Order.objects.filter(pk=self.pk, status=self.status).update(status=to_status)
+                if moved:
+                    if to_status in RELEASES_STOCK:
+                        StockReservation.objects.filter(order=self).release()
+                    OrderEvent.objects.record([(self.pk, self.status)], to_status)
+        # Raised outside the block, so the caller's transaction is still usable.
+        if not moved:
+            raise InvalidTransition(self.status, to_status)
+        self.status = to_status
+
     def calculate_total_amount(self):
-        total_amount = self.items.aggregate(total=Sum(F('price') - F('discount') * F('basket__quantity'), output_field=models.DecimalField()))['total']
-        self.total_amount = total_amount
-        return total_amount or Decimal('0.00')
+        """Re-price the order from all its lines; basket changes keep the amounts up to date without this."""
+        pricing.recalculate(self, self.basket_set.all())
+        return self.total_amount
+
+
+class OrderEventQuerySet(models.QuerySet):
+    def record(self, moved, to_status):
+        """Log ``(order id, from status)`` pairs moved to ``to_status`` with one INSERT, then send status_changed."""
+        self.bulk_create(self.model(order_id=pk, from_status=from_status, to_status=to_status)
+                         for pk, from_status in moved)
+        counts = {}
+        for _, from_status in moved:
+            counts[from_status, to_status] = counts.get((from_status, to_status), 0) + 1
+        status_changed.send(sender=Order, transitions=counts)
+
+
+class OrderEvent(models.Model):
+    """Append-only log of order status changes, written by the transitions of shopapp.order_states."""
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='orderevent_created_idx'),
+        ]
+
+    objects = OrderEventQuerySet.as_manager()
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='events')
+    from_status = models.CharField(max_length=10)
+    to_status = models.CharField(max_length=10)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Order {self.order_id}: {self.from_status} -> {self.to_status}"
 
 
 class Sale(models.Model):
@@ -147,10 +390,23 @@ class Sale(models.Model):
         return self.title
 
 
+class SaleItemQuerySet(models.QuerySet):
+    def for_listing(self):
+        return self.select_related('sale').prefetch_related(
+            models.Prefetch('item', queryset=Item.objects.for_cards()),
+        )
+
+
 class SaleItem(models.Model):
+    objects = SaleItemQuerySet.as_manager()
+
     sale = models.ForeignKey(Sale, on_delete=models.CASCADE)
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
 
+    @property
+    def sale_price(self) -> Decimal:
+        return discounted_price(self.item.price, self.sale.discount)
+
 
 class DeliverySettings(models.Model):
     delivery_type = models.CharField(max_length=20,
@@ -163,15 +419,242 @@ class DeliverySettings(models.Model):
         return str(self.delivery_type)
 
 
+class BasketQuerySet(models.QuerySet):
+    def for_listing(self):
+        return self.prefetch_related(models.Prefetch('item', queryset=Item.objects.for_listing()))
+
+    def add_item(self, order, item, count):
+        """
+        Add ``count`` pieces of ``item`` to the order with an atomic increment, so concurrent
+        additions are never lost, and move the order's amounts accordingly. Must run in a
+        transaction holding the order's lock. Returns the line and whether it was created.
+        """
+        snapshot = Basket.snapshot_of(item)
+        sale_price = snapshot['sale_price']
+        line, created = self.get_or_create(order=order, item=item,
+                                           defaults={**snapshot, 'quantity': count, 'line_total': sale_price * count})
+        old_subtotal, old_discount = ZERO, ZERO
+        if not created:
+            old_subtotal, old_discount = pricing.line_amounts(line.unit_price, line.sale_price, line.quantity)
+            self.filter(pk=line.pk).update(**snapshot, quantity=F('quantity') + count,
+                                           line_total=(F('quantity') + count) * sale_price)
+            line.refresh_from_db(fields=['quantity', 'line_total', *snapshot])
+        subtotal, discount = pricing.line_amounts(line.unit_price, line.sale_price, line.quantity)
+        pricing.apply(order, subtotal - old_subtotal, discount - old_discount)
+        return line, created
+
+    def remove_item(self, order, item_id, count):
+        """
+        Take ``count`` pieces of the item out of the order, deleting the line when nothing is left,
+        and move the order's amounts accordingly. Must run in a transaction holding the order's
+        lock. Returns 'update', 'remove' or None.
+        """
+        line = self.filter(order=order, item_id=item_id).first()
+        if line is None:
+            return None
+        if line.quantity > count:
+            self.filter(pk=line.pk).update(quantity=F('quantity') - count,
+                                           line_total=(F('quantity') - count) * F('sale_price'))
+            action = 'update'
+        else:
+            line.delete()
+            count, action = line.quantity, 'remove'
+        subtotal, discount = pricing.line_amounts(line.unit_price, line.sale_price, count)
+        pricing.apply(order, -subtotal, -discount)
+        return action
+
+    def apply_changes(self, order, items, changes):
+        """
+        Apply ``{item id: quantity change}`` to the order with one read, one upsert, one delete
+        and one update of the order's amounts. ``items`` maps the ids to Item instances. Must run
+        in a transaction holding the order's lock (see OrderQuerySet.get_active), as the new
+        quantities are computed from the read.
+        Returns ``{item id: 'add' | 'update' | 'remove'}`` for the lines that changed.
+        """
+        current = {line.item_id: line for line in self.filter(order=order, item_id__in=changes)
+                   .only('item_id', 'quantity', 'unit_price', 'sale_price')}
+        upserts, removed, actions = [], [], {}
+        subtotal, discount = ZERO, ZERO
+        for item_id, change in changes.items():
+            old = current.get(item_id)
+            if old is not None:
+                old_subtotal, old_discount = pricing.line_amounts(old.unit_price, old.sale_price, old.quantity)
+                subtotal, discount = subtotal - old_subtotal, discount - old_discount
+            quantity = (old.quantity if old else 0) + change
+            if quantity > 0:
+                snapshot = Basket.snapshot_of(items[item_id])
+                upserts.append(self.model(order=order, item_id=item_id, quantity=quantity,
+                                          line_total=snapshot['sale_price'] * quantity, **snapshot))
+                actions[item_id] = 'update' if old else 'add'
+                new_subtotal, new_discount = pricing.line_amounts(snapshot['unit_price'], snapshot['sale_price'],
+                                                                  quantity)
+                subtotal, discount = subtotal + new_subtotal, discount + new_discount
+            elif old:
+                removed.append(item_id)
+                actions[item_id] = 'remove'
+        if upserts:
+            self.bulk_create(upserts, update_conflicts=True, unique_fields=['order', 'item'],
+                             update_fields=['quantity', 'line_total', *Basket.SNAPSHOT_FIELDS])
+        if removed:
+            self.filter(order=order, item_id__in=removed).delete()
+        pricing.apply(order, subtotal, discount)
+        return actions
+
+    def freeze(self, order):
+        """
+        Copy the current title, prices, delivery terms and image of every item into the
+        order's lines, so the order reads the same however the catalog changes later, and
+        re-price the order from them. Called at checkout; the order itself is left for the
+        caller to save. Three queries whatever the number of lines.
+        """
+        lines = list(self.filter(order=order))
+        items = Item.objects.with_preview().in_bulk([line.item_id for line in lines])
+        for line in lines:
+            item = items[line.item_id]
+            for field, value in Basket.snapshot_of(item).items():
+                setattr(line, field, value)
+            line.line_total = line.sale_price * line.quantity
+        self.bulk_update(lines, ['line_total', *Basket.SNAPSHOT_FIELDS])
+        pricing.recalculate(order, lines)
+        return order
+
+
 class Basket(models.Model):
+    """
+    A line of an order. Besides the quantity it keeps a copy of the item's title, description,
+    prices and image (refreshed on every basket change and frozen at checkout), so orders are
+    rendered and totalled from their own rows.
+    """
+    SNAPSHOT_FIELDS = ['title', 'description', 'unit_price', 'discount', 'sale_price', 'free_delivery', 'image']
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'item'], name='basket_order_item_unique'),
+        ]
+
+    objects = BasketQuerySet.as_manager()
+
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=0)
+    title = models.CharField(max_length=50, blank=True, default='')
+    description = models.TextField(max_length=1000, blank=True, default='')
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, help_text='Item price before discount')
+    discount = models.SmallIntegerField(default=0)
     sale_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    line_total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    free_delivery = models.BooleanField(default=False)
+    image = models.CharField(max_length=100, blank=True, default='')
+
+    @staticmethod
+    def snapshot_of(item):
+        """The item data a line keeps. The image is the first gallery image when ``item`` comes from with_preview()."""
+        return {
+            'title': item.name,
+            'description': item.description,
+            'unit_price': item.price,
+            'discount': item.discount,
+            'sale_price': item.sale_price,
+            'free_delivery': item.free_delivery,
+            'image': getattr(item, 'preview_src', None) or item.preview.name or '',
+        }
+
+
+class OutOfStock(Exception):
+    def __init__(self, item_ids):
+        super().__init__(f'Not enough stock for items {sorted(item_ids)}')
+        self.item_ids = sorted(item_ids)
+
+
+class StockReservationQuerySet(models.QuerySet):
+    def reserve(self, order, timeout):
+        """
+        Take the order's quantities out of ``Item.count`` with one conditional UPDATE and hold
+        them for ``timeout`` seconds. If any item is short nothing is reserved and OutOfStock
+        is raised, so stock never goes negative however many checkouts run at once.
+        """
+        quantities = dict(Basket.objects.filter(order=order).values_list('item_id', 'quantity'))
+        if not quantities:
+            return []
+        needed = models.Case(*[models.When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()])
+        try:
+            with transaction.atomic():
+                updated = Item.objects.filter(pk__in=quantities, count__gte=needed).update(count=F('count') - needed)
+                if updated != len(quantities):
+                    # Leaving the block with an exception undoes the rows that were decremented.
+                    raise OutOfStock([])
+                expires_at = timezone.now() + timedelta(seconds=timeout)
+                return self.bulk_create(
+                    self.model(order=order, item_id=pk, quantity=quantity, expires_at=expires_at)
+                    for pk, quantity in quantities.items()
+                )
+        except OutOfStock:
+            stock = dict(Item.objects.filter(pk__in=quantities).values_list('pk', 'count'))
+            raise OutOfStock([pk for pk, quantity in quantities.items() if stock.get(pk, 0) < quantity])
+
+    def commit(self, order, timeout):
+        """Make the order's hold permanent on payment, reserving again if it has expired meanwhile."""
+        reservations = self.filter(order=order)
+        with transaction.atomic():
+            # Locked, so a concurrent sweep can't release the hold between the check and the update.
+            statuses = set(reservations.select_for_update().exclude(status=StockReservation.RELEASED)
+                           .values_list('status', flat=True))
+            if StockReservation.COMMITTED in statuses:
+                return 0
+            if StockReservation.HELD not in statuses:
+                self.reserve(order, timeout)
+            return reservations.filter(status=StockReservation.HELD).update(status=StockReservation.COMMITTED)
+
+    def release(self):
+        """Give the held quantities of these reservations back to stock with one UPDATE of the items."""
+        with transaction.atomic():
+            held = list(self.select_for_update().filter(status=StockReservation.HELD).values_list('pk', 'item_id',
+                                                                                                   'quantity'))
+            if not held:
+                return 0
+            returned = {}
+            for _, item_id, quantity in held:
+                returned[item_id] = returned.get(item_id, 0) + quantity
+            amount = models.Case(*[models.When(pk=pk, then=Value(quantity)) for pk, quantity in returned.items()])
+            Item.objects.filter(pk__in=returned).update(count=F('count') + amount)
+            return StockReservation.objects.filter(pk__in=[pk for pk, _, _ in held], status=StockReservation.HELD).update(
+                status=StockReservation.RELEASED,
+            )
+
+    def release_expired(self, now=None):
+        return self.filter(status=StockReservation.HELD, expires_at__lte=now or timezone.now()).release()
+
+
+class StockReservation(models.Model):
+    HELD = 'held'
+    COMMITTED = 'committed'
+    RELEASED = 'released'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], condition=Q(status='held'), name='reservation_held_idx'),
+        ]
 
+    objects = StockReservationQuerySet.as_manager()
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, default=HELD,
+                              choices=[(HELD, 'Held'), (COMMITTED, 'Committed'), (RELEASED, 'Released')])
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.quantity} x {self.item_id} for order {self.order_id} ({self.status})"
 
 
 class FeedBack(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=['item', 'date', 'id'], name='feedback_item_date_idx'),
+        ]
+
     item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='feedbacks')
     author = models.CharField(max_length=50)
     email = models.EmailField()
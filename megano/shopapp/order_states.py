@@ -0,0 +1,48 @@
+"""
+Order status state machine.
+
+    active -> pending -> payment -> delivery -> archived
+
+An active order is the customer's basket. Checkout makes it pending, confirming
+the delivery details moves it to payment and paying to delivery. Any order that
+is not archived yet can be archived; archiving gives held stock back.
+
+Statuses are only changed through ``OrderQuerySet.transition`` (or
+``Order.transition`` for one order): the movable orders are locked in batches
+of ``TRANSITION_BATCH_SIZE``, and each batch is moved with one ``UPDATE`` of the
+locked ids plus one ``OrderEvent`` row per order, written with ``bulk_create``.
+``status_changed`` is sent after each batch with the number of orders moved
+per ``(from_status, to_status)``.
+"""
+from django.dispatch import Signal
+
+TRANSITIONS = {
+    'active': {'pending', 'archived'},
+    'pending': {'payment', 'archived'},
+    'payment': {'delivery', 'archived'},
+    'delivery': {'archived'},
+    'archived': set(),
+}
+# Targets for which the held stock reservations of the moved orders are released.
+RELEASES_STOCK = {'archived'}
+TRANSITION_BATCH_SIZE = 1000
+
+status_changed = Signal()
+
+
+class InvalidTransition(Exception):
+    def __init__(self, from_status, to_status):
+        super().__init__(f'An order cannot go from {from_status!r} to {to_status!r}')
+        self.from_status = from_status
+        self.to_status = to_status
+
+
+def can_transition(from_status, to_status) -> bool:
+    return to_status in TRANSITIONS.get(from_status, ())
+
+
+def sources_of(to_status) -> list:
+    """Statuses an order may be in to move to ``to_status``."""
+    if to_status not in TRANSITIONS:
+        raise ValueError(f'Unknown order status {to_status!r}')
+    return sorted(status for status, targets in TRANSITIONS.items() if to_status in targets)
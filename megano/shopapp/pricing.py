@@ -0,0 +1,155 @@
+"""
+Order pricing.
+
+An order keeps four amounts: ``subtotal`` (list prices times quantities),
+``discount`` (what the item discounts take off), ``delivery_fee`` and the grand
+total ``total_amount``. They are maintained incrementally: every basket change
+passes the difference it makes to ``OrderPricing.apply``, which moves the
+amounts with one ``UPDATE`` of F() expressions, so no change ever has to add up
+the whole order again. Checkout and the admin re-price an order from its lines
+with ``recalculate``. The same ``pricing`` object is used by the basket, the
+checkout views and the admin, so the formulas live in this module only.
+
+The delivery rules (``DeliverySettings`` rows) are kept per process as an
+immutable ``PricingRules``, so pricing an order costs a cache lookup rather
+than a query. Saving or deleting a row bumps the ``pricing`` version in the
+cache (see ``shopapp.signals``) and the rules are reloaded when the version
+changes. That reaches every worker only when the cache is shared between them;
+with a per-process cache such as LocMemCache other workers never see the bump,
+so the rules are also reloaded once they are older than
+``settings.PRICING_RULES_TTL`` seconds, which bounds how long a worker can
+price with outdated rules.
+"""
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import F
+
+from .cache import bump_version, get_version
+
+ZERO = Decimal('0.00')
+RULES_NAMESPACE = 'pricing'
+DEFAULT_RULES_TTL = 60
+
+
+def discounted_price(price, discount) -> Decimal:
+    """Unit price after a percentage discount; the one formula used for cards, baskets and orders."""
+    return (Decimal(price) * (100 - discount) / 100).quantize(Decimal('0.01'))
+
+
+@dataclass(frozen=True)
+class DeliveryRule:
+    delivery_type: str
+    standard_fee: Decimal
+    free_threshold: Decimal
+    express_fee: Decimal
+
+    def fee(self, amount) -> Decimal:
+        """
+        The standard fee below the free delivery threshold, plus the express fee for
+        express delivery. Nothing is charged for an empty order.
+        """
+        if amount <= 0:
+            return ZERO
+        fee = self.standard_fee if amount < self.free_threshold else ZERO
+        if self.delivery_type == 'express':
+            fee += self.express_fee
+        return fee
+
+
+@dataclass(frozen=True)
+class PricingRules:
+    delivery: tuple = ()
+
+    def delivery_rule(self, delivery_type):
+        """The rule of a delivery type; the first one wins if the admin has several. None if there is none."""
+        return next((rule for rule in self.delivery if rule.delivery_type == delivery_type), None)
+
+
+def load_rules() -> PricingRules:
+    from .models import DeliverySettings
+
+    return PricingRules(delivery=tuple(
+        DeliveryRule(delivery_type=row.delivery_type, standard_fee=row.standard_delivery_fee,
+                     free_threshold=row.free_delivery_threshold, express_fee=row.express_delivery_fee)
+        for row in DeliverySettings.objects.order_by('pk')
+    ))
+
+
+class OrderPricing:
+    def __init__(self):
+        # (version, loaded_at, rules), replaced as a whole so concurrent threads never see a mix.
+        self.cached_rules = (None, None, None)
+
+    def get_rules(self) -> PricingRules:
+        """
+        The current rules. This process reloads them at once when the ``pricing`` version
+        changes. With the configured LocMemCache, that happens only for changes made in this
+        process. Changes made through another worker become visible here only when the rules
+        expire, so they can be up to ``PRICING_RULES_TTL`` seconds (60 by default) late.
+        """
+        version = get_version(RULES_NAMESPACE)
+        cached_version, loaded_at, rules = self.cached_rules
+        now = time.monotonic()
+        ttl = getattr(settings, 'PRICING_RULES_TTL', DEFAULT_RULES_TTL)
+        if rules is None or cached_version != version or now - loaded_at >= ttl:
+            rules = load_rules()
+            self.cached_rules = (version, now, rules)
+        return rules
+
+    def invalidate(self):
+        """
+        Make the processes sharing the cache reload the rules; the others reload them within
+        ``PRICING_RULES_TTL``. Call it once the change is committed.
+        """
+        bump_version(RULES_NAMESPACE)
+
+    def line_amounts(self, unit_price, sale_price, quantity):
+        """What a line adds to the order's (subtotal, discount)."""
+        return unit_price * quantity, (unit_price - sale_price) * quantity
+
+    def delivery_fee(self, order, subtotal, discount) -> Decimal:
+        """Fee of the order's delivery type for the given amounts; no rule for the type means no fee."""
+        rule = self.get_rules().delivery_rule(order.delivery_type)
+        return rule.fee(subtotal - discount) if rule else ZERO
+
+    def apply(self, order, subtotal=ZERO, discount=ZERO):
+        """
+        Move the order's amounts by the given differences with a single UPDATE. The caller must
+        hold the order's lock (see OrderQuerySet.get_active), as the delivery fee is worked out
+        from the amounts of ``order``, which are updated in place as well.
+        """
+        if not subtotal and not discount:
+            return order
+        fee = self.delivery_fee(order, order.subtotal + subtotal, order.discount + discount)
+        type(order).objects.filter(pk=order.pk).update(
+            subtotal=F('subtotal') + subtotal,
+            discount=F('discount') + discount,
+            delivery_fee=fee,
+            total_amount=F('subtotal') + subtotal - F('discount') - discount + fee,
+        )
+        order.subtotal += subtotal
+        order.discount += discount
+        order.delivery_fee = fee
+        order.total_amount = order.subtotal - order.discount + fee
+        return order
+
+    def recalculate(self, order, lines):
+        """Set all the amounts of ``order`` from its ``lines``, without saving it."""
+        order.subtotal, order.discount = ZERO, ZERO
+        for line in lines:
+            subtotal, discount = self.line_amounts(line.unit_price, line.sale_price, line.quantity)
+            order.subtotal += subtotal
+            order.discount += discount
+        return self.update_delivery(order)
+
+    def update_delivery(self, order):
+        """Re-price the delivery after the delivery type changed, without saving the order."""
+        order.delivery_fee = self.delivery_fee(order, order.subtotal, order.discount)
+        order.total_amount = order.subtotal - order.discount + order.delivery_fee
+        return order
+
+
+pricing = OrderPricing()
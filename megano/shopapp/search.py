@@ -0,0 +1,219 @@
+"""
+Full-text search over items.
+
+Each item is indexed as one document (name, description, tag names and
+specifications) in a side table owned by the active backend:
+
+* SQLite   - an FTS5 virtual table ranked with bm25;
+* PostgreSQL - a table of tsvectors with a GIN index, ranked with ts_rank;
+* anything else - no index, plain ``icontains`` on the name.
+
+``search_items`` narrows a queryset to the matching items and annotates
+``search_rank`` (higher is better). Every query word is matched as a prefix.
+The index is kept in sync by signals (see ``shopapp.signals``) and can be
+rebuilt from scratch with ``manage.py rebuild_search_index``.
+"""
+import re
+
+from django.db import connection, models, transaction
+from django.db.models.expressions import RawSQL
+
+SEARCH_TABLE = 'shopapp_itemsearch'
+REBUILD_BATCH_SIZE = 2000
+
+word_re = re.compile(r'\w+', re.UNICODE)
+
+
+def item_document(item) -> dict:
+    return {
+        'name': item.name,
+        'description': item.description,
+        'tags': ' '.join(tag.name for tag in item.tags.all()),
+        'specifications': ' '.join(f'{spec.name} {spec.value}' for spec in item.specifications.all()),
+    }
+
+
+class ItemRank(models.Expression):
+    """
+    A scalar subquery over the search table, correlated with the item through ``{pk}``.
+    The pk column is compiled by Django, so it follows the item table's alias when the
+    searched queryset is nested in another query (e.g. the catalog's tag facet).
+    """
+    output_field = models.FloatField()
+
+    def __init__(self, sql, params):
+        super().__init__()
+        self.sql = sql
+        self.params = params
+        self.pk = models.F('pk')
+
+    def get_source_expressions(self):
+        return [self.pk]
+
+    def set_source_expressions(self, exprs):
+        self.pk, = exprs
+
+    def as_sql(self, compiler, connection):
+        pk_sql, pk_params = compiler.compile(self.pk)
+        return f'({self.sql.format(pk=pk_sql)})', [*self.params, *pk_params]
+
+
+class BaseSearchBackend:
+    vendor = None
+
+    def __init__(self, db_connection):
+        self.connection = db_connection
+
+    def create_index(self):
+        pass
+
+    def drop_index(self):
+        pass
+
+    def index_items(self, items):
+        pass
+
+    def remove_items(self, item_ids):
+        pass
+
+    def filter(self, queryset, words):
+        queryset = queryset.filter(name__icontains=' '.join(words))
+        return queryset.annotate(search_rank=models.Value(0.0, output_field=models.FloatField()))
+
+    def rebuild(self, item_model=None):
+        if item_model is None:
+            from .models import Item as item_model
+
+        # One transaction: searches keep seeing the old index until the new one is complete,
+        # and SQLite does not sync to disk after every inserted row.
+        with transaction.atomic(using=self.connection.alias):
+            self.drop_index()
+            self.create_index()
+            items = item_model.objects.order_by('pk').prefetch_related('tags', 'specifications')
+            indexed = 0
+            last_pk = 0
+            while True:
+                batch = list(items.filter(pk__gt=last_pk)[:REBUILD_BATCH_SIZE])
+                if not batch:
+                    return indexed
+                self.index_items(batch)
+                indexed += len(batch)
+                last_pk = batch[-1].pk
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    vendor = 'sqlite'
+    # Column weights for bm25: a hit in the name counts most, the description least.
+    weights = '10.0, 1.0, 5.0, 3.0'
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5('
+                f"name, description, tags, specifications, tokenize='unicode61 remove_diacritics 2')"
+            )
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+    def index_items(self, items):
+        rows = [(item.pk, *item_document(item).values()) for item in items]
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, name, description, tags, specifications) '
+                f'VALUES (%s, %s, %s, %s, %s)',
+                rows,
+            )
+
+    def remove_items(self, item_ids):
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [(pk,) for pk in item_ids])
+
+    def filter(self, queryset, words):
+        match = ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+        queryset = queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s',
+                                                 [match]))
+        return queryset.annotate(search_rank=ItemRank(
+            f'SELECT -bm25({SEARCH_TABLE}, {self.weights}) FROM {SEARCH_TABLE} '
+            f'WHERE {SEARCH_TABLE} MATCH %s AND {SEARCH_TABLE}.rowid = {{pk}}',
+            [match],
+        ))
+
+
+class PostgreSQLSearchBackend(BaseSearchBackend):
+    vendor = 'postgresql'
+    config = 'simple'
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ('
+                f'item_id bigint PRIMARY KEY, document tsvector NOT NULL)'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document ON {SEARCH_TABLE} USING GIN (document)'
+            )
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+    def index_items(self, items):
+        rows = []
+        for item in items:
+            document = item_document(item)
+            rows.append((item.pk, document['name'], document['tags'], document['specifications'],
+                         document['description']))
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {SEARCH_TABLE} (item_id, document) VALUES (%s, '
+                f"setweight(to_tsvector('{self.config}', %s), 'A') || "
+                f"setweight(to_tsvector('{self.config}', %s), 'B') || "
+                f"setweight(to_tsvector('{self.config}', %s), 'C') || "
+                f"setweight(to_tsvector('{self.config}', %s), 'D')) "
+                f'ON CONFLICT (item_id) DO UPDATE SET document = EXCLUDED.document',
+                rows,
+            )
+
+    def remove_items(self, item_ids):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE item_id = ANY(%s)', [list(item_ids)])
+
+    def filter(self, queryset, words):
+        tsquery = ' & '.join(f'{word}:*' for word in words)
+        queryset = queryset.filter(pk__in=RawSQL(
+            f"SELECT item_id FROM {SEARCH_TABLE} WHERE document @@ to_tsquery('{self.config}', %s)", [tsquery],
+        ))
+        return queryset.annotate(search_rank=ItemRank(
+            f"SELECT ts_rank(document, to_tsquery('{self.config}', %s)) FROM {SEARCH_TABLE} WHERE item_id = {{pk}}",
+            [tsquery],
+        ))
+
+
+backends = {backend.vendor: backend for backend in [SQLiteSearchBackend, PostgreSQLSearchBackend]}
+
+
+def get_backend(db_connection=None) -> BaseSearchBackend:
+    db_connection = db_connection or connection
+    return backends.get(db_connection.vendor, BaseSearchBackend)(db_connection)
+
+
+def search_items(queryset, query: str):
+    words = word_re.findall(query)
+    if not words:
+        return queryset.annotate(search_rank=models.Value(0.0, output_field=models.FloatField()))
+    return get_backend().filter(queryset, words)
+
+
+def reindex_items(item_ids):
+    from .models import Item
+
+    items = list(Item.objects.filter(pk__in=item_ids).prefetch_related('tags', 'specifications'))
+    if items:
+        get_backend().index_items(items)
+
+
+def remove_items(item_ids):
+    get_backend().remove_items(item_ids)
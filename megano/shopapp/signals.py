@@ -0,0 +1,83 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from . import search
+from .models import DeliverySettings, Item, FeedBack, Specification, Tag
+from .pricing import pricing
+
+
+@receiver(pre_save, sender=FeedBack)
+def remember_feedback_rate(sender, instance: FeedBack, **kwargs):
+    instance._previous_rate = None
+    if instance.pk:
+        instance._previous_rate = FeedBack.objects.filter(pk=instance.pk).values_list('item_id', 'rate').first()
+
+
+@receiver(post_save, sender=FeedBack)
+def add_feedback_rate(sender, instance: FeedBack, created, **kwargs):
+    previous = getattr(instance, '_previous_rate', None)
+    if previous:
+        Item.apply_feedback_rate(*previous, sign=-1)
+    Item.apply_feedback_rate(instance.item_id, instance.rate)
+
+
+@receiver(post_delete, sender=FeedBack)
+def remove_feedback_rate(sender, instance: FeedBack, **kwargs):
+    Item.apply_feedback_rate(instance.item_id, instance.rate, sign=-1)
+
+
+@receiver(post_save, sender=Item)
+def index_item(sender, instance: Item, raw=False, **kwargs):
+    if not raw:
+        search.reindex_items([instance.pk])
+
+
+@receiver(post_delete, sender=Item)
+def unindex_item(sender, instance: Item, **kwargs):
+    search.remove_items([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Specification)
+def index_specification_item(sender, instance: Specification, raw=False, **kwargs):
+    if not raw:
+        search.reindex_items([instance.item_id])
+
+
+@receiver(m2m_changed, sender=Item.tags.through)
+def index_tagged_items(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return
+    if not reverse:
+        item_ids = [instance.pk]
+    elif action == 'pre_clear':
+        # The affected items are gone by post_clear, so remember them here.
+        instance._cleared_item_ids = list(instance.item_set.values_list('pk', flat=True))
+        return
+    elif action == 'post_clear':
+        item_ids = getattr(instance, '_cleared_item_ids', [])
+    else:
+        item_ids = pk_set
+    search.reindex_items(item_ids)
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tag_items(sender, instance: Tag, **kwargs):
+    instance._tagged_item_ids = list(instance.item_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def index_tag_items(sender, instance: Tag, raw=False, **kwargs):
+    if raw:
+        return
+    item_ids = getattr(instance, '_tagged_item_ids', None)
+    if item_ids is None:
+        item_ids = list(instance.item_set.values_list('pk', flat=True))
+    search.reindex_items(item_ids)
+
+
+@receiver([post_save, post_delete], sender=DeliverySettings)
+def invalidate_pricing_rules(sender, **kwargs):
+    # After the commit: a worker reloading earlier would cache the old rows under the new version.
+    transaction.on_commit(pricing.invalidate)
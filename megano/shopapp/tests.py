@@ -1,3 +1,399 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from myauth.models import CustomUser
+
+from .models import (Basket, DeliverySettings, Item, FeedBack, Category, Order, OrderEvent, OutOfStock, SaleItem,
+                     Specification, StockReservation, Tag)
+from .order_states import InvalidTransition
+from .pricing import pricing
+from .search import search_items
+
+
+class ItemRatingColumnsTestCase(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='Item', description='Description', price=100)
+
+    def add_feedback(self, rate, item=None):
+        return FeedBack.objects.create(item=item or self.item, author='Author', email='author@example.com',
+                                       text='Text', rate=rate)
+
+    def assertRating(self, rating_sum, review_count, rating_avg):
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.rating_sum, self.item.review_count), (rating_sum, review_count))
+        self.assertAlmostEqual(self.item.rating_avg, rating_avg)
+
+    def test_feedback_create_and_delete_update_columns(self):
+        first = self.add_feedback(4)
+        self.add_feedback(5)
+        self.assertRating(9, 2, 4.5)
+
+        first.delete()
+        self.assertRating(5, 1, 5.0)
+
+        FeedBack.objects.all().delete()
+        self.assertRating(0, 0, 0.0)
+
+    def test_feedback_edit_moves_rate(self):
+        other = Item.objects.create(name='Other', description='Description', price=100)
+        feedback = self.add_feedback(2)
+
+        feedback.rate = 4
+        feedback.save()
+        self.assertRating(4, 1, 4.0)
+
+        feedback.item = other
+        feedback.save()
+        self.assertRating(0, 0, 0.0)
+        other.refresh_from_db()
+        self.assertEqual((other.rating_sum, other.review_count), (4, 1))
+
+    def test_rebuild_command_restores_columns(self):
+        FeedBack.objects.bulk_create(
+            FeedBack(item=self.item, author='Author', email='author@example.com', text='Text', rate=rate)
+            for rate in [1, 2, 5]
+        )
+        self.assertRating(0, 0, 0.0)
+
+        call_command('rebuild_ratings', stdout=StringIO())
+        self.assertRating(8, 3, 8 / 3)
+        self.assertEqual(self.item.calculate_overall_rating(), '2.7 / 5')
+
+
+class CategoryPathTestCase(TestCase):
+    def create_chain(self, depth, parent=None):
+        chain = []
+        for level in range(depth):
+            parent = Category.objects.create(title=f'Level {level}', parent_category=parent, image='category/image.jpg')
+            chain.append(parent)
+        return chain
+
+    def test_descendants_and_ancestors_of_deep_tree(self):
+        chain = self.create_chain(8)
+        sibling = Category.objects.create(title='Sibling', parent_category=chain[2], image='category/image.jpg')
+        root = Category.objects.get(pk=chain[0].pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            descendant_ids = set(root.descendant_ids())
+            ancestors = list(chain[-1].ancestors())
+
+        self.assertEqual(len(queries.captured_queries), 2)
+        self.assertEqual(descendant_ids, {category.pk for category in chain} | {sibling.pk})
+        self.assertEqual(ancestors, chain[:-1])
+        self.assertEqual(set(chain[2].descendant_ids(include_self=False)), {category.pk for category in chain[3:]} | {sibling.pk})
+
+    def test_moving_subtree_rewrites_descendant_paths(self):
+        chain = self.create_chain(5)
+        other_root = Category.objects.create(title='Other', image='category/image.jpg')
+
+        moved = chain[2]
+        moved.parent_category = other_root
+        moved.save()
+
+        leaf = Category.objects.get(pk=chain[-1].pk)
+        self.assertEqual(list(leaf.ancestors()), [other_root, chain[2], chain[3]])
+        self.assertEqual(set(Category.objects.get(pk=chain[0].pk).descendant_ids()), {chain[0].pk, chain[1].pk})
+
+    def test_category_cannot_be_moved_under_its_descendant(self):
+        chain = self.create_chain(3)
+        root = chain[0]
+        root.parent_category = chain[2]
+
+        with self.assertRaises(ValidationError):
+            root.full_clean()
+
+
+class ItemSearchTestCase(TestCase):
+    def setUp(self):
+        self.phone = Item.objects.create(name='Smartphone Galaxy', description='Android phone', price=100)
+        self.laptop = Item.objects.create(name='Laptop', description='Comes with a smartphone charger', price=200)
+        self.lamp = Item.objects.create(name='Lamp', description='Desk lamp', price=10)
+
+    def search(self, query):
+        return list(search_items(Item.objects.all(), query).order_by('-search_rank').values_list('pk', flat=True))
+
+    def test_prefix_match_ranks_name_hits_first(self):
+        self.assertEqual(self.search('smart'), [self.phone.pk, self.laptop.pk])
+        self.assertEqual(self.search('smartphone galax'), [self.phone.pk])
+
+    def test_tags_and_specifications_are_searchable(self):
+        tag = Tag.objects.create(name='lighting')
+        self.lamp.tags.add(tag)
+        Specification.objects.create(item=self.laptop, name='Processor', value='Quadcore')
+
+        self.assertEqual(self.search('lighting'), [self.lamp.pk])
+        self.assertEqual(self.search('quadcore'), [self.laptop.pk])
+
+        tag.name = 'illumination'
+        tag.save()
+        self.assertEqual(self.search('lighting'), [])
+        self.assertEqual(self.search('illumination'), [self.lamp.pk])
+
+        self.lamp.tags.clear()
+        self.assertEqual(self.search('illumination'), [])
+
+    def test_item_changes_are_reindexed(self):
+        self.lamp.name = 'Floor light'
+        self.lamp.save()
+        self.assertEqual(self.search('floor'), [self.lamp.pk])
+
+        self.lamp.delete()
+        self.assertEqual(self.search('floor'), [])
+
+    def test_rebuild_command_indexes_bulk_created_items(self):
+        Item.objects.bulk_create([Item(name='Kettle', description='Steel', price=5)])
+        self.assertEqual(self.search('kettle'), [])
+
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(self.search('kettle')), 1)
+        self.assertEqual(self.search('smart'), [self.phone.pk, self.laptop.pk])
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(self.search('"smart OR* NEAR('), [])
+        self.assertEqual(self.search('smart*'), [self.phone.pk, self.laptop.pk])
+
+
+class SeedShopCommandTestCase(TestCase):
+    def seed(self, **options):
+        call_command('seed_shop', items=200, stdout=StringIO(), **options)
+
+    def test_generated_data_is_consistent(self):
+        self.seed()
+
+        self.assertEqual(Item.objects.count(), 200)
+        self.assertTrue(Order.objects.exists())
+        self.assertTrue(Basket.objects.exists())
+        self.assertTrue(SaleItem.objects.exists())
+        for category in Category.objects.all():
+            parent_path = category.parent_category.path if category.parent_category else ''
+            self.assertEqual(category.path, f'{parent_path}{category.pk}/')
+        stored = list(Item.objects.order_by('pk').values_list('rating_sum', 'review_count', 'rating_avg'))
+        Item.objects.rebuild_ratings()
+        self.assertEqual(list(Item.objects.order_by('pk').values_list('rating_sum', 'review_count', 'rating_avg')),
+                         stored)
+        self.assertTrue(search_items(Item.objects.all(), Item.objects.first().name).exists())
+
+    def test_same_seed_generates_same_data(self):
+        self.seed(seed=7)
+        self.seed(seed=7)
+        self.seed(seed=8)
+
+        rows = list(Item.objects.order_by('pk').values_list('name', 'price', 'review_count'))
+        self.assertEqual(rows[:200], rows[200:400])
+        self.assertNotEqual(rows[:200], rows[400:])
+
+
+class StockReservationTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='buyer', password='secret')
+        self.phone = Item.objects.create(name='Phone', description='Description', price=100, count=5)
+        self.lamp = Item.objects.create(name='Lamp', description='Description', price=10, count=1)
+        self.order = Order.objects.create(customer=self.user, total_amount=0)
+        Basket.objects.create(order=self.order, item=self.phone, quantity=2)
+        Basket.objects.create(order=self.order, item=self.lamp, quantity=1)
+
+    def stock(self):
+        return list(Item.objects.order_by('pk').values_list('count', flat=True))
+
+    def test_reserve_and_release(self):
+        StockReservation.objects.reserve(self.order, 60)
+        self.assertEqual(self.stock(), [3, 0])
+
+        call_command('release_reservations', stdout=StringIO())
+        self.assertEqual(self.stock(), [3, 0])
+
+        out = StringIO()
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=61)):
+            call_command('release_reservations', stdout=out)
+        self.assertIn('2 expired reservations released', out.getvalue())
+        self.assertEqual(self.stock(), [5, 1])
+        self.assertFalse(StockReservation.objects.filter(status=StockReservation.HELD).exists())
+
+    def test_short_item_reserves_nothing(self):
+        Basket.objects.filter(item=self.lamp).update(quantity=2)
+
+        with self.assertRaises(OutOfStock) as error:
+            StockReservation.objects.reserve(self.order, 60)
+
+        self.assertEqual(error.exception.item_ids, [self.lamp.pk])
+        self.assertEqual(self.stock(), [5, 1])
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_commit(self):
+        StockReservation.objects.reserve(self.order, 60)
+        StockReservation.objects.all().release()
+
+        # The hold expired before payment, so committing reserves again; a second commit changes nothing.
+        self.assertEqual(StockReservation.objects.commit(self.order, 60), 2)
+        self.assertEqual(StockReservation.objects.commit(self.order, 60), 0)
+        self.assertEqual(self.stock(), [3, 0])
+        self.assertEqual(StockReservation.objects.filter(status=StockReservation.COMMITTED).count(), 2)
+
+
+class OrderPricingTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='buyer', password='secret')
+        self.phone = Item.objects.create(name='Phone', description='Description', price=1000, discount=10)
+        self.lamp = Item.objects.create(name='Lamp', description='Description', price=Decimal('99.90'))
+        self.order = Order.objects.create(customer=self.user, total_amount=0, delivery_type='ordinary')
+        with self.captureOnCommitCallbacks(execute=True):
+            DeliverySettings.objects.create(delivery_type='ordinary', standard_delivery_fee=200,
+                                            free_delivery_threshold=2000)
+        # The rows are rolled back after the test without a signal, so drop the cached rules too.
+        self.addCleanup(pricing.invalidate)
+
+    def amounts(self, order=None):
+        order = Order.objects.get(pk=self.order.pk) if order is None else order
+        return order.subtotal, order.discount, order.delivery_fee, order.total_amount
+
+    def assertAmountsMatchLines(self):
+        order = Order.objects.get(pk=self.order.pk)
+        expected = self.amounts(pricing.recalculate(Order.objects.get(pk=self.order.pk), order.basket_set.all()))
+        self.assertEqual(self.amounts(order), expected)
+        self.assertEqual(self.amounts(self.order), expected)
+
+    def test_basket_changes_keep_the_amounts_up_to_date(self):
+        Basket.objects.add_item(self.order, self.phone, 1)
+        self.assertEqual(self.amounts(), (1000, 100, 200, 1100))
+
+        Basket.objects.add_item(self.order, self.phone, 2)
+        Basket.objects.add_item(self.order, self.lamp, 3)
+        self.assertEqual(self.amounts(), (Decimal('3299.70'), 300, 0, Decimal('2999.70')))
+        self.assertAmountsMatchLines()
+
+        Basket.objects.remove_item(self.order, self.phone.pk, 2)
+        self.assertEqual(self.amounts(), (Decimal('1299.70'), 100, 200, Decimal('1399.70')))
+        Basket.objects.apply_changes(self.order, {self.phone.pk: self.phone, self.lamp.pk: self.lamp},
+                                     {self.phone.pk: -1, self.lamp.pk: 2})
+        self.assertEqual(self.amounts(), (Decimal('499.50'), 0, 200, Decimal('699.50')))
+        self.assertAmountsMatchLines()
+
+        Basket.objects.remove_item(self.order, self.lamp.pk, 5)
+        self.assertEqual(self.amounts(), (0, 0, 0, 0))
+
+    def test_price_change_is_applied_to_the_whole_line(self):
+        Basket.objects.add_item(self.order, self.phone, 2)
+        Item.objects.filter(pk=self.phone.pk).update(discount=50)
+        self.phone.refresh_from_db()
+
+        Basket.objects.add_item(self.order, self.phone, 1)
+
+        self.assertEqual(self.amounts(), (3000, 1500, 200, 1700))
+        self.assertAmountsMatchLines()
+
+    def test_basket_changes_do_not_aggregate(self):
+        Basket.objects.add_item(self.order, self.phone, 1)
+        with CaptureQueriesContext(connection) as queries:
+            Basket.objects.add_item(self.order, self.lamp, 1)
+            Basket.objects.remove_item(self.order, self.phone.pk, 1)
+
+        self.assertFalse([query for query in queries.captured_queries if 'SUM(' in query['sql'].upper()])
+
+    def test_express_delivery(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            DeliverySettings.objects.create(delivery_type='express', express_delivery_fee=500,
+                                            standard_delivery_fee=200, free_delivery_threshold=2000)
+        Basket.objects.add_item(self.order, self.phone, 3)
+        self.order.delivery_type = 'express'
+
+        pricing.update_delivery(self.order)
+
+        self.assertEqual(self.amounts(self.order), (3000, 300, 500, 3200))
+
+    def test_rules_are_loaded_once_until_changed(self):
+        pricing.get_rules()
+        with CaptureQueriesContext(connection) as queries:
+            rules = pricing.get_rules()
+            pricing.delivery_fee(self.order, 1000, 0)
+        self.assertEqual(len(queries.captured_queries), 0)
+        self.assertEqual(rules.delivery_rule('ordinary').standard_fee, 200)
+
+        settings = DeliverySettings.objects.get()
+        settings.standard_delivery_fee = 300
+        with self.captureOnCommitCallbacks(execute=True):
+            settings.save()
+
+        self.assertEqual(pricing.delivery_fee(self.order, 1000, 0), 300)
+        self.assertIsNone(pricing.get_rules().delivery_rule('express'))
+
+    def test_rules_expire_without_a_version_change(self):
+        # A change made by a worker whose version bump this process never sees.
+        pricing.get_rules()
+        DeliverySettings.objects.update(standard_delivery_fee=300)
+        self.assertEqual(pricing.delivery_fee(self.order, 1000, 0), 200)
+
+        with mock.patch('shopapp.pricing.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertEqual(pricing.delivery_fee(self.order, 1000, 0), 300)
+
+
+class OrderTransitionTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='buyer', password='secret')
+        self.item = Item.objects.create(name='Phone', description='Description', price=100, count=5)
+
+    def create_orders(self, statuses):
+        return Order.objects.bulk_create(Order(customer=self.user, total_amount=0, status=status) for status in statuses)
+
+    def test_bulk_archiving_updates_the_locked_orders(self):
+        orders = self.create_orders(['pending', 'payment', 'delivery', 'archived'] * 25)
+        Basket.objects.create(order=orders[0], item=self.item, quantity=2)
+        StockReservation.objects.reserve(orders[0], 60)
+
+        with CaptureQueriesContext(connection) as queries:
+            archived = Order.objects.all().transition('archived')
+
+        self.assertEqual(archived, 75)
+        order_updates = [query['sql'] for query in queries.captured_queries
+                         if query['sql'].startswith('UPDATE "shopapp_order"')]
+        self.assertEqual(len(order_updates), 1)
+        self.assertIn('"id" IN', order_updates[0])
+        self.assertFalse(Order.objects.exclude(status='archived').exists())
+        self.assertEqual(OrderEvent.objects.count(), 75)
+        self.assertEqual(OrderEvent.objects.filter(from_status='pending', to_status='archived').count(), 25)
+        self.assertEqual(Item.objects.get().count, 5)
+        self.assertEqual(StockReservation.objects.get().status, StockReservation.RELEASED)
+
+    def test_large_sets_move_in_batches(self):
+        self.create_orders(['pending', 'archived'] * 25)
+
+        with mock.patch('shopapp.models.TRANSITION_BATCH_SIZE', 10), \
+                CaptureQueriesContext(connection) as queries:
+            archived = Order.objects.all().transition('archived')
+
+        self.assertEqual(archived, 25)
+        order_updates = [query for query in queries.captured_queries
+                         if query['sql'].startswith('UPDATE "shopapp_order"')]
+        self.assertEqual(len(order_updates), 3)
+        self.assertFalse(Order.objects.exclude(status='archived').exists())
+        self.assertEqual(OrderEvent.objects.count(), 25)
+
+    def test_orders_that_cannot_move_are_left_alone(self):
+        self.create_orders(['pending', 'delivery', 'archived'])
+
+        self.assertEqual(Order.objects.all().transition('delivery'), 0)
+        self.assertEqual(sorted(Order.objects.values_list('status', flat=True)), ['archived', 'delivery', 'pending'])
+        self.assertFalse(OrderEvent.objects.exists())
+
+    def test_single_order(self):
+        order, = self.create_orders(['pending'])
+
+        order.transition('payment')
+        with self.assertRaises(InvalidTransition):
+            order.transition('pending')
+        stale = Order.objects.get()
+        order.transition('delivery')
+        with self.assertRaises(InvalidTransition):
+            stale.transition('delivery')
 
-# Create your tests here.
+        self.assertEqual(list(OrderEvent.objects.order_by('pk').values_list('from_status', 'to_status')),
+                         [('pending', 'payment'), ('payment', 'delivery')])